@@ -0,0 +1,169 @@
+"""
+Recall-vs-latency benchmark for the FAISS index types in ``build_index.py``.
+
+Generates a synthetic, clustered set of normalized vectors (the real corpus is
+far too small to tell the index types apart), builds every requested index
+type over it and reports, against the exact flat baseline:
+
+    build time, on-disk size, memory once loaded, p50/p99 single-query latency, recall@k
+
+Memory is measured the way the server holds the index: a fresh process loads
+the written file with ``load_index`` (mmapped when ``--mmap``, the server's
+default) and runs a few searches. The growth of its private memory (heap) and
+of its mapped file pages, which worker processes share through the OS page
+cache, is reported separately; for HNSW the graph links add heap on top of the
+vectors, and an mmapped index holds almost nothing privately. Figures come from
+``/proc/self/status`` (Linux); elsewhere only the peak RSS is available and is
+reported as heap.
+
+Usage:
+    python benchmark_index.py --n 100000
+    python benchmark_index.py --n 1000000 --types flat hnsw ivf_pq --nprobe 8 16 32
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Tuple
+
+import faiss
+import numpy as np
+
+from build_index import INDEX_TYPES, build_index, configure_search, load_index
+
+
+def synthetic_vectors(n: int, d: int, n_clusters: int = 256, seed: int = 42) -> np.ndarray:
+    """Normalized vectors drawn around random cluster centres (closer to real embeddings than pure noise)."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((n_clusters, d), dtype=np.float32)
+    vectors = np.empty((n, d), dtype=np.float32)
+    chunk = 100_000
+    for start in range(0, n, chunk):
+        stop = min(start + chunk, n)
+        labels = rng.integers(0, n_clusters, size=stop - start)
+        vectors[start:stop] = centres[labels] + 0.8 * rng.standard_normal((stop - start, d), dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def _memory_bytes() -> Tuple[int, int]:
+    """(private, file-backed) resident bytes of this process."""
+    try:
+        with open("/proc/self/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(fields["RssAnon"].split()[0]) * 1024, int(fields["RssFile"].split()[0]) * 1024
+    except (OSError, KeyError, ValueError):
+        # Peak RSS: kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if peak > 1 << 32 else peak * 1024, 0
+
+
+def _load_footprint(path: str, queries: np.ndarray, mmap: bool) -> Dict[str, int]:
+    """Runs in a fresh process: memory growth from loading the index and searching it."""
+    before = _memory_bytes()
+    index = load_index(path, mmap=mmap)
+    index.search(queries, 10)
+    after = _memory_bytes()
+    return {"heap": after[0] - before[0], "mapped": after[1] - before[1]}
+
+
+def index_footprint(index: faiss.Index, queries: np.ndarray, mmap: bool = True) -> Dict[str, int]:
+    """
+    On-disk size of the index and its memory once loaded in a fresh process (see the module
+    docstring). Written through a temp file so huge indexes are not copied in RAM.
+    """
+    fd, path = tempfile.mkstemp(suffix=".bin")
+    os.close(fd)
+    try:
+        faiss.write_index(index, path)
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            loaded = pool.submit(_load_footprint, path, queries, mmap).result()
+        return {"disk": os.path.getsize(path), **loaded}
+    finally:
+        os.remove(path)
+
+
+def measure(index: faiss.Index, queries: np.ndarray, k: int, ground_truth: np.ndarray) -> dict:
+    """Times one query at a time (the server's access pattern) and computes recall@k."""
+    latencies = np.empty(len(queries))
+    found = np.empty((len(queries), k), dtype=np.int64)
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        _, I = index.search(queries[i:i + 1], k)
+        latencies[i] = time.perf_counter() - start
+        found[i] = I[0]
+
+    hits = sum(len(np.intersect1d(found[i], ground_truth[i])) for i in range(len(queries)))
+    return {
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p99_ms": float(np.percentile(latencies, 99) * 1000),
+        "recall": hits / (len(queries) * k),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FAISS index types on synthetic vectors")
+    parser.add_argument("--n", type=int, default=100_000, help="Number of database vectors (default: 100000)")
+    parser.add_argument("--d", type=int, default=768, help="Dimension (default: 768, as all-mpnet-base-v2)")
+    parser.add_argument("--queries", type=int, default=1000, help="Number of queries (default: 1000)")
+    parser.add_argument("--k", type=int, default=10, help="Recall@k (default: 10)")
+    parser.add_argument("--types", nargs="+", choices=INDEX_TYPES, default=list(INDEX_TYPES))
+    parser.add_argument("--nprobe", nargs="+", type=int, default=[8, 32], help="IVF nprobe values to sweep")
+    parser.add_argument("--ef-search", nargs="+", type=int, default=[32, 128], help="HNSW efSearch values to sweep")
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--pq-m", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=None, help="FAISS OpenMP threads")
+    parser.add_argument("--no-mmap", dest="mmap", action="store_false",
+                        help="Measure memory with the index read into RAM (FAISS_MMAP=0)")
+    args = parser.parse_args()
+
+    if args.threads:
+        faiss.omp_set_num_threads(args.threads)
+
+    print(f"Generating {args.n} synthetic vectors (dim {args.d}) and {args.queries} queries...")
+    vectors = synthetic_vectors(args.n, args.d)
+    queries = synthetic_vectors(args.queries, args.d, seed=7)
+
+    flat = build_index(vectors, "flat")
+    _, ground_truth = flat.search(queries, args.k)
+
+    rows = []
+    for index_type in args.types:
+        start = time.time()
+        index = flat if index_type == "flat" else build_index(
+            vectors, index_type, hnsw_m=args.hnsw_m, nlist=args.nlist, pq_m=args.pq_m
+        )
+        build_s = time.time() - start
+        footprint = {k: v / 1e6 for k, v in index_footprint(index, queries[:100], mmap=args.mmap).items()}
+
+        if index_type == "hnsw":
+            settings = [("efSearch", v) for v in args.ef_search]
+        elif index_type in ("ivf_flat", "ivf_pq"):
+            settings = [("nprobe", v) for v in args.nprobe]
+        else:
+            settings = [("", None)]
+
+        for name, value in settings:
+            configure_search(index, nprobe=value if name == "nprobe" else None,
+                             ef_search=value if name == "efSearch" else None)
+            result = measure(index, queries, args.k, ground_truth)
+            label = f"{index_type} {name}={value}" if name else index_type
+            rows.append((label, build_s, footprint, result))
+
+    print(f"\nMemory: growth of a fresh process after loading the index "
+          f"({'mmapped' if args.mmap else 'read into RAM'}) and searching it")
+    print(f"\n{'index':<22}{'build s':>9}{'disk MB':>10}{'heap MB':>10}{'mapped MB':>11}"
+          f"{'p50 ms':>9}{'p99 ms':>9}{f'recall@{args.k}':>11}")
+    for label, build_s, mb, r in rows:
+        print(f"{label:<22}{build_s:>9.1f}{mb['disk']:>10.1f}{mb['heap']:>10.1f}{mb['mapped']:>11.1f}"
+              f"{r['p50_ms']:>9.3f}{r['p99_ms']:>9.3f}{r['recall']:>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
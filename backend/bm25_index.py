@@ -0,0 +1,168 @@
+"""
+Sparse lexical (BM25) index over the corpus ``content`` field.
+
+Dense mpnet embeddings match exact calculus notation poorly ("sin(x)/x",
+"Σ(1/n)", "integration by parts"), so the tokenizer keeps math symbols as
+their own tokens. Postings are stored in CSR form: ``indptr`` slices
+``doc_ids`` / ``weights`` per term, and each posting already holds its BM25
+contribution (document length normalization is fixed at build time), so a
+query is a few array slices and one ``bincount``. ``BM25Builder`` takes
+records one at a time (see corpus_indexes.py, which builds every index in
+one pass and stores the arrays for the workers to mmap).
+
+``rrf_fuse`` combines ranked lists (e.g. dense + BM25) with reciprocal rank
+fusion.
+"""
+
+import re
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Words/numbers, plus any single non-space symbol that isn't prose punctuation
+_TOKEN_RE = re.compile(r"[^\W_]+|[^\w\s.,;:!?'\"`]")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _document_text(item: Dict) -> str:
+    # Videos have no content; index their title instead
+    return item.get('content') or (item.get('metadata') or {}).get('title') or ''
+
+
+class BM25Builder:
+    """Accumulates term counts record by record (in FAISS row order), then builds the index."""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        """
+        Args:
+            k1: Term-frequency saturation
+            b: Document length normalization strength
+        """
+        self.k1 = k1
+        self.b = b
+        self.vocab: Dict[str, int] = {}
+        self.term_ids: List[int] = []
+        self.doc_ids: List[int] = []
+        self.tfs: List[int] = []
+        self.doc_lens: List[int] = []
+
+    def add(self, item: Dict):
+        row = len(self.doc_lens)
+        tokens = tokenize(_document_text(item))
+        self.doc_lens.append(len(tokens))
+        counts: Dict[int, int] = {}
+        for token in tokens:
+            tid = self.vocab.setdefault(token, len(self.vocab))
+            counts[tid] = counts.get(tid, 0) + 1
+        self.term_ids.extend(counts.keys())
+        self.doc_ids.extend([row] * len(counts))
+        self.tfs.extend(counts.values())
+
+    def build(self) -> "BM25Index":
+        k1, b = self.k1, self.b
+        n_docs = len(self.doc_lens)
+        n_terms = len(self.vocab)
+        term_ids = np.asarray(self.term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind="stable")
+
+        doc_ids = np.asarray(self.doc_ids, dtype=np.int32)[order]
+        tf = np.asarray(self.tfs, dtype=np.float32)[order]
+        df = np.bincount(term_ids, minlength=n_terms)
+        indptr = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(df, out=indptr[1:])
+
+        doc_len = np.asarray(self.doc_lens, dtype=np.float32)
+        avgdl = float(doc_len.mean()) if n_docs else 1.0
+        idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+        term_of_posting = np.repeat(np.arange(n_terms), df)
+        norm = k1 * (1 - b + b * doc_len[doc_ids] / max(avgdl, 1e-6))
+        weights = (idf[term_of_posting] * tf * (k1 + 1) / (tf + norm)).astype(np.float32)
+        return BM25Index(self.vocab, indptr, doc_ids, weights, n_docs)
+
+
+class BM25Index:
+    def __init__(self, vocab: Dict[str, int], indptr: np.ndarray, doc_ids: np.ndarray,
+                 weights: np.ndarray, n_docs: int):
+        """
+        Args:
+            vocab: Term -> term id
+            indptr: CSR offsets, postings of term t are ``[indptr[t], indptr[t + 1])``
+            doc_ids: Row id of every posting
+            weights: BM25 contribution of every posting
+            n_docs: Number of indexed records
+        """
+        self.vocab = vocab
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.n_docs = int(n_docs)
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict], k1: float = 1.2, b: float = 0.75) -> "BM25Index":
+        """Builds the index from metadata records in FAISS row order."""
+        builder = BM25Builder(k1, b)
+        for item in records:
+            builder.add(item)
+        return builder.build()
+
+    def state(self) -> Tuple[Dict[str, np.ndarray], Dict]:
+        """Arrays and JSON-serializable fields that ``from_state`` restores the index from."""
+        terms = sorted(self.vocab, key=self.vocab.get)
+        arrays = {"indptr": self.indptr, "doc_ids": self.doc_ids, "weights": self.weights}
+        return arrays, {"terms": terms, "n_docs": self.n_docs}
+
+    @classmethod
+    def from_state(cls, arrays: Dict[str, np.ndarray], fields: Dict) -> "BM25Index":
+        vocab = {term: tid for tid, term in enumerate(fields["terms"])}
+        return cls(vocab, arrays["indptr"], arrays["doc_ids"], arrays["weights"], fields["n_docs"])
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every document for the query."""
+        tids = [self.vocab[t] for t in set(tokenize(query)) if t in self.vocab]
+        if not tids:
+            return np.zeros(self.n_docs, dtype=np.float32)
+        slices = [slice(self.indptr[t], self.indptr[t + 1]) for t in tids]
+        docs = np.concatenate([self.doc_ids[s] for s in slices])
+        weights = np.concatenate([self.weights[s] for s in slices])
+        return np.bincount(docs, weights=weights, minlength=self.n_docs).astype(np.float32)
+
+    def search(self, query: str, limit: int, allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top ``limit`` documents with a positive score.
+
+        Args:
+            query: Query text
+            limit: Number of hits
+            allowed: Optional sorted row ids to restrict the search to (metadata filters)
+
+        Returns:
+            (ids, scores), best first
+        """
+        scores = self.scores(query)
+        candidates = allowed if allowed is not None else np.arange(self.n_docs)
+        candidates = candidates[scores[candidates] > 0]
+        if len(candidates) > limit:
+            top = np.argpartition(-scores[candidates], limit - 1)[:limit]
+            candidates = candidates[top]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return candidates.astype(np.int64), scores[candidates]
+
+
+def rrf_fuse(ranked_lists: Sequence[np.ndarray], limit: int, k: int = 60) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reciprocal rank fusion: each list contributes 1 / (k + rank) per document.
+
+    Returns:
+        (ids, fused scores), best first
+    """
+    fused: Dict[int, float] = {}
+    for ids in ranked_lists:
+        for rank, doc in enumerate(ids):
+            fused[int(doc)] = fused.get(int(doc), 0.0) + 1.0 / (k + rank + 1)
+    best = sorted(fused.items(), key=lambda kv: kv[1], reverse=True)[:limit]
+    return (np.asarray([d for d, _ in best], dtype=np.int64),
+            np.asarray([s for _, s in best], dtype=np.float32))
@@ -0,0 +1,167 @@
+"""
+Build the FAISS index from ``embeddings.npy``.
+
+Supports four index types, all using inner-product (cosine on the normalized
+mpnet embeddings) like the original flat index:
+
+    flat      exact search (IndexFlatIP), the baseline
+    hnsw      graph index (IndexHNSWFlat), fast and high recall, more memory
+    ivf_flat  inverted lists over full vectors (IndexIVFFlat)
+    ivf_pq    inverted lists over product-quantized codes (IndexIVFPQ), smallest
+
+The flat index is written to ``faiss_index.bin``; other types go to
+``faiss_index_<type>.bin`` so they can sit side by side. The server picks one
+with ``FAISS_INDEX_TYPE`` (and tunes it with ``FAISS_NPROBE`` /
+``FAISS_EF_SEARCH``).
+
+Usage:
+    python build_index.py --type hnsw --hnsw-m 32
+    python build_index.py --type ivf_pq --nlist 1024 --pq-m 64
+"""
+
+import argparse
+import math
+import os
+import time
+from typing import Optional, Tuple
+
+import faiss
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+EMBEDDINGS_PATH = os.path.join(BASE_DIR, "embeddings.npy")
+METADATA_PATH = os.path.join(BASE_DIR, "faiss_metadata.json")
+# Model that produced embeddings.npy; queries must be embedded with the same one
+EMBEDDING_MODEL = "sentence-transformers/all-mpnet-base-v2"
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+
+# k-means needs at least this many training points per centroid
+MIN_POINTS_PER_CENTROID = 39
+
+
+def index_path_for(index_type: str, base_dir: str = BASE_DIR) -> str:
+    """File name used for each index type."""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+    if index_type == "flat":
+        return os.path.join(base_dir, "faiss_index.bin")
+    return os.path.join(base_dir, f"faiss_index_{index_type}.bin")
+
+
+def default_nlist(n: int) -> int:
+    """~4*sqrt(n) inverted lists, capped so every centroid gets enough training points."""
+    return max(1, min(int(4 * math.sqrt(n)), n // MIN_POINTS_PER_CENTROID))
+
+
+def build_index(vectors: np.ndarray, index_type: str = "flat", hnsw_m: int = 32,
+                ef_construction: int = 200, nlist: Optional[int] = None,
+                pq_m: int = 64, pq_nbits: int = 8) -> faiss.Index:
+    """
+    Builds (and trains, if needed) an inner-product index over ``vectors``.
+
+    Args:
+        vectors: 2-D float array, one row per chunk (row i is metadata entry i)
+        index_type: One of ``INDEX_TYPES``
+        hnsw_m: HNSW neighbours per node
+        ef_construction: HNSW build-time beam width
+        nlist: Number of IVF lists (default: ``default_nlist(n)``)
+        pq_m: Number of PQ sub-quantizers (must divide the dimension)
+        pq_nbits: Bits per PQ code (reduced automatically for small corpora)
+
+    Returns:
+        The populated FAISS index
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, d = vectors.shape
+
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(d)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(d, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        nlist = nlist or default_nlist(n)
+        quantizer = faiss.IndexFlatIP(d)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, d, nlist, faiss.METRIC_INNER_PRODUCT)
+        else:
+            if d % pq_m != 0:
+                raise ValueError(f"pq_m={pq_m} must divide the dimension {d}")
+            # Each sub-quantizer trains 2^nbits centroids
+            max_nbits = int(math.log2(max(n // MIN_POINTS_PER_CENTROID, 2)))
+            pq_nbits = max(1, min(pq_nbits, max_nbits))
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, pq_m, pq_nbits, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+    else:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+
+    index.add(vectors)
+    return index
+
+
+def configure_search(index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """Applies search-time knobs for IVF (``nprobe``) and HNSW (``efSearch``) indexes."""
+    if nprobe and hasattr(index, "nprobe"):
+        index.nprobe = nprobe
+    if ef_search and hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search
+
+
+def search_settings() -> Tuple[str, int, int]:
+    """
+    Index type, nprobe and efSearch from ``FAISS_INDEX_TYPE`` / ``FAISS_NPROBE`` /
+    ``FAISS_EF_SEARCH``, so the server and offline scripts search the same way.
+    """
+    return (os.environ.get("FAISS_INDEX_TYPE", "flat"),
+            int(os.environ.get("FAISS_NPROBE", "16")),
+            int(os.environ.get("FAISS_EF_SEARCH", "128")))
+
+
+def load_index(path: str, mmap: bool = True) -> faiss.Index:
+    """
+    Reads an index, memory-mapping it when possible so several worker processes
+    share the pages through the OS cache instead of each holding a private copy.
+    Flat storage is mapped zero-copy where this FAISS build supports it; IVF
+    inverted lists use the regular mmap flag.
+    """
+    if mmap:
+        flag_sets = [faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0), faiss.IO_FLAG_MMAP]
+        for flags in flag_sets:
+            try:
+                return faiss.read_index(path, flags)
+            except RuntimeError:
+                continue
+    return faiss.read_index(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a FAISS index from embeddings.npy")
+    parser.add_argument("--type", choices=INDEX_TYPES, default="flat", help="Index type (default: flat)")
+    parser.add_argument("--embeddings", default=EMBEDDINGS_PATH, help="Input .npy file")
+    parser.add_argument("--out", default=None, help="Output path (default depends on --type)")
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--ef-construction", type=int, default=200)
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--pq-m", type=int, default=64)
+    parser.add_argument("--pq-nbits", type=int, default=8)
+    args = parser.parse_args()
+
+    vectors = np.load(args.embeddings)
+    print(f"Building '{args.type}' index over {vectors.shape[0]} vectors (dim {vectors.shape[1]})...")
+
+    start = time.time()
+    index = build_index(
+        vectors, args.type,
+        hnsw_m=args.hnsw_m, ef_construction=args.ef_construction,
+        nlist=args.nlist, pq_m=args.pq_m, pq_nbits=args.pq_nbits
+    )
+    out_path = args.out or index_path_for(args.type)
+    faiss.write_index(index, out_path)
+
+    print(f"Built in {time.time() - start:.1f}s")
+    print(f"Index saved to: {out_path} ({os.path.getsize(out_path) / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
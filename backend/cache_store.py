@@ -0,0 +1,273 @@
+"""
+Keyed cache store for generated content (quizzes, chapters), shared by the
+server and the pre-generation scripts.
+
+Entries live in SQLite in WAL mode: one row per (namespace, key) with the
+JSON-encoded value, so a lookup is a primary-key read and a write is a single
+atomic upsert instead of rewriting a whole JSON file. WAL lets the server keep
+reading while ``generate_quiz_cache.py`` writes from another process. Decoded
+values are also kept in an in-process LRU (the hot tier) together with the
+row's ``updated_at``. Each lookup re-reads ``updated_at`` (a primary-key read)
+and re-decodes the value if the row changed, so entries rewritten by another
+worker or by the pre-generation scripts are served at once, never a stale copy.
+
+Leases in the ``claims`` table let one process take on work for a key (e.g.
+re-rendering a stale chapter) while the other uvicorn workers skip it. A
+lease expires on its own if its holder dies.
+
+``open_store`` performs a one-time import of the legacy ``quiz_cache.json``.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DB_PATH = os.path.join(BASE_DIR, "cache.db")
+LEGACY_QUIZ_JSON = os.path.join(BASE_DIR, "quiz_cache.json")
+
+QUIZ_NAMESPACE = "quiz"
+CHAPTER_NAMESPACE = "chapter"
+
+
+def quiz_cache_key(topic: str, subtopic: str, difficulty: str, variant: int = 0) -> str:
+    """``topic|subtopic|difficulty`` for the first variant, ``...|v{n}`` for the others."""
+    key = f"{topic}|{subtopic}|{difficulty}"
+    return f"{key}|v{variant}" if variant else key
+
+
+def chapter_cache_key(topic: str, subtopic: str, difficulty: str) -> str:
+    return f"{topic}|{subtopic}|{difficulty}"
+
+
+def content_fingerprint(template: str, doc_ids: Iterable[Any]) -> str:
+    """
+    Version of generated content: a hash of the prompt template and the ids of the
+    retrieved context it was generated from. A cached entry with a different
+    fingerprint was generated from an older prompt or corpus.
+    """
+    digest = hashlib.sha1(template.encode("utf-8"))
+    for doc_id in doc_ids:
+        digest.update(b"\0" + str(doc_id).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS claims (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    until REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID;
+"""
+
+# Takes a lease unless another owner holds one that has not expired yet
+_CLAIM = """
+INSERT INTO claims (namespace, key, owner, until) VALUES (?, ?, ?, ?)
+ON CONFLICT(namespace, key) DO UPDATE SET owner = excluded.owner, until = excluded.until
+WHERE claims.until < ? OR claims.owner = excluded.owner
+"""
+
+
+class CacheStore:
+    def __init__(self, path: str = DEFAULT_DB_PATH, hot_entries: int = 512, busy_timeout: float = 10.0):
+        """
+        Args:
+            path: SQLite database file
+            hot_entries: Decoded values kept in memory (LRU)
+            busy_timeout: Seconds to wait for another writer's lock
+        """
+        self.path = path
+        self.hot_entries = max(0, int(hot_entries))
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._conns: List[sqlite3.Connection] = []
+        self._hot: "OrderedDict[Tuple[str, str], Tuple[Any, float]]" = OrderedDict()  # -> (value, updated_at)
+        self._lock = threading.Lock()
+        self.hot_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._owner = f"{os.getpid()}:{id(self)}"  # lease holder id
+
+        with self._conn() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections are not shareable across threads; keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    def _remember(self, hot_key: Tuple[str, str], value: Any, updated_at: float):
+        if not self.hot_entries:
+            return
+        with self._lock:
+            self._hot[hot_key] = (value, updated_at)
+            self._hot.move_to_end(hot_key)
+            while len(self._hot) > self.hot_entries:
+                self._hot.popitem(last=False)
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        """Returns the decoded value or None. Values may be shared; do not mutate them."""
+        hot_key = (namespace, key)
+        conn = self._conn()
+        with self._lock:
+            hot = self._hot.get(hot_key)
+        if hot is not None:
+            row = conn.execute(
+                "SELECT updated_at FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            if row is not None and row[0] == hot[1]:
+                with self._lock:
+                    if hot_key in self._hot:
+                        self._hot.move_to_end(hot_key)
+                    self.hot_hits += 1
+                return hot[0]
+            with self._lock:  # rewritten or deleted by another process
+                self._hot.pop(hot_key, None)
+            if row is None:
+                with self._lock:
+                    self.misses += 1
+                return None
+
+        row = conn.execute(
+            "SELECT value, updated_at FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        if row is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        value = json.loads(row[0])
+        with self._lock:
+            self.disk_hits += 1
+        self._remember(hot_key, value, row[1])
+        return value
+
+    def put(self, namespace: str, key: str, value: Any):
+        """Atomically inserts or replaces one entry."""
+        self.put_many(namespace, [(key, value)])
+
+    def put_many(self, namespace: str, items: Iterable[Tuple[str, Any]], replace: bool = True) -> int:
+        """
+        Writes several entries in one transaction.
+
+        Args:
+            namespace: Entry namespace
+            items: (key, value) pairs
+            replace: Overwrite existing keys; False keeps them (INSERT OR IGNORE)
+
+        Returns:
+            Number of rows written
+        """
+        now = time.time()
+        rows = [(namespace, key, json.dumps(value), now) for key, value in items]
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        conn = self._conn()
+        with conn:
+            cursor = conn.executemany(
+                f"{verb} INTO entries (namespace, key, value, updated_at) VALUES (?, ?, ?, ?)", rows
+            )
+        with self._lock:
+            self.writes += len(rows)
+            for namespace_, key, _, _ in rows:
+                self._hot.pop((namespace_, key), None)
+        return cursor.rowcount if cursor.rowcount >= 0 else len(rows)
+
+    def claim(self, namespace: str, key: str, seconds: float) -> bool:
+        """
+        Takes a lease on (namespace, key) for ``seconds``, shared by every process using
+        the database. Returns False if another process holds an unexpired lease.
+        """
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            cursor = conn.execute(_CLAIM, (namespace, key, self._owner, now + seconds, now))
+        return cursor.rowcount > 0
+
+    def release(self, namespace: str, key: str):
+        """Ends this process's lease early (no-op if another process holds it)."""
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM claims WHERE namespace = ? AND key = ? AND owner = ?",
+                         (namespace, key, self._owner))
+
+    def count(self, namespace: str) -> int:
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM entries WHERE namespace = ?", (namespace,)
+        ).fetchone()[0]
+
+    def migrate_json(self, namespace: str, json_path: str) -> int:
+        """
+        One-time import of a legacy ``{key: value}`` JSON cache. Existing keys win,
+        and the import is recorded so it is not repeated. Returns the rows imported.
+        """
+        marker = f"migrated:{namespace}:{os.path.abspath(json_path)}"
+        conn = self._conn()
+        if conn.execute("SELECT 1 FROM meta WHERE name = ?", (marker,)).fetchone():
+            return 0
+        if not os.path.exists(json_path):
+            return 0
+        try:
+            with open(json_path, 'r') as f:
+                legacy = json.load(f)
+        except Exception as e:
+            logger.warning(f"Could not read legacy cache {json_path}: {e}")
+            return 0
+
+        imported = self.put_many(namespace, legacy.items(), replace=False)
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (marker, str(time.time())))
+        logger.info(f"Migrated {imported} entries from {json_path} into {self.path}")
+        return imported
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hot_hits + self.disk_hits + self.misses
+            return {
+                "hot_entries": len(self._hot),
+                "hot_hits": self.hot_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hot_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "writes": self.writes,
+            }
+
+    def close(self):
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            conn.close()
+        self._local = threading.local()
+
+
+def open_store(path: Optional[str] = None, hot_entries: int = 512) -> CacheStore:
+    """Opens the shared store and imports the legacy quiz_cache.json on first use."""
+    store = CacheStore(path or DEFAULT_DB_PATH, hot_entries=hot_entries)
+    store.migrate_json(QUIZ_NAMESPACE, LEGACY_QUIZ_JSON)
+    return store
@@ -0,0 +1,148 @@
+"""
+Server-side chat sessions for multi-turn ``/api/chat`` with Ollama.
+
+A one-shot ``/api/generate`` prompt makes Ollama re-evaluate the whole
+system text, context and conversation on every turn. A session keeps the
+messages of a conversation instead: a fixed system message (tutor
+instructions plus the student's profile), then every turn appended in
+order. Only the newest user message carries the context retrieved for it;
+a session records the bare question, so old context doesn't pile up in the
+window. Earlier messages never change, so with ``keep_alive`` the model
+stays loaded, and Ollama reuses the KV cache for the shared prefix. Only
+the newly appended turn needs prompt evaluation.
+
+Sessions are kept in memory (LRU, with an idle TTL). Once a session exceeds
+``max_messages`` or ``max_tokens`` (estimated), its oldest turns are dropped
+in one step, down to half of either limit. That breaks the cached prefix
+once, instead of on every turn as a sliding window would. A session whose
+system message changes (e.g. the profile was updated) starts over, and so
+does one the caller asks to start ``fresh``. A client history that
+disagrees with the session replaces it (see ``sync``).
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List
+
+from context_builder import estimate_tokens
+
+
+class ChatSession:
+    __slots__ = ("key", "system", "messages", "last_used", "turns")
+
+    def __init__(self, key: str, system: str):
+        self.key = key
+        self.system = system
+        self.messages: List[Dict[str, str]] = []
+        self.last_used = time.monotonic()
+        self.turns = 0
+
+
+class ChatSessionStore:
+    def __init__(self, max_sessions: int = 10_000, ttl_seconds: float = 1800, max_messages: int = 40,
+                 max_tokens: int = 0):
+        """
+        Args:
+            max_sessions: Sessions kept in memory (LRU eviction beyond it)
+            ttl_seconds: Idle time after which a session is forgotten; 0 disables expiry
+            max_messages: User/assistant messages kept per session before the oldest half is dropped
+            max_tokens: Estimated tokens of those messages allowed before the same trim
+                (keeps the conversation inside Ollama's num_ctx); 0 disables the limit
+        """
+        self.max_sessions = max(1, int(max_sessions))
+        self.ttl = float(ttl_seconds)
+        self.max_messages = max(2, int(max_messages))
+        self.max_tokens = max(0, int(max_tokens))
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.resets = 0
+        self.trims = 0
+        self.syncs = 0
+
+    def _expired(self, session: ChatSession, now: float) -> bool:
+        return self.ttl > 0 and now - session.last_used > self.ttl
+
+    def get(self, key: str, system: str, fresh: bool = False) -> ChatSession:
+        """
+        The live session for ``key``, started fresh if it is new, expired, has another
+        system message, or ``fresh`` is set (the client began a new conversation).
+        """
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None and (self._expired(session, now) or session.system != system
+                                        or (fresh and session.messages)):
+                if session.system != system or fresh:
+                    self.resets += 1
+                session = None
+            if session is None:
+                session = ChatSession(key, system)
+                self.created += 1
+            self._sessions[key] = session
+            self._sessions.move_to_end(key)
+            session.last_used = now
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return session
+
+    def messages(self, session: ChatSession, user_message: str) -> List[Dict[str, str]]:
+        """Messages to send for a new turn: system, the session so far, then the new user message."""
+        with self._lock:
+            history = list(session.messages)
+        return ([{"role": "system", "content": session.system}] + history
+                + [{"role": "user", "content": user_message}])
+
+    def _trimmed(self, messages: List[Dict[str, str]], limit: float = 1.0) -> List[Dict[str, str]]:
+        """The newest whole user/assistant pairs within ``limit`` times the message and token caps."""
+        max_messages = int(self.max_messages * limit) & ~1
+        max_tokens = self.max_tokens * limit
+        keep, tokens = 0, 0
+        for i in range(len(messages) - 2, -1, -2):
+            tokens += sum(estimate_tokens(m.get("content") or "") for m in messages[i:i + 2])
+            if keep + 2 > max_messages or (self.max_tokens and tokens > max_tokens):
+                break
+            keep += 2
+        return messages[len(messages) - keep:] if keep else []
+
+    def sync(self, session: ChatSession, history: List[Dict[str, str]]):
+        """
+        Reconciles a session with the client's history. The session is kept while its
+        messages are the tail of the history (it may have trimmed the start); otherwise
+        (server restart, eviction, messages edited or deleted on the client) the history
+        replaces them.
+        """
+        history = list(history)
+        with self._lock:
+            kept = len(session.messages)
+            if kept and kept <= len(history) and history[-kept:] == session.messages:
+                return
+            if kept:
+                self.syncs += 1
+            session.messages = self._trimmed(history)
+
+    def append(self, session: ChatSession, user_message: str, reply: str):
+        """Records a completed turn."""
+        with self._lock:
+            session.messages.append({"role": "user", "content": user_message})
+            session.messages.append({"role": "assistant", "content": reply})
+            session.turns += 1
+            session.last_used = time.monotonic()
+            if len(self._trimmed(session.messages)) < len(session.messages):
+                session.messages = self._trimmed(session.messages, 0.5)
+                self.trims += 1
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "created": self.created,
+                "resets": self.resets,
+                "trims": self.trims,
+                "syncs": self.syncs,
+            }
@@ -0,0 +1,182 @@
+"""
+Context assembly for RAG prompts.
+
+Sits between retrieval and the prompt templates. Prompt evaluation on a
+CPU-hosted model grows with every input token, so the retrieved chunks are
+compacted before they are pasted into a prompt:
+
+1. Clean: strip citation boilerplate left in the corpus (the
+   ``:contentReference[oaicite:N]{index=N}`` markers) and collapse runs of
+   whitespace.
+2. Dedupe: drop a chunk whose embedding is within ``dedupe_threshold`` cosine
+   similarity of a more relevant chunk already kept, provided the two also
+   share most of their words (``overlap_threshold``, Jaccard). Short chunks
+   that differ in one key word ("left endpoints" / "right endpoints") embed
+   almost identically but are not duplicates. Chunks whose text is identical
+   after cleaning are dropped even without embeddings (builds that had none
+   are counted in ``builds_without_vectors``).
+3. Pack: keep chunks in relevance order while they fit in ``token_budget``.
+   The most relevant chunk is always kept, truncated if it alone is too long.
+
+Token counts are estimates (about four characters per token). Each build
+reports how many context tokens the stages saved.
+"""
+
+import logging
+import math
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+_CONTENT_REFERENCE = re.compile(r"\s*:contentReference\[oaicite:\d+\]\{index=\d+\}")
+_SPACES = re.compile(r"[ \t]+")
+_BLANK_LINES = re.compile(r"\n\s*\n+")
+_WORDS = re.compile(r"\w+")
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4
+
+
+def clean_text(text: Optional[str]) -> str:
+    """Removes corpus citation markers and redundant whitespace."""
+    if not text:
+        return ""
+    text = _CONTENT_REFERENCE.sub("", text)
+    text = _SPACES.sub(" ", text)
+    return _BLANK_LINES.sub("\n", text).strip()
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def _word_overlap(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+class ContextBuilder:
+    def __init__(self, token_budget: int = 1200, dedupe_threshold: float = 0.95,
+                 overlap_threshold: float = 0.8,
+                 vector_fn: Optional[Callable[[Sequence[Dict[str, Any]]], Optional[np.ndarray]]] = None):
+        """
+        Args:
+            token_budget: Maximum estimated tokens of context per prompt; 0 disables packing
+            dedupe_threshold: Cosine similarity above which a chunk counts as a near-duplicate
+            overlap_threshold: Word-set overlap a near-duplicate must also reach
+            vector_fn: Returns the stored (normalized) embeddings of the docs, one row per doc,
+                or None when they are unavailable (only exact duplicates are dropped then)
+        """
+        self.token_budget = max(0, int(token_budget))
+        self.dedupe_threshold = dedupe_threshold
+        self.overlap_threshold = overlap_threshold
+        self.vector_fn = vector_fn
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.duplicates = 0
+        self.over_budget = 0
+        self.without_vectors = 0
+        self._vector_error_logged = False
+
+    def _vectors(self, docs: Sequence[Dict[str, Any]]) -> Optional[np.ndarray]:
+        if self.vector_fn is None or len(docs) < 2:
+            return None
+        try:
+            vectors = self.vector_fn(docs)
+        except Exception as e:
+            vectors = None
+            if not self._vector_error_logged:
+                self._vector_error_logged = True
+                logger.warning(f"Embeddings for context dedupe unavailable, dropping exact duplicates only: {e}")
+        if vectors is None:
+            with self._lock:
+                self.without_vectors += 1
+            return None
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def build(self, docs: Sequence[Dict[str, Any]], fixed_tokens: int = 0) -> Dict[str, Any]:
+        """
+        Selects and cleans the chunks to paste into a prompt.
+
+        Args:
+            docs: Retrieved docs, most relevant first
+            fixed_tokens: Tokens of per-doc framing (e.g. "Source: ..." lines) counted against
+                the budget for every kept doc
+
+        Returns:
+            Dict with the kept ``docs`` (copies with cleaned ``content``), and the estimated
+            ``input_tokens``, ``context_tokens``, ``tokens_saved``, ``duplicates`` and
+            ``over_budget`` for this build
+        """
+        raw_tokens = sum(estimate_tokens(d.get('content') or '') + fixed_tokens for d in docs)
+        vectors = self._vectors(docs)
+
+        kept: List[Dict[str, Any]] = []
+        kept_rows: List[int] = []
+        kept_words: List[set] = []
+        seen_texts = set()
+        used = 0
+        duplicates = over_budget = 0
+        for i, doc in enumerate(docs):
+            content = clean_text(doc.get('content'))
+            if not content:
+                continue
+            if content in seen_texts:
+                duplicates += 1
+                continue
+            words = set(_WORDS.findall(content.lower()))
+            if vectors is not None and kept_rows:
+                similar = vectors[kept_rows] @ vectors[i] >= self.dedupe_threshold
+                if any(_word_overlap(words, kept_words[k]) >= self.overlap_threshold
+                       for k in np.flatnonzero(similar)):
+                    duplicates += 1
+                    continue
+
+            tokens = estimate_tokens(content) + fixed_tokens
+            if self.token_budget and used + tokens > self.token_budget:
+                if kept:
+                    over_budget += 1
+                    continue
+                # Never send an empty context: cut the best chunk down to the budget
+                content = content[:max(0, self.token_budget - fixed_tokens) * CHARS_PER_TOKEN]
+                tokens = estimate_tokens(content) + fixed_tokens
+
+            seen_texts.add(content)
+            kept.append({**doc, 'content': content})
+            kept_rows.append(i)
+            kept_words.append(words)
+            used += tokens
+
+        with self._lock:
+            self.builds += 1
+            self.input_tokens += raw_tokens
+            self.output_tokens += used
+            self.duplicates += duplicates
+            self.over_budget += over_budget
+        return {
+            "docs": kept,
+            "input_tokens": raw_tokens,
+            "context_tokens": used,
+            "tokens_saved": raw_tokens - used,
+            "duplicates": duplicates,
+            "over_budget": over_budget,
+        }
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "builds": self.builds,
+                "token_budget": self.token_budget,
+                "input_tokens": self.input_tokens,
+                "context_tokens": self.output_tokens,
+                "tokens_saved": self.input_tokens - self.output_tokens,
+                "duplicates_dropped": self.duplicates,
+                "over_budget_dropped": self.over_budget,
+                "builds_without_vectors": self.without_vectors,
+            }
@@ -0,0 +1,149 @@
+"""
+Search indexes derived from the metadata store, built once and shared.
+
+The topic index, the metadata filter index, BM25 and the corpus id -> row map
+are all built in a single pass over the records, right after the metadata
+store itself is (re)built, and written next to it (``faiss_metadata.idx``):
+
+    header   magic, JSON length
+    JSON     source signature, per-index fields (vocabulary, value lists,
+             corpus ids) and the name, dtype, shape and offset of every array
+    arrays   the posting arrays, 64-byte aligned
+
+Workers mmap the file read-only, so the posting arrays are shared through the
+OS page cache instead of being rebuilt in every worker's private heap; only
+the small value lists are decoded. The file is rebuilt whenever the metadata
+store it was built from changes.
+"""
+
+import json
+import mmap
+import os
+import struct
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from bm25_index import BM25Builder, BM25Index
+from metadata_store import MetadataStore
+from search_filters import FilterBuilder, FilterIndex
+from topic_index import TopicBuilder, TopicIndex
+
+MAGIC = b"CMIDX001"
+# magic, JSON header length
+HEADER = struct.Struct("<8sQ")
+ALIGN = 64
+
+# Index name in the file -> class restoring it
+_INDEXES = {"topics": TopicIndex, "filters": FilterIndex, "bm25": BM25Index}
+
+
+def _signature(store: MetadataStore):
+    return [len(store), store.source_size, store.source_mtime_ns]
+
+
+class CorpusIndexes:
+    def __init__(self, topics: TopicIndex, filters: FilterIndex, bm25: BM25Index, doc_rows: Dict[str, int]):
+        self.topics = topics
+        self.filters = filters
+        self.bm25 = bm25
+        self.doc_rows = doc_rows
+        self._mm: Optional[mmap.mmap] = None
+
+    @classmethod
+    def build(cls, store: MetadataStore) -> "CorpusIndexes":
+        """All indexes from one pass over the records (each is decoded once)."""
+        builders = (TopicBuilder(), FilterBuilder(), BM25Builder())
+        ids = []
+        for item in store:
+            for builder in builders:
+                builder.add(item)
+            ids.append(item.get('id'))
+        topics, filters, bm25 = (builder.build() for builder in builders)
+        return cls(topics, filters, bm25, {doc_id: row for row, doc_id in enumerate(ids)})
+
+    def save(self, path: str, store: MetadataStore):
+        """Writes the indexes for ``store`` to ``path`` (atomically)."""
+        fields = {"source": _signature(store), "arrays": {}, "indexes": {}}
+        # Corpus id per row (a repeated id keeps its last row, like the map itself)
+        doc_ids = [None] * len(store)
+        for doc_id, row in self.doc_rows.items():
+            doc_ids[row] = doc_id
+        fields["doc_ids"] = doc_ids
+        blobs = []
+        offset = 0
+        for name, index in (("topics", self.topics), ("filters", self.filters), ("bm25", self.bm25)):
+            arrays, index_fields = index.state()
+            fields["indexes"][name] = index_fields
+            for key, array in arrays.items():
+                array = np.ascontiguousarray(array)
+                offset = -(-offset // ALIGN) * ALIGN
+                fields["arrays"][f"{name}/{key}"] = [array.dtype.str, list(array.shape), offset]
+                blobs.append((offset, array))
+                offset += array.nbytes
+        header = json.dumps(fields, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        data_start = -(-(HEADER.size + len(header)) // ALIGN) * ALIGN
+
+        # Unique temp name so concurrent workers never write the same file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(header)))
+            f.write(header)
+            for blob_offset, array in blobs:
+                f.seek(data_start + blob_offset)
+                f.write(array.tobytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, store: Optional[MetadataStore] = None) -> Optional["CorpusIndexes"]:
+        """
+        Maps the indexes saved at ``path``; None if the file is missing, unreadable or
+        was built from another version of ``store``.
+        """
+        try:
+            with open(path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        try:
+            magic, length = HEADER.unpack_from(mm, 0)
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a corpus index file")
+            fields = json.loads(mm[HEADER.size:HEADER.size + length])
+            if store is not None and fields["source"] != _signature(store):
+                raise ValueError(f"{path} was built from another metadata file")
+        except (ValueError, KeyError, struct.error):
+            mm.close()
+            return None
+
+        data_start = -(-(HEADER.size + length) // ALIGN) * ALIGN
+        arrays: Dict[str, Dict[str, np.ndarray]] = {name: {} for name in _INDEXES}
+        for full_name, (dtype, shape, offset) in fields["arrays"].items():
+            name, key = full_name.split("/", 1)
+            count = int(np.prod(shape))
+            if count == 0:
+                arrays[name][key] = np.empty(shape, dtype=np.dtype(dtype))
+                continue
+            arrays[name][key] = np.frombuffer(mm, dtype=np.dtype(dtype), count=count,
+                                              offset=data_start + offset).reshape(shape)
+        indexes = {name: index_cls.from_state(arrays[name], fields["indexes"][name])
+                   for name, index_cls in _INDEXES.items()}
+        loaded = cls(indexes["topics"], indexes["filters"], indexes["bm25"],
+                     {doc_id: row for row, doc_id in enumerate(fields["doc_ids"]) if doc_id is not None})
+        # The arrays point into the mapping, which stays open as long as they are alive
+        loaded._mm = mm
+        return loaded
+
+    @classmethod
+    def open_for(cls, store: MetadataStore, path: Optional[str] = None) -> Tuple["CorpusIndexes", bool]:
+        """
+        The indexes for ``store``, mapped from the saved file, or built (and saved) if it is
+        missing or stale. Returns (indexes, whether they were rebuilt).
+        """
+        path = path or os.path.splitext(store.path)[0] + ".idx"
+        loaded = cls.load(path, store)
+        if loaded is not None:
+            return loaded, False
+        built = cls.build(store)
+        built.save(path, store)
+        return cls.load(path, store) or built, True
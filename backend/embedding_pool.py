@@ -0,0 +1,354 @@
+"""
+Process pool for query embeddings.
+
+The API process pins OMP/MKL to one thread (see server.py), so an in-process
+model encodes on a single core. ``EmbeddingPool`` starts ``workers`` processes
+instead (spawned, so no torch state is forked). Each one loads its own copy of
+the model with ``threads`` intra-op threads, and torch never has to be
+imported in the API process. A worker that crashes fails only its in-flight
+batch and is restarted.
+
+Batches are dispatched round-robin. Each worker owns a shared-memory block
+with ``slots`` result slots of ``max_batch_size`` rows. The worker writes the
+vectors straight into its slot and sends back only a task id, so the
+vectors are never pickled. The caller copies its rows out and frees the slot.
+
+The pool mimics the parts of ``SentenceTransformer`` the server uses
+(``encode`` and ``get_sentence_embedding_dimension``), and its ``encode`` is
+thread-safe. It plugs into ``EmbeddingBatcher`` with ``max_in_flight`` set to
+``workers * slots``, so several batches encode at once.
+"""
+
+import itertools
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def load_sentence_transformer(model_name: str):
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name, device="cpu")
+
+
+def _worker_main(model_name: str, factory: Callable, threads: int, tasks, results):
+    """Worker process: load the model, then encode batches into the shared slots."""
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+    try:
+        model = factory(model_name)
+        results.put(("ready", int(model.get_sentence_embedding_dimension())))
+    except Exception as e:
+        results.put(("failed", repr(e)))
+        return
+
+    shm, slots = None, None
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        if task[0] == "attach":
+            _, name, shape = task
+            # Spawned children share the parent's resource tracker, so the parent's unlink
+            # on stop also covers this attachment
+            shm = shared_memory.SharedMemory(name=name)
+            slots = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+            continue
+
+        _, task_id, slot, texts = task
+        try:
+            vectors = model.encode(texts, batch_size=len(texts), show_progress_bar=False)
+            slots[slot, :len(texts)] = vectors
+            results.put(("done", task_id, None))
+        except Exception as e:
+            results.put(("done", task_id, repr(e)))
+
+    if shm is not None:
+        del slots
+        shm.close()
+
+
+class _Worker:
+    """Parent-side handle of one worker process and its result slots."""
+
+    def __init__(self, worker_id: int, slots: int):
+        self.id = worker_id
+        self.process = None
+        self.tasks = None
+        self.results = None
+        self.shm: Optional[shared_memory.SharedMemory] = None
+        self.buffer: Optional[np.ndarray] = None
+        self.free: "queue.Queue[int]" = queue.Queue()
+        for slot in range(slots):
+            self.free.put(slot)
+        self.pending: Dict[int, Future] = {}  # task id -> future
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.error: Optional[str] = None
+        self.collector: Optional[threading.Thread] = None
+        self.restarts = 0
+
+
+class EmbeddingPool:
+    def __init__(self, model_name: str, workers: int = 2, threads: Optional[int] = None,
+                 max_batch_size: int = 32, slots: int = 2,
+                 factory: Callable = load_sentence_transformer, start_timeout: float = 600.0,
+                 encode_timeout: float = 60.0):
+        """
+        Args:
+            model_name: Model each worker loads
+            workers: Number of worker processes
+            threads: Intra-op threads per worker (default: cores / workers)
+            max_batch_size: Rows per result slot; larger encodes are split
+            slots: Batches that can be queued on one worker at a time
+            factory: Top-level (picklable) callable loading the model by name
+            start_timeout: Seconds to wait for the workers to load the model
+            encode_timeout: Seconds to wait for one batch before failing it
+        """
+        self.model_name = model_name
+        self.n_workers = max(1, int(workers))
+        self.threads = max(1, int(threads or (os.cpu_count() or 1) // self.n_workers))
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.n_slots = max(1, int(slots))
+        self.factory = factory
+        self.start_timeout = start_timeout
+        self.encode_timeout = encode_timeout
+        self.dim: Optional[int] = None
+        self._ctx = mp.get_context("spawn")
+        self._workers = [_Worker(i, self.n_slots) for i in range(self.n_workers)]
+        self._next = itertools.count()
+        self._task_ids = itertools.count()
+        self._stopping = threading.Event()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.failures = 0
+
+    @property
+    def max_in_flight(self) -> int:
+        return self.n_workers * self.n_slots
+
+    def _spawn(self, worker: _Worker):
+        worker.ready.clear()
+        worker.error = None
+        worker.tasks = self._ctx.Queue()
+        worker.results = self._ctx.Queue()
+        worker.process = self._ctx.Process(
+            target=_worker_main,
+            args=(self.model_name, self.factory, self.threads, worker.tasks, worker.results),
+            name=f"embedding-worker-{worker.id}",
+            daemon=True
+        )
+        worker.process.start()
+
+    def start(self):
+        """Starts the workers and waits until every one has loaded the model."""
+        self._stopping.clear()
+        for worker in self._workers:
+            self._spawn(worker)
+            worker.collector = threading.Thread(target=self._collect, args=(worker,),
+                                                name=f"embedding-pool-{worker.id}", daemon=True)
+            worker.collector.start()
+        for worker in self._workers:
+            if not worker.ready.wait(self.start_timeout) or worker.error:
+                self.stop()
+                raise RuntimeError(f"Embedding worker {worker.id} failed to start: "
+                                   f"{worker.error or 'timed out'}")
+        logger.info(f"Embedding pool ready: {self.n_workers} workers x {self.threads} threads, dim {self.dim}")
+
+    def _attach(self, worker: _Worker, dim: int):
+        if self.dim is None:
+            self.dim = dim
+        elif dim != self.dim:
+            raise RuntimeError(f"Worker {worker.id} reports dim {dim}, expected {self.dim}")
+        shape = (self.n_slots, self.max_batch_size, dim)
+        if worker.shm is None:
+            worker.shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 4)
+            worker.buffer = np.ndarray(shape, dtype=np.float32, buffer=worker.shm.buf)
+        worker.tasks.put(("attach", worker.shm.name, shape))
+
+    def _fail_pending(self, worker: _Worker, reason: str):
+        with worker.lock:
+            pending, worker.pending = worker.pending, {}
+        self._fail(pending, reason)
+
+    @staticmethod
+    def _fail(pending: Dict[int, Future], reason: str):
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(RuntimeError(reason))
+
+    def _collect(self, worker: _Worker):
+        """Resolves the worker's batches; restarts the worker if its process dies."""
+        while not self._stopping.is_set():
+            try:
+                message = worker.results.get(timeout=0.5)
+            except queue.Empty:
+                if worker.process.is_alive() or self._stopping.is_set():
+                    continue
+                code = worker.process.exitcode
+                if not worker.ready.is_set():
+                    worker.error = worker.error or f"exited with code {code}"
+                    worker.ready.set()
+                    return
+                logger.error(f"Embedding worker {worker.id} died (exit code {code}); restarting")
+                # Under the lock, so no batch is sent to the dead process's queue after its
+                # pending batches were failed; senders wait for the new process to be ready
+                with worker.lock:
+                    worker.ready.clear()
+                    pending, worker.pending = worker.pending, {}
+                    worker.restarts += 1
+                    self._spawn(worker)
+                self._fail(pending, f"Embedding worker {worker.id} died")
+                continue
+            except (EOFError, OSError):
+                return
+
+            kind = message[0]
+            if kind == "ready":
+                try:
+                    self._attach(worker, message[1])
+                except Exception as e:
+                    worker.error = str(e)
+                worker.ready.set()
+            elif kind == "failed":
+                worker.error = message[1]
+                worker.ready.set()
+                return
+            elif kind == "done":
+                _, task_id, error = message
+                with worker.lock:
+                    future = worker.pending.pop(task_id, None)
+                if future is None or future.done():
+                    continue  # the caller timed out
+                if error:
+                    future.set_exception(RuntimeError(f"Embedding worker {worker.id}: {error}"))
+                else:
+                    future.set_result(task_id)
+
+    def _encode_chunk(self, texts: List[str]) -> np.ndarray:
+        worker = self._workers[next(self._next) % self.n_workers]
+        slot = worker.free.get()
+        task_id = next(self._task_ids)
+        future: Future = Future()
+        try:
+            while True:
+                if not worker.ready.wait(self.start_timeout) or worker.error:
+                    raise RuntimeError(f"Embedding worker {worker.id} unavailable")
+                with worker.lock:
+                    if worker.ready.is_set():  # not restarted since the wait
+                        worker.pending[task_id] = future
+                        worker.tasks.put(("encode", task_id, slot, texts))
+                        break
+            try:
+                future.result(timeout=self.encode_timeout)
+            except TimeoutError:
+                with worker.lock:
+                    worker.pending.pop(task_id, None)
+                raise RuntimeError(f"Embedding worker {worker.id} timed out after {self.encode_timeout:.0f}s")
+            # Tasks run in order per worker, so a timed-out batch that later writes this slot
+            # finishes before the next batch using the slot starts
+            vectors = worker.buffer[slot, :len(texts)].copy()
+        except Exception:
+            with self._stats_lock:
+                self.failures += 1
+            raise
+        finally:
+            worker.free.put(slot)
+        with self._stats_lock:
+            self.batches += 1
+        return vectors
+
+    def encode(self, texts, batch_size: Optional[int] = None, show_progress_bar: bool = False,
+               **kwargs) -> np.ndarray:
+        """
+        Embeds a text or a list of texts (thread-safe).
+
+        Args:
+            texts: A string or a sequence of strings
+            batch_size: Ignored (chunks are at most max_batch_size)
+            show_progress_bar: Ignored
+
+        Returns:
+            (len(texts), dim) float32 array, or (dim,) for a single string
+        """
+        if isinstance(texts, str):
+            return self.encode([texts])[0]
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        chunks = [texts[i:i + self.max_batch_size] for i in range(0, len(texts), self.max_batch_size)]
+        if len(chunks) == 1:
+            return self._encode_chunk(chunks[0])
+        # Spread large inputs over the workers
+        results: List[Optional[np.ndarray]] = [None] * len(chunks)
+        errors = []
+
+        def run(i):
+            try:
+                results[i] = self._encode_chunk(chunks[i])
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(len(chunks))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return np.concatenate(results)
+
+    def get_sentence_embedding_dimension(self) -> Optional[int]:
+        return self.dim
+
+    def stop(self, timeout: float = 5.0):
+        """Stops the workers, failing queued batches, and releases the shared memory."""
+        self._stopping.set()
+        for worker in self._workers:
+            if worker.process is None:
+                continue
+            try:
+                worker.tasks.put(None)
+            except Exception:
+                pass
+        for worker in self._workers:
+            if worker.process is not None:
+                worker.process.join(timeout)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+                    worker.process.join(timeout)
+            if worker.collector is not None:
+                worker.collector.join(timeout)
+                worker.collector = None
+            self._fail_pending(worker, "Embedding pool stopped")
+            if worker.shm is not None:
+                worker.buffer = None
+                worker.shm.close()
+                worker.shm.unlink()
+                worker.shm = None
+            worker.process = None
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return {
+                "workers": self.n_workers,
+                "threads_per_worker": self.threads,
+                "alive": sum(1 for w in self._workers if w.process is not None and w.process.is_alive()),
+                "restarts": sum(w.restarts for w in self._workers),
+                "batches": self.batches,
+                "failures": self.failures,
+            }
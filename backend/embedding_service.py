@@ -0,0 +1,167 @@
+"""
+Micro-batching embedding service.
+
+Concurrent callers enqueue query strings; a dedicated worker thread drains the
+queue, coalesces up to ``max_batch_size`` texts (waiting at most ``max_wait_ms``
+for stragglers) into a single encode call and resolves each caller's future
+with its own vector. Async handlers await the future without blocking the
+event loop.
+
+With ``max_in_flight`` > 1 (e.g. an ``EmbeddingPool`` with several worker
+processes behind ``encode_fn``), the next batch is collected while earlier
+ones are still encoding, up to that many batches at once.
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class EmbeddingBatcher:
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray],
+                 max_batch_size: int = 32, max_wait_ms: float = 5.0, max_in_flight: int = 1):
+        """
+        Args:
+            encode_fn: Callable that embeds a list of texts into a 2-D array
+                (one row per text), e.g. a wrapped ``SentenceTransformer.encode``
+            max_batch_size: Maximum number of texts per encode call
+            max_wait_ms: How long the worker waits for more requests after the
+                first one arrives before encoding a partial batch
+            max_in_flight: Batches encoded concurrently; encode_fn must be
+                thread-safe when this is above 1
+        """
+        self.encode_fn = encode_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue: "queue.Queue" = queue.Queue()
+        self.max_in_flight = max(1, int(max_in_flight))
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+
+    def start(self):
+        """Starts the worker thread (idempotent)."""
+        if self._thread and self._thread.is_alive():
+            return
+        if self.max_in_flight > 1:
+            self._executor = ThreadPoolExecutor(self.max_in_flight, thread_name_prefix="embedding-batch")
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Stops the worker thread; requests still queued are failed."""
+        if not self._thread:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP and item[1].set_running_or_notify_cancel():
+                item[1].set_exception(RuntimeError("Embedding service stopped"))
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def submit(self, text: str) -> Future:
+        """Queues a text for embedding and returns a future for its vector."""
+        if not self.running:
+            raise RuntimeError("Embedding service is not running")
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def encode(self, text: str, timeout: Optional[float] = None) -> np.ndarray:
+        """Blocking embed of a single text (for sync callers / threadpool)."""
+        return self.submit(text).result(timeout)
+
+    async def encode_async(self, text: str) -> np.ndarray:
+        """Embeds a single text without blocking the event loop."""
+        return await asyncio.wrap_future(self.submit(text))
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return {
+                "requests": self.requests,
+                "batches": self.batches,
+                "avg_batch_size": self.requests / self.batches if self.batches else 0.0,
+                "queued": self._queue.qsize(),
+            }
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        item = self._queue.get(timeout=remaining)
+                    else:
+                        item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            if self._executor is None:
+                self._process(batch)
+                continue
+            # Wait for a free slot; requests keep queueing meanwhile and join the next batch
+            self._slots.acquire()
+            self._executor.submit(self._process_released, batch)
+
+    def _process_released(self, batch):
+        try:
+            self._process(batch)
+        finally:
+            self._slots.release()
+
+    def _process(self, batch):
+        # Drop requests whose callers gave up while queued
+        batch = [(text, fut) for text, fut in batch if fut.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        try:
+            vectors = np.asarray(self.encode_fn([text for text, _ in batch]), dtype=np.float32)
+        except Exception as e:
+            logger.error(f"Embedding batch of {len(batch)} failed: {e}")
+            for _, fut in batch:
+                fut.set_exception(e)
+            return
+
+        with self._stats_lock:
+            self.requests += len(batch)
+            self.batches += 1
+
+        for i, (_, fut) in enumerate(batch):
+            fut.set_result(vectors[i])
@@ -0,0 +1,109 @@
+"""
+Dependency-free inference for the mastery RandomForestRegressor.
+
+``export_forest`` (run by ``train_model.py``) flattens every tree of a fitted
+forest into contiguous NumPy arrays: per node the split feature, threshold,
+left/right child and leaf value, with each tree's root offset. Leaves point
+to themselves, so a fixed number of steps (the forest depth) walks every
+row down every tree at once without branching per tree.
+
+``ForestPredictor`` loads those arrays with NumPy alone (no sklearn, scipy,
+pandas or joblib in the worker) and reproduces ``RandomForestRegressor.predict``
+exactly: inputs are float32 as in sklearn, compared against the float64
+thresholds, and per-tree outputs are summed in tree order before dividing by
+the number of trees.
+"""
+
+from typing import List, Optional
+
+import numpy as np
+
+
+def export_forest(model, path: str, feature_names: Optional[List[str]] = None):
+    """
+    Writes a fitted single-output RandomForestRegressor to ``path`` (.npz).
+
+    Args:
+        model: Fitted sklearn RandomForestRegressor
+        path: Output .npz path
+        feature_names: Column order the model was trained with
+    """
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        n = tree.node_count
+        is_leaf = tree.children_left == -1
+        own = np.arange(offset, offset + n, dtype=np.int32)
+        roots.append(offset)
+        features.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+        thresholds.append(np.where(is_leaf, 0.0, tree.threshold).astype(np.float64))
+        lefts.append(np.where(is_leaf, own, tree.children_left + offset).astype(np.int32))
+        rights.append(np.where(is_leaf, own, tree.children_right + offset).astype(np.int32))
+        values.append(tree.value[:, 0, 0].astype(np.float64))
+        max_depth = max(max_depth, tree.max_depth)
+        offset += n
+
+    np.savez(
+        path,
+        feature=np.concatenate(features),
+        threshold=np.concatenate(thresholds),
+        left=np.concatenate(lefts),
+        right=np.concatenate(rights),
+        value=np.concatenate(values),
+        roots=np.asarray(roots, dtype=np.int32),
+        max_depth=np.asarray(max_depth),
+        n_features=np.asarray(model.n_features_in_),
+        feature_names=np.asarray(feature_names or [], dtype=str)
+    )
+
+
+class ForestPredictor:
+    def __init__(self, path: str):
+        """
+        Args:
+            path: .npz written by export_forest
+        """
+        with np.load(path) as data:
+            self.feature = data["feature"]
+            self.threshold = data["threshold"]
+            self.left = data["left"]
+            self.right = data["right"]
+            self.value = data["value"]
+            self.roots = data["roots"]
+            self.max_depth = int(data["max_depth"])
+            self.n_features = int(data["n_features"])
+            self.feature_names = [str(name) for name in data["feature_names"]] or None
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """
+        Mean prediction over all trees for each row.
+
+        Args:
+            X: (n_rows, n_features) array, in feature_names order
+
+        Returns:
+            (n_rows,) float64 predictions, identical to RandomForestRegressor.predict
+        """
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"Expected (n, {self.n_features}) features, got {X.shape}")
+
+        rows = np.arange(len(X))[:, None]
+        nodes = np.broadcast_to(self.roots, (len(X), self.n_trees))
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+
+        # Same accumulation order as sklearn: add trees one by one, then divide
+        leaf_values = self.value[nodes]
+        total = np.zeros(len(X))
+        for t in range(self.n_trees):
+            total += leaf_values[:, t]
+        total /= self.n_trees
+        return total
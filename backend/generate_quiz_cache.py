@@ -1,129 +1,190 @@
 """
 Pre-generate quizzes for all topics and cache them.
 
-This script generates quizzes for all topic/subtopic combinations
-and saves them to a cache file for instant retrieval.
+This script generates quizzes for every topic × subtopic × difficulty × variant
+and saves them to the shared cache store (cache.db) for instant retrieval.
+
+Retrieval for all combinations runs up front as one batched encode and one
+FAISS search. Generations then run concurrently (bounded by --concurrency and
+by the Ollama client's OLLAMA_NUM_PARALLEL),
+invalid JSON is retried, and each quiz is committed as soon as it is done, so
+an interrupted run resumes where it stopped.
+
+Usage:
+    python generate_quiz_cache.py --difficulties Easy Medium Hard --variants 3 --concurrency 4
 """
 
+import argparse
 import asyncio
-import json
-import os
-from server import call_ollama, search, SearchRequest
-
-# Path to cache
-CACHE_DIR = os.path.dirname(__file__)
-QUIZ_CACHE_FILE = os.path.join(CACHE_DIR, "quiz_cache.json")
-
-# Topics to generate quizzes for
-CALCULUS_TOPICS = {
-    "Limits": ["Basic Limit Concept", "Limit Laws", "Continuity", "Infinite Limits"],
-    "Derivatives": ["Definition of Derivative", "Derivative Rules", "Chain Rule", "Implicit Differentiation"],
-    "Integration": ["Antiderivatives", "Definite Integrals", "Substitution", "Integration by Parts"],
-    "Applications": ["Optimization", "Related Rates", "Area Between Curves", "Volume of Revolution"],
-    "Series": ["Sequences", "Geometric Series", "Convergence Tests", "Power Series"]
-}
-
-async def generate_quiz_for_topic(topic: str, subtopic: str, num_questions: int = 5, difficulty: str = "Medium"):
-    """Generate a single quiz and return it."""
-    try:
-        print(f"  Generating quiz for {topic} - {subtopic}...")
-        
-        # 1. RAG Search
-        search_query = f"{topic} {subtopic} practice problems quiz"
-        search_res = search(SearchRequest(query=search_query, limit=10))
-        context_docs = search_res['results']
-        context_str = "\n".join([f"- {d.get('content', '')}" for d in context_docs])
-
-        # 2. Generate Quiz JSON
-        prompt = f"""
-        Create a {num_questions}-question multiple choice quiz on '{topic} - {subtopic}'.
-        Difficulty: {difficulty}.
-        
-        Context material:
-        {context_str}
-
-        Output STRICTLY valid JSON in this format:
-        [
-            {{
-                "id": 1,
-                "question": "Question text here?",
-                "options": ["A) Option 1", "B) Option 2", "C) Option 3", "D) Option 4"],
-                "correctAnswer": "Option text matching one of the options",
-                "explanation": "Brief explanation of why"
-            }}
-        ]
-        Do not include markdown formatting (like ```json), just the raw JSON string.
-        """
-        
-        response_text = await call_ollama(prompt)
-        # Clean response if it contains markdown
-        response_text = response_text.replace("```json", "").replace("```", "").strip()
-        
-        # Format RAG sources
-        rag_sources = [{
-            'id': d.get('id', str(i)),
-            'topic': d.get('topic', ''),
-            'subtopic': d.get('subtopic', ''),
-            'content': d.get('content', ''),
-            'content_type': d.get('content_type', 'explanation'),
-            'score': d.get('score', 0),
-            'source': d.get('source', 'Unknown')
-        } for i, d in enumerate(context_docs[:10])]
-        
-        return {
-            "quiz": json.loads(response_text),
-            "rag_sources": rag_sources
-        }
-    except Exception as e:
-        print(f"    ERROR: Failed to generate quiz for {topic} - {subtopic}: {e}")
-        return None
-
-async def pre_generate_all_quizzes():
-    """Pre-generate quizzes for all topics and save to cache."""
-    cache = {}
-    
-    # Load existing cache if it exists
-    if os.path.exists(QUIZ_CACHE_FILE):
-        try:
-            with open(QUIZ_CACHE_FILE, 'r') as f:
-                cache = json.load(f)
-            print(f"Loaded existing cache with {len(cache)} quizzes.")
-        except:
-            print("Starting with empty cache.")
-    
-    total_topics = sum(len(subtopics) for subtopics in CALCULUS_TOPICS.values())
-    current = 0
-    
-    print(f"\nGenerating quizzes for {total_topics} topic/subtopic combinations...\n")
-    
-    for topic, subtopics in CALCULUS_TOPICS.items():
-        print(f"\n📚 Topic: {topic}")
-        for subtopic in subtopics:
-            current += 1
-            cache_key = f"{topic}|{subtopic}|Medium"
-            
-            # Skip if already in cache
-            if cache_key in cache:
-                print(f"  [{current}/{total_topics}] ✅ Already cached: {subtopic}")
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+import server
+from server import (
+    call_ollama, build_quiz_prompt, parse_quiz, _rag_sources, load_components,
+    CACHE_DB_PATH, OLLAMA_NUM_PARALLEL
+)
+from topics import CALCULUS_TOPICS, CURRICULUM_TOPICS, QUIZ_QUERY_TEMPLATE
+from cache_store import QUIZ_NAMESPACE, open_store, quiz_cache_key
+
+TOPIC_SETS = {"calculus": CALCULUS_TOPICS, "curriculum": CURRICULUM_TOPICS}
+DIFFICULTIES = ["Easy", "Medium", "Hard"]
+
+
+def retrieve_all(pairs: List[Tuple[str, str]], limit: int = 10) -> Dict[Tuple[str, str], List[Dict[str, Any]]]:
+    """RAG context for every topic/subtopic pair with one batched encode and one index search."""
+    # Same loaders (and config) as the server's startup, run in this process
+    load_components("index", "metadata", "embedder")
+    index, metadata, model = server.index, server.metadata, server.model
+
+    queries = [QUIZ_QUERY_TEMPLATE.format(topic=topic, subtopic=subtopic) for topic, subtopic in pairs]
+    vectors = np.asarray(model.encode(queries, show_progress_bar=False), dtype=np.float32)
+    scores, ids = index.search(vectors, limit)
+
+    contexts = {}
+    for pair, row_ids, row_scores in zip(pairs, ids, scores):
+        docs = []
+        for idx, score in zip(row_ids, row_scores):
+            if idx < 0:
                 continue
-            
-            print(f"  [{current}/{total_topics}] ⏳ Generating: {subtopic}")
-            quiz_data = await generate_quiz_for_topic(topic, subtopic)
-            
-            if quiz_data:
-                cache[cache_key] = quiz_data
-                print(f"  [{current}/{total_topics}] ✅ Completed: {subtopic}")
-                
-                # Save after each successful generation (in case of crashes)
-                with open(QUIZ_CACHE_FILE, 'w') as f:
-                    json.dump(cache, f, indent=2)
-            else:
-                print(f"  [{current}/{total_topics}] ❌ Failed: {subtopic}")
-    
-    print(f"\n✅ Cache generation complete! Saved {len(cache)} quizzes to {QUIZ_CACHE_FILE}")
+            item = metadata[int(idx)]
+            item['score'] = float(score)
+            docs.append(item)
+        contexts[pair] = docs
+    return contexts
+
+
+def _valid_quiz(quiz: Any, num_questions: int) -> bool:
+    return (isinstance(quiz, list) and len(quiz) >= num_questions
+            and all(isinstance(q, dict) and q.get("question") and q.get("options") for q in quiz))
+
+
+async def generate_quiz_for_topic(topic: str, subtopic: str, context_docs: List[Dict[str, Any]],
+                                  num_questions: int = 5, difficulty: str = "Medium",
+                                  variant: int = 0, retries: int = 3):
+    """Generate a single quiz and return it, or None after ``retries`` failed or invalid outputs."""
+    prompt = build_quiz_prompt(topic, subtopic, num_questions, difficulty, context_docs, variant=variant)
+    for attempt in range(1, retries + 1):
+        upstream_failed = False
+        try:
+            # One Ollama call per attempt, so ``retries`` bounds the upstream calls per quiz
+            response = await call_ollama(prompt, retries=1)
+        except Exception as e:
+            error, upstream_failed = str(e), True
+        else:
+            try:
+                quiz = parse_quiz(response)
+                if _valid_quiz(quiz, num_questions):
+                    return {
+                        "quiz": quiz,
+                        "rag_sources": _rag_sources(context_docs[:10])
+                    }
+                error = "quiz JSON has the wrong shape"
+            except Exception as e:
+                error = f"invalid quiz JSON: {e}"
+        print(f"    Attempt {attempt}/{retries} failed for {topic} - {subtopic} ({difficulty}, v{variant}): {error}")
+        if upstream_failed and attempt < retries:
+            # Back off like the client's own retries would
+            await asyncio.sleep(min(8.0, 0.5 * 2 ** (attempt - 1)))
+    return None
+
+
+async def pre_generate_all_quizzes(topics: Dict[str, List[str]], difficulties: List[str], variants: int = 1,
+                                   concurrency: int = OLLAMA_NUM_PARALLEL, num_questions: int = 5,
+                                   retries: int = 3):
+    """Pre-generate quizzes for all topics and save to cache."""
+    store = open_store(CACHE_DB_PATH)
+    print(f"Loaded existing cache with {store.count(QUIZ_NAMESPACE)} quizzes.")
+
+    jobs = [
+        (topic, subtopic, difficulty, variant)
+        for topic, subtopics in topics.items()
+        for subtopic in subtopics
+        for difficulty in difficulties
+        for variant in range(variants)
+    ]
+    total = len(jobs)
+    # Resume: skip everything already checkpointed in the store
+    jobs = [job for job in jobs if store.get(QUIZ_NAMESPACE, quiz_cache_key(*job)) is None]
+    print(f"\n{total} quizzes requested, {total - len(jobs)} already cached, {len(jobs)} to generate.")
+    if not jobs:
+        store.close()
+        return
+
+    start = time.time()
+    pairs = sorted({(topic, subtopic) for topic, subtopic, _, _ in jobs})
+    contexts = retrieve_all(pairs)
+    print(f"Retrieved context for {len(pairs)} topic/subtopic pairs in {time.time() - start:.1f}s")
+    print(f"Generating with up to {concurrency} concurrent requests...\n")
+
+    semaphore = asyncio.Semaphore(concurrency)
+    done = 0
+    failed = []
+    gen_start = time.time()
+
+    async def run(job):
+        nonlocal done
+        topic, subtopic, difficulty, variant = job
+        async with semaphore:
+            quiz_data = await generate_quiz_for_topic(
+                topic, subtopic, contexts[(topic, subtopic)],
+                num_questions=num_questions, difficulty=difficulty, variant=variant, retries=retries
+            )
+        label = f"{topic} - {subtopic} ({difficulty}, v{variant})"
+        if quiz_data:
+            # Each quiz is committed on its own, so a crash loses nothing
+            await asyncio.to_thread(store.put, QUIZ_NAMESPACE, quiz_cache_key(topic, subtopic, difficulty, variant), quiz_data)
+            done += 1
+            rate = done / max(time.time() - gen_start, 1e-6) * 60
+            print(f"  [{done + len(failed)}/{len(jobs)}] ✅ {label}  ({rate:.1f} quizzes/min)")
+        else:
+            failed.append(label)
+            print(f"  [{done + len(failed)}/{len(jobs)}] ❌ Failed: {label}")
+
+    await asyncio.gather(*(run(job) for job in jobs))
+
+    elapsed = time.time() - gen_start
+    print(f"\n✅ Cache generation complete! Generated {done} quizzes in {elapsed:.1f}s "
+          f"({done / max(elapsed, 1e-6) * 60:.1f} quizzes/min); "
+          f"{store.count(QUIZ_NAMESPACE)} quizzes in {CACHE_DB_PATH}")
+    if failed:
+        print(f"❌ {len(failed)} failed (re-run to retry):")
+        for label in failed:
+            print(f"   - {label}")
+    store.close()
+
+
+async def _run(**kwargs):
+    try:
+        await pre_generate_all_quizzes(**kwargs)
+    finally:
+        await server.close_clients()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate quizzes into the shared cache store")
+    parser.add_argument("--topics", choices=sorted(TOPIC_SETS), default="calculus",
+                        help="Topic list to cover (default: calculus; curriculum matches the frontend chapters)")
+    parser.add_argument("--difficulties", nargs="+", choices=DIFFICULTIES, default=["Medium"],
+                        help="Difficulties to generate (default: Medium)")
+    parser.add_argument("--variants", type=int, default=1,
+                        help="Quizzes per topic/subtopic/difficulty (serve them with QUIZ_CACHE_VARIANTS)")
+    parser.add_argument("--concurrency", type=int, default=OLLAMA_NUM_PARALLEL,
+                        help=f"Generations in flight (default: OLLAMA_NUM_PARALLEL={OLLAMA_NUM_PARALLEL})")
+    parser.add_argument("--num-questions", type=int, default=5, help="Questions per quiz (default: 5)")
+    parser.add_argument("--retries", type=int, default=3, help="Ollama calls per quiz, covering errors and invalid JSON (default: 3)")
+    args = parser.parse_args()
 
-if __name__ == "__main__":
     print("=" * 60)
     print("Quiz Cache Generator")
     print("=" * 60)
-    asyncio.run(pre_generate_all_quizzes())
+    asyncio.run(_run(
+        topics=TOPIC_SETS[args.topics], difficulties=args.difficulties, variants=max(1, args.variants),
+        concurrency=max(1, args.concurrency), num_questions=args.num_questions, retries=max(1, args.retries)
+    ))
+
+
+if __name__ == "__main__":
+    main()
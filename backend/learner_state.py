@@ -0,0 +1,157 @@
+"""
+Per-learner rolling interaction state for the mastery model's history features.
+
+``LearnerState`` keeps the last ``HISTORY_SIZE`` interactions in fixed-size
+ring buffers together with running counts and sums for every window the model
+uses (past 5, past 8, whole history), so recording an interaction and reading
+the features are constant-time and the memory per learner is fixed.
+
+The features are exactly those the old list-based history produced. The only
+part that looks at the buffer is the scaffolding-time mean, which is taken
+over the scaffolded entries in order (as before) and only when there are any.
+"""
+
+import struct
+from array import array
+from typing import Dict
+
+import numpy as np
+
+HISTORY_SIZE = 20
+
+# Serialized layout: format version, head, count, total_wrong, scaffold_count, help5, wrong8,
+# sum_correct, correct5, then the times/correct buffers (float64) and the flags
+_FORMAT = 1
+_HEADER = struct.Struct("<B6H2d")
+
+_HELP = 1      # hint requested
+_WRONG = 2     # incorrect answer
+_SCAFFOLD = 4  # scaffolding was needed
+
+# History features for a learner with no history (neutral/average)
+DEFAULT_HISTORY_FEATURES = {
+    'frPast5HelpRequest': 0.3,
+    'frPast8WrongCount': 2,
+    'totalFrPercentPastWrong': 0.3,
+    'AveCorrect': 0.5,
+    'AveKnow': 0.5,
+    'frTimeTakenOnScaffolding': 0,
+}
+
+
+class LearnerState:
+    __slots__ = ("times", "correct", "flags", "head", "count",
+                 "sum_correct", "total_wrong", "scaffold_count", "help5", "correct5", "wrong8")
+
+    def __init__(self):
+        self.times = array('d', bytes(8 * HISTORY_SIZE))
+        self.correct = array('d', bytes(8 * HISTORY_SIZE))
+        self.flags = bytearray(HISTORY_SIZE)
+        self.head = 0    # next slot to write
+        self.count = 0   # interactions held (<= HISTORY_SIZE)
+        self.sum_correct = 0.0
+        self.total_wrong = 0
+        self.scaffold_count = 0
+        self.help5 = 0
+        self.correct5 = 0.0
+        self.wrong8 = 0
+
+    def _slot(self, age: int) -> int:
+        """Ring position of the interaction ``age`` steps back (1 = most recent)."""
+        return (self.head - age) % HISTORY_SIZE
+
+    def push(self, interaction: Dict):
+        """
+        Records an interaction, dropping the oldest beyond HISTORY_SIZE.
+
+        Args:
+            interaction: Dict with keys: time_taken, correct, hint_count, scaffold
+        """
+        correct = interaction.get('correct', 0)
+        flags = ((_HELP if interaction.get('hint_count', 0) > 0 else 0)
+                 | (_WRONG if correct == 0 else 0)
+                 | (_SCAFFOLD if interaction.get('scaffold', 0) == 1 else 0))
+
+        # Slide the past-5 / past-8 windows
+        if self.count >= 5:
+            old = self._slot(5)
+            self.help5 -= self.flags[old] & _HELP
+            self.correct5 -= self.correct[old]
+        if self.count >= 8:
+            self.wrong8 -= (self.flags[self._slot(8)] & _WRONG) >> 1
+        # The oldest interaction leaves the history when the ring is full
+        if self.count == HISTORY_SIZE:
+            old = self.head
+            self.sum_correct -= self.correct[old]
+            self.total_wrong -= (self.flags[old] & _WRONG) >> 1
+            self.scaffold_count -= (self.flags[old] & _SCAFFOLD) >> 2
+
+        slot = self.head
+        self.times[slot] = interaction.get('time_taken', 0)
+        self.correct[slot] = correct
+        self.flags[slot] = flags
+        self.head = (slot + 1) % HISTORY_SIZE
+        self.count = min(self.count + 1, HISTORY_SIZE)
+
+        self.sum_correct += correct
+        self.total_wrong += (flags & _WRONG) >> 1
+        self.scaffold_count += (flags & _SCAFFOLD) >> 2
+        self.help5 += flags & _HELP
+        self.correct5 += correct
+        self.wrong8 += (flags & _WRONG) >> 1
+
+    def features(self) -> Dict:
+        """History features for the next prediction."""
+        if self.count == 0:
+            return dict(DEFAULT_HISTORY_FEATURES)
+
+        recent = min(self.count, 5)
+        scaffold_time = 0
+        if self.scaffold_count:
+            slots = [self._slot(age) for age in range(self.count, 0, -1)]
+            scaffold_time = np.mean([self.times[s] for s in slots if self.flags[s] & _SCAFFOLD])
+        return {
+            # Help requests in past 5
+            'frPast5HelpRequest': self.help5 / recent,
+            # Wrong count in past 8
+            'frPast8WrongCount': self.wrong8,
+            # Overall error rate
+            'totalFrPercentPastWrong': self.total_wrong / self.count,
+            # Average correctness
+            'AveCorrect': self.sum_correct / self.count,
+            # Average knowledge (proxy: recent correctness)
+            'AveKnow': self.correct5 / recent,
+            # Scaffolding time (if available)
+            'frTimeTakenOnScaffolding': scaffold_time,
+        }
+
+    def copy(self) -> "LearnerState":
+        clone = LearnerState.__new__(LearnerState)
+        for name in self.__slots__:
+            value = getattr(self, name)
+            setattr(clone, name, value[:] if isinstance(value, (array, bytearray)) else value)
+        return clone
+
+    def to_bytes(self) -> bytes:
+        return (_HEADER.pack(_FORMAT, self.head, self.count, self.total_wrong, self.scaffold_count,
+                             self.help5, self.wrong8, self.sum_correct, self.correct5)
+                + self.times.tobytes() + self.correct.tobytes() + bytes(self.flags))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "LearnerState":
+        fmt, head, count, total_wrong, scaffold_count, help5, wrong8, sum_correct, correct5 = \
+            _HEADER.unpack_from(data)
+        if fmt != _FORMAT:
+            raise ValueError(f"Unsupported learner state format {fmt}")
+        state = cls.__new__(cls)
+        offset = _HEADER.size
+        state.times = array('d', data[offset:offset + 8 * HISTORY_SIZE])
+        offset += 8 * HISTORY_SIZE
+        state.correct = array('d', data[offset:offset + 8 * HISTORY_SIZE])
+        offset += 8 * HISTORY_SIZE
+        state.flags = bytearray(data[offset:offset + HISTORY_SIZE])
+        state.head, state.count = head, count
+        state.total_wrong, state.scaffold_count = total_wrong, scaffold_count
+        state.help5, state.wrong8 = help5, wrong8
+        state.sum_correct, state.correct5 = sum_correct, correct5
+        return state
@@ -0,0 +1,250 @@
+"""
+Persistent learner-state store for the ML engine.
+
+Each learner's ``LearnerState`` is serialized (~370 bytes) into SQLite, in WAL
+mode and sharded by user id across several database files so writers from
+different uvicorn workers rarely contend for the same lock. Every row carries
+a version that increases with each recorded interaction.
+
+- Reads go through an in-memory LRU of hot users. On each lookup the row's
+  version is checked (a primary-key read), so a worker picks up interactions
+  another worker recorded, and restarts resume from disk.
+- Writes are write-behind: ``put`` only serializes the state into a dirty
+  map, and a background thread flushes dirty states in one transaction per
+  shard every ``flush_interval`` seconds (or sooner once ``max_batch`` are
+  pending). The prediction path never waits on a disk write.
+- A flush only replaces a row with a newer version. If one learner's
+  interactions land on two workers within the same flush interval, the
+  first flushed state wins. The worker whose write lost drops its cached
+  copy, so its next lookup reloads the winning state and the workers
+  converge instead of diverging silently.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from learner_state import LearnerState
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS learners (
+    user_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    state BLOB NOT NULL,
+    updated_at REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+_UPSERT = """
+INSERT INTO learners (user_id, version, state, updated_at) VALUES (?, ?, ?, ?)
+ON CONFLICT(user_id) DO UPDATE SET
+    version = excluded.version, state = excluded.state, updated_at = excluded.updated_at
+WHERE excluded.version > learners.version
+"""
+
+
+def shard_paths(path: str, shards: int) -> List[str]:
+    """``learner_state.db`` -> ``learner_state.0.db`` ... (a single shard keeps the path as is)."""
+    if shards <= 1:
+        return [path]
+    root, ext = os.path.splitext(path)
+    return [f"{root}.{i}{ext or '.db'}" for i in range(shards)]
+
+
+class LearnerStore:
+    def __init__(self, path: str, shards: int = 4, hot_users: int = 100_000,
+                 flush_interval: float = 0.5, max_batch: int = 512, busy_timeout: float = 10.0):
+        """
+        Args:
+            path: Database path (shard files are derived from it)
+            shards: Number of database files user ids are spread over
+            hot_users: Learner states kept in memory (LRU)
+            flush_interval: Seconds between write-behind flushes
+            max_batch: Pending states that trigger an early flush
+            busy_timeout: Seconds to wait for another worker's write lock
+        """
+        self.paths = shard_paths(path, max(1, shards))
+        self.hot_users = max(1, int(hot_users))
+        self.flush_interval = flush_interval
+        self.max_batch = max(1, max_batch)
+        self.busy_timeout = busy_timeout
+
+        self._hot: "OrderedDict[str, Tuple[LearnerState, int]]" = OrderedDict()
+        self._dirty: Dict[str, Tuple[int, bytes]] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._conns: List[sqlite3.Connection] = []
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.hot_hits = 0
+        self.loads = 0
+        self.flushed = 0
+        self.conflicts = 0
+
+        for conn in self._shard_conns():
+            with conn:
+                conn.executescript(_SCHEMA)
+
+    def _shard_conns(self) -> List[sqlite3.Connection]:
+        # sqlite3 connections are not shareable across threads; keep one set per thread
+        conns = getattr(self._local, "conns", None)
+        if conns is None:
+            conns = []
+            for path in self.paths:
+                conn = sqlite3.connect(path, timeout=self.busy_timeout, check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conns.append(conn)
+            self._local.conns = conns
+            with self._lock:
+                self._conns.extend(conns)
+        return conns
+
+    def _shard(self, user_id: str) -> int:
+        return zlib.crc32(user_id.encode("utf-8")) % len(self.paths)
+
+    def _remember(self, user_id: str, state: LearnerState, version: int):
+        self._hot[user_id] = (state, version)
+        self._hot.move_to_end(user_id)
+        while len(self._hot) > self.hot_users:
+            self._hot.popitem(last=False)
+
+    def get(self, user_id: str) -> Tuple[Optional[LearnerState], int]:
+        """
+        Current state and version of a learner, or (None, 0) for a new learner.
+        The state is live: after recording an interaction on it, call ``put``.
+        """
+        with self._lock:
+            hot = self._hot.get(user_id)
+            pending = self._dirty.get(user_id)
+        if pending is not None:
+            # Not flushed yet: this worker holds the newest state
+            if hot is not None and hot[1] == pending[0]:
+                state, version = hot
+            else:
+                state, version = LearnerState.from_bytes(pending[1]), pending[0]
+            with self._lock:
+                self.hot_hits += 1
+                self._remember(user_id, state, version)
+            return state, version
+
+        conn = self._shard_conns()[self._shard(user_id)]
+        row = conn.execute("SELECT version FROM learners WHERE user_id = ?", (user_id,)).fetchone()
+        if hot is not None and (row is None or row[0] <= hot[1]):
+            with self._lock:
+                self.hot_hits += 1
+                self._hot.move_to_end(user_id)
+            return hot
+        if row is None:
+            return None, 0
+
+        # Newer on disk (another worker or a previous run)
+        row = conn.execute("SELECT version, state FROM learners WHERE user_id = ?", (user_id,)).fetchone()
+        state = LearnerState.from_bytes(row[1])
+        with self._lock:
+            self.loads += 1
+            self._remember(user_id, state, row[0])
+        return state, row[0]
+
+    def put(self, user_id: str, state: LearnerState, version: int):
+        """Records a new state (``version`` must exceed the one returned by ``get``); flushed later."""
+        data = state.to_bytes()
+        with self._lock:
+            self._remember(user_id, state, version)
+            self._dirty[user_id] = (version, data)
+            pending = len(self._dirty)
+        if pending >= self.max_batch:
+            self._wake.set()
+
+    def flush(self) -> int:
+        """
+        Writes all pending states, one transaction per shard. States that lost to a newer
+        or equal stored version are evicted from memory. Returns the number written.
+        """
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return 0
+
+        now = time.time()
+        by_shard: Dict[int, list] = {}
+        for user_id, (version, data) in dirty.items():
+            by_shard.setdefault(self._shard(user_id), []).append((user_id, version, data, now))
+        conns = self._shard_conns()
+        lost = []
+        try:
+            for shard, rows in by_shard.items():
+                conn = conns[shard]
+                with conn:
+                    for row in rows:
+                        # No row changed: another worker already wrote this or a newer version
+                        if conn.execute(_UPSERT, row).rowcount == 0:
+                            lost.append((row[0], row[1]))
+        except Exception:
+            # Put back whatever was not superseded meanwhile, and retry on the next flush
+            with self._lock:
+                for user_id, entry in dirty.items():
+                    if user_id not in self._dirty:
+                        self._dirty[user_id] = entry
+            raise
+        with self._lock:
+            self.flushed += len(dirty) - len(lost)
+            self.conflicts += len(lost)
+            for user_id, version in lost:
+                # Our copy diverged from the stored one; reload it on the next lookup. A newer
+                # pending state is left to its own flush (it converges the same way if it loses)
+                hot = self._hot.get(user_id)
+                if hot is not None and hot[1] == version and user_id not in self._dirty:
+                    del self._hot[user_id]
+        if lost:
+            logger.info(f"Learner state: {len(lost)} stale writes lost to another worker; reloading them")
+        return len(dirty) - len(lost)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"Learner state flush failed: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="learner-store-flush", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stops the flush thread, writes everything pending and closes the databases."""
+        if self._thread is not None:
+            self._stopping.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            conn.close()
+        self._local = threading.local()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "shards": len(self.paths),
+                "hot_users": len(self._hot),
+                "pending_writes": len(self._dirty),
+                "hot_hits": self.hot_hits,
+                "loads": self.loads,
+                "flushed": self.flushed,
+                "conflicts": self.conflicts,
+            }
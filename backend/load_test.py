@@ -0,0 +1,330 @@
+"""
+End-to-end load generator for the API.
+
+Replays a weighted mix of student traffic (search, chat, quiz generation,
+hints and quiz submissions) at a target request rate and reports throughput,
+latency percentiles and error rates per endpoint. Arrivals are open-loop
+(Poisson at --rps), so a slow server shows up as growing latency rather than
+as a lower offered load. Requests beyond --max-in-flight are counted as
+dropped, so an overloaded run still finishes on time.
+
+Run against a server backed by mock_ollama.py to measure the backend itself,
+or against a real Ollama to size hardware.
+
+Usage:
+    python mock_ollama.py --port 11434 &
+    OLLAMA_URL=http://localhost:11434 python server.py &
+    python load_test.py --url http://localhost:8000 --rps 10 --duration 60
+    python load_test.py --mix search=70,chat=30 --rps 25 --json results.json
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+from topics import CALCULUS_TOPICS
+
+DEFAULT_MIX = "search=40,chat=20,generate_quiz=15,generate_hint=15,submit_quiz_ml=10"
+
+QUESTIONS = [
+    "What is a limit?",
+    "How do I use the chain rule?",
+    "Explain the derivative of sin(x)",
+    "What does continuity mean?",
+    "How do I integrate by substitution?",
+    "What is the fundamental theorem of calculus?",
+    "When does a series converge?",
+    "How do I find the maximum of a function?",
+    "What is implicit differentiation?",
+    "Explain Riemann sums with left and right endpoints",
+]
+
+# Average chat turns per conversation before a student starts a new one
+CHAT_TURNS = 4
+
+
+def _topic(rng: random.Random) -> Tuple[str, str]:
+    topic = rng.choice(list(CALCULUS_TOPICS))
+    return topic, rng.choice(CALCULUS_TOPICS[topic])
+
+
+def _search(rng: random.Random, user: str, state: Dict[str, Any]) -> Dict[str, Any]:
+    topic, subtopic = _topic(rng)
+    query = rng.choice(QUESTIONS + [f"{topic} {subtopic}", subtopic])
+    return {"query": query, "limit": 5, "mode": rng.choice(["dense", "dense", "dense", "hybrid"])}
+
+
+def _chat(rng: random.Random, user: str, state: Dict[str, Any]) -> Dict[str, Any]:
+    # Like the frontend, a student sends their running conversation as history (the server
+    # continues its session for the user_id) and now and then starts a new one, with no
+    # history. The profile is fixed per student; grade, subject and difficultyLevel pick
+    # the chat's semantic-cache bucket
+    if rng.random() < 1 / CHAT_TURNS:
+        state["history"] = []
+    profile = random.Random(user)
+    return {"message": rng.choice(QUESTIONS), "user_id": user,
+            "history": list(state.get("history", [])),
+            "user_profile": {"grade": profile.choice(["Grade 11", "Grade 12", "College"]),
+                             "subject": "Calculus",
+                             "difficultyLevel": profile.choice(["Easy", "Medium", "Hard"])}}
+
+
+def _chat_reply(state: Dict[str, Any], payload: Dict[str, Any], body: Dict[str, Any]):
+    """Adds a finished turn to the student's conversation."""
+    state["history"] = payload["history"] + [
+        {"role": "user", "text": payload["message"]},
+        {"role": "model", "text": body.get("response", "")},
+    ]
+
+
+def _generate_quiz(rng: random.Random, user: str, state: Dict[str, Any]) -> Dict[str, Any]:
+    topic, subtopic = _topic(rng)
+    return {"topic": topic, "subtopic": subtopic, "num_questions": 5,
+            "difficulty": rng.choice(["Easy", "Medium", "Hard"])}
+
+
+def _generate_hint(rng: random.Random, user: str, state: Dict[str, Any]) -> Dict[str, Any]:
+    topic, subtopic = _topic(rng)
+    return {"question_text": rng.choice(QUESTIONS), "user_answer": rng.choice(["", "0", "2x"]),
+            "topic": topic, "subtopic": subtopic}
+
+
+def _submit_quiz_ml(rng: random.Random, user: str, state: Dict[str, Any]) -> Dict[str, Any]:
+    topic, subtopic = _topic(rng)
+    questions = [{
+        "questionId": i,
+        "correct": rng.random() < 0.7,
+        "timeTaken": round(rng.uniform(5, 90), 1),
+        "attemptCount": rng.choice([1, 1, 1, 2, 3]),
+        "hintCount": rng.choice([0, 0, 1, 2]),
+    } for i in range(1, 6)]
+    return {"user_id": user, "topic": topic, "subtopic": subtopic, "questions": questions}
+
+
+# Endpoint name -> (path, payload builder, optional handler of a successful response).
+# Builders and handlers get the simulated student's own state dict.
+SCENARIOS: Dict[str, Tuple[str, Callable[[random.Random, str, Dict[str, Any]], Dict[str, Any]],
+                           Optional[Callable[[Dict[str, Any], Dict[str, Any], Dict[str, Any]], None]]]] = {
+    "search": ("/search", _search, None),
+    "chat": ("/chat", _chat, _chat_reply),
+    "generate_quiz": ("/generate_quiz", _generate_quiz, None),
+    "generate_hint": ("/generate_hint", _generate_hint, None),
+    "submit_quiz_ml": ("/submit_quiz_ml", _submit_quiz_ml, None),
+}
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """Parses "search=40,chat=20" into normalized endpoint weights."""
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown endpoint '{name}' (choose from {', '.join(SCENARIOS)})")
+        weights[name] = float(weight or 1)
+    total = sum(weights.values())
+    if total <= 0:
+        raise ValueError("Mix weights must add up to more than 0")
+    return {name: weight / total for name, weight in weights.items() if weight > 0}
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors: Dict[str, int] = {}
+        self.dropped = 0
+
+    def record(self, seconds: float, error: str = None):
+        if error:
+            self.errors[error] = self.errors.get(error, 0) + 1
+        else:
+            self.latencies.append(seconds)
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        ok = len(self.latencies)
+        errors = sum(self.errors.values())
+        total = ok + errors
+        result = {
+            "requests": total,
+            "ok": ok,
+            "errors": errors,
+            "dropped": self.dropped,
+            "error_rate": errors / total if total else 0.0,
+            "throughput": ok / elapsed if elapsed else 0.0,
+            "error_kinds": dict(self.errors),
+        }
+        if ok:
+            lat = np.array(self.latencies) * 1000
+            result.update({
+                "p50_ms": float(np.percentile(lat, 50)),
+                "p95_ms": float(np.percentile(lat, 95)),
+                "p99_ms": float(np.percentile(lat, 99)),
+                "max_ms": float(lat.max()),
+            })
+        return result
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float) -> bool:
+    """Polls /readyz until the server has loaded its components."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/readyz")).status_code == 200:
+                return True
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(1.0)
+    return False
+
+
+async def run_load(url: str, rps: float, duration: float, mix: Dict[str, float], users: int = 50,
+                   max_in_flight: int = 256, timeout: float = 120.0, seed: int = 0) -> Dict[str, Any]:
+    """
+    Offers ``rps`` requests per second for ``duration`` seconds and collects per-endpoint stats.
+
+    Args:
+        url: Base URL of the API server
+        rps: Target arrival rate (requests per second, Poisson arrivals)
+        duration: Seconds to keep sending new requests
+        mix: Normalized endpoint weights (see parse_mix)
+        users: Distinct simulated students (user ids and conversations for chat, submissions)
+        max_in_flight: Outstanding requests beyond which new arrivals are dropped
+        timeout: Per-request timeout in seconds
+        seed: Random seed, so runs replay the same traffic
+
+    Returns:
+        Dict with the run settings, overall totals and an ``endpoints`` summary per endpoint
+    """
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    stats = {name: EndpointStats() for name in names}
+    students: Dict[str, Dict[str, Any]] = {}
+    in_flight = 0
+    tasks = set()
+    limits = httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight)
+
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        async def send(name: str, payload: Dict[str, Any], state: Dict[str, Any]):
+            nonlocal in_flight
+            path, _, on_response = SCENARIOS[name]
+            start = time.perf_counter()
+            try:
+                response = await client.post(path, json=payload)
+                error = None if response.status_code < 400 else str(response.status_code)
+                if error is None and on_response:
+                    on_response(state, payload, response.json())
+            except httpx.TimeoutException:
+                error = "timeout"
+            except httpx.HTTPError as e:
+                error = type(e).__name__
+            except ValueError:
+                error = "invalid JSON"
+            finally:
+                in_flight -= 1
+            stats[name].record(time.perf_counter() - start, error)
+
+        start = time.perf_counter()
+        next_at = start
+        while True:
+            next_at += rng.expovariate(rps)
+            if next_at - start >= duration:
+                break
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+            name = rng.choices(names, weights)[0]
+            if in_flight >= max_in_flight:
+                stats[name].dropped += 1
+                continue
+            user = f"loadtest-{rng.randrange(users)}"
+            state = students.setdefault(user, {})
+            payload = SCENARIOS[name][1](rng, user, state)
+            in_flight += 1
+            task = asyncio.create_task(send(name, payload, state))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+    endpoints = {name: stats[name].summary(elapsed) for name in names}
+    ok = sum(e["ok"] for e in endpoints.values())
+    errors = sum(e["errors"] for e in endpoints.values())
+    return {
+        "url": url,
+        "target_rps": rps,
+        "duration": duration,
+        "elapsed": elapsed,
+        "requests": ok + errors,
+        "dropped": sum(e["dropped"] for e in endpoints.values()),
+        "throughput": ok / elapsed if elapsed else 0.0,
+        "error_rate": errors / (ok + errors) if ok + errors else 0.0,
+        "endpoints": endpoints,
+    }
+
+
+def print_report(result: Dict[str, Any]):
+    print(f"\nTarget {result['target_rps']:.1f} req/s for {result['duration']:.0f}s "
+          f"(finished in {result['elapsed']:.1f}s): {result['requests']} requests, "
+          f"{result['throughput']:.2f} ok/s, {result['error_rate']:.1%} errors, {result['dropped']} dropped\n")
+    header = f"{'endpoint':<16} {'reqs':>6} {'ok/s':>7} {'err%':>6} {'drop':>5} " \
+             f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    print(header)
+    print("-" * len(header))
+    for name, e in result["endpoints"].items():
+        if "p50_ms" in e:
+            latency = f"{e['p50_ms']:>9.1f} {e['p95_ms']:>9.1f} {e['p99_ms']:>9.1f} {e['max_ms']:>9.1f}"
+        else:
+            latency = f"{'-':>9} {'-':>9} {'-':>9} {'-':>9}"
+        print(f"{name:<16} {e['requests']:>6} {e['throughput']:>7.2f} {e['error_rate']:>6.1%} "
+              f"{e['dropped']:>5} {latency}")
+    for name, e in result["endpoints"].items():
+        if e["error_kinds"]:
+            kinds = ", ".join(f"{kind} x{count}" for kind, count in sorted(e["error_kinds"].items()))
+            print(f"  {name} errors: {kinds}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the API with a realistic traffic mix")
+    parser.add_argument("--url", default="http://localhost:8000", help="API base URL")
+    parser.add_argument("--rps", type=float, default=5.0, help="Target requests per second (default: 5)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of traffic (default: 30)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Endpoint weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--users", type=int, default=50, help="Simulated students (default: 50)")
+    parser.add_argument("--max-in-flight", type=int, default=256,
+                        help="Outstanding requests before arrivals are dropped (default: 256)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout (default: 120s)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    parser.add_argument("--ready-timeout", type=float, default=600.0,
+                        help="Seconds to wait for /readyz before starting (default: 600)")
+    parser.add_argument("--json", metavar="PATH", help="Also write the results to a JSON file")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+
+    async def run():
+        async with httpx.AsyncClient(base_url=args.url, timeout=5.0) as client:
+            print(f"Waiting for {args.url}/readyz ...")
+            if not await wait_ready(client, args.ready_timeout):
+                raise SystemExit(f"❌ Server at {args.url} not ready after {args.ready_timeout:.0f}s")
+        print(f"Sending {args.rps:.1f} req/s for {args.duration:.0f}s: "
+              + ", ".join(f"{name} {weight:.0%}" for name, weight in mix.items()))
+        return await run_load(args.url, max(0.01, args.rps), args.duration, mix, users=max(1, args.users),
+                              max_in_flight=max(1, args.max_in_flight), timeout=args.timeout, seed=args.seed)
+
+    result = asyncio.run(run())
+    print_report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
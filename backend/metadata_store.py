@@ -0,0 +1,106 @@
+"""
+Memory-mapped metadata store for the FAISS chunks.
+
+``faiss_metadata.json`` is converted once into a compact binary file
+(``faiss_metadata.bin``) laid out as:
+
+    header   magic, record count, source size and mtime (for staleness)
+    offsets  (count + 1) little-endian uint64 byte offsets into the data block
+    data     the records as compact UTF-8 JSON, back to back
+
+The file is mmapped read-only, so uvicorn workers share its pages through the
+OS page cache instead of each parsing the whole JSON into Python objects, and
+a record is only decoded when a search hit or topic lookup actually needs it.
+"""
+
+import json
+import mmap
+import os
+import struct
+from typing import Dict, Iterator, Optional
+
+import numpy as np
+
+MAGIC = b"CMMETA01"
+# magic, count, source size, source mtime_ns
+HEADER = struct.Struct("<8sQQq")
+
+
+def _source_signature(json_path: str):
+    st = os.stat(json_path)
+    return st.st_size, st.st_mtime_ns
+
+
+class MetadataStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count, self.source_size, self.source_mtime_ns = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a metadata store")
+        self._offsets = np.frombuffer(self._mm, dtype="<u8", count=self._count + 1, offset=HEADER.size)
+        self._data_start = HEADER.size + (self._count + 1) * 8
+
+    @staticmethod
+    def build(json_path: str, out_path: str) -> int:
+        """Converts a metadata JSON list into the binary format. Returns the record count."""
+        with open(json_path, "r", encoding="utf-8") as f:
+            records = json.load(f)
+        size, mtime_ns = _source_signature(json_path)
+
+        blobs = [json.dumps(r, ensure_ascii=False, separators=(",", ":")).encode("utf-8") for r in records]
+        offsets = np.zeros(len(blobs) + 1, dtype="<u8")
+        np.cumsum([len(b) for b in blobs], out=offsets[1:])
+
+        # Unique temp name so concurrent workers never write the same file
+        tmp_path = f"{out_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(blobs), size, mtime_ns))
+            f.write(offsets.tobytes())
+            for blob in blobs:
+                f.write(blob)
+        os.replace(tmp_path, out_path)
+        return len(blobs)
+
+    @classmethod
+    def open_for(cls, json_path: str, path: Optional[str] = None) -> "MetadataStore":
+        """
+        Opens the binary store for ``json_path``, (re)building it first if it is
+        missing or older than the JSON it was built from.
+        """
+        path = path or os.path.splitext(json_path)[0] + ".bin"
+        if os.path.exists(path):
+            try:
+                store = cls(path)
+                if (store.source_size, store.source_mtime_ns) == _source_signature(json_path):
+                    return store
+                store.close()
+            except (ValueError, struct.error):
+                pass
+        cls.build(json_path, path)
+        return cls(path)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, idx: int) -> Dict:
+        """Decodes one record. Each call returns a fresh dict, so callers may mutate it."""
+        if idx < 0:
+            idx += self._count
+        if not 0 <= idx < self._count:
+            raise IndexError(idx)
+        start = self._data_start + int(self._offsets[idx])
+        end = self._data_start + int(self._offsets[idx + 1])
+        return json.loads(self._mm[start:end])
+
+    def __iter__(self) -> Iterator[Dict]:
+        for i in range(self._count):
+            yield self[i]
+
+    def close(self):
+        # Release the numpy view before closing the mmap it points into
+        self._offsets = None
+        self._mm.close()
+        self._file.close()
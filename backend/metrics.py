@@ -0,0 +1,358 @@
+"""
+Minimal Prometheus metrics and per-request stage timing.
+
+Counters and histograms live in a process-wide ``REGISTRY`` and are rendered
+in the Prometheus text format by ``REGISTRY.render()`` (served on /metrics).
+Values that other components already count (cache hits, pool sizes, ...) are
+read at scrape time through collectors instead of being counted twice.
+
+``stage(name)`` times one step of a request (query encode, index search,
+Ollama queueing, ...) into the ``classmate_stage_seconds`` histogram.
+``MetricsMiddleware`` records the latency of every request, and can also
+return the request's stages in a ``Server-Timing`` response header.
+
+When ``REGISTRY.enabled`` is False, ``stage()`` returns a shared no-op and
+``inc``/``observe`` return after one attribute check.
+"""
+
+import bisect
+import contextvars
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Seconds; covers sub-millisecond cache reads up to multi-minute generations
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Samples yielded by a collector: (metric name, type, help, [(labels, value), ...])
+Sample = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, registry: "Registry", name: str, help: str, labelnames: Sequence[str] = ()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str):
+        """The child for one combination of label values (created on first use)."""
+        child = self._children.get(values)
+        if child is None:
+            key = tuple(str(v) for v in values)
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            children = list(self._children.items())
+        for key, child in sorted(children):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("registry", "value", "lock")
+
+    def __init__(self, registry: "Registry"):
+        self.registry = registry
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        if not self.registry.enabled:
+            return
+        with self.lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild(self.registry)
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def _render_child(self, key, child):
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(child.value)}"]
+
+
+class _HistogramChild:
+    __slots__ = ("registry", "bounds", "counts", "sum", "count", "lock")
+
+    def __init__(self, registry: "Registry", bounds: Tuple[float, ...]):
+        self.registry = registry
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # per bucket, the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        if not self.registry.enabled:
+            return
+        i = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self) -> "_Timer":
+        """Context manager observing the seconds spent inside it."""
+        return _Timer(self) if self.registry.enabled else _NULL_TIMER
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, registry: "Registry", name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.registry, self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self) -> "_Timer":
+        return self.labels().time()
+
+    def _render_child(self, key, child):
+        with child.lock:
+            counts, total, count = list(child.counts), child.sum, child.count
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets + (math.inf,), counts):
+            cumulative += n
+            le = 'le="' + _number(float(bound)) + '"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+        lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("child", "start")
+
+    def __init__(self, child: _HistogramChild):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Registry:
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        # Also send each request's stages in a Server-Timing header (see MetricsMiddleware)
+        self.timing_headers = False
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"Metric {metric.name} is already registered differently")
+                return existing
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(self, name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(self, name, help, labelnames, buckets))
+
+    def collector(self, fn: Callable[[], Iterable[Sample]]):
+        """Registers a function whose samples are read at scrape time."""
+        with self._lock:
+            self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for fn in collectors:
+            try:
+                samples = list(fn())
+            except Exception as e:
+                lines.append(f"# collector {getattr(fn, '__name__', fn)} failed: {_escape(e)}")
+                continue
+            for name, kind, help, values in samples:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in values:
+                    names = sorted(labels)
+                    lines.append(f"{name}{_labels(names, [labels[n] for n in names])} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "classmate_stage_seconds", "Time spent in one stage of a request", ("stage",)
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "classmate_request_seconds", "HTTP request latency until the response finished",
+    ("method", "route", "status")
+)
+
+# Stages of the current request, when it asked for timing headers
+_request_stages: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = \
+    contextvars.ContextVar("request_stages", default=None)
+
+
+class _StageTimer:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe_stage(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def stage(name: str):
+    """Context manager timing a request stage (a no-op while metrics are disabled)."""
+    return _StageTimer(name) if REGISTRY.enabled else _NULL_TIMER
+
+
+def observe_stage(name: str, seconds: float):
+    """Records a stage measured elsewhere (e.g. a queue wait)."""
+    if not REGISTRY.enabled:
+        return
+    STAGE_SECONDS.labels(name).observe(seconds)
+    stages = _request_stages.get()
+    if stages is not None:
+        stages.append((name, seconds))
+
+
+def server_timing(stages: Sequence[Tuple[str, float]], total: float) -> str:
+    """Server-Timing header value; repeated stages are summed, durations in ms."""
+    durations: Dict[str, float] = {}
+    for name, seconds in stages:
+        durations[name] = durations.get(name, 0.0) + seconds
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in durations.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request latency per route and status, and adding a
+    ``Server-Timing`` header with the request's stages when ``timing_headers`` is set.
+    Streaming responses get the header for the stages finished before the first byte.
+    """
+
+    def __init__(self, app, registry: Registry = REGISTRY):
+        self.app = app
+        self.registry = registry
+        self._routes: Dict[Callable, str] = {}
+
+    def _route(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self._routes.get(endpoint)
+        if path is None:
+            router = getattr(scope.get("app"), "router", None)
+            path = next((route.path for route in getattr(router, "routes", ())
+                         if getattr(route, "endpoint", None) is endpoint), endpoint.__name__)
+            self._routes[endpoint] = path
+        return path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.registry.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        stages: Optional[List[Tuple[str, float]]] = [] if self.registry.timing_headers else None
+        token = _request_stages.set(stages)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if stages is not None:
+                    header = server_timing(stages, time.perf_counter() - start)
+                    message = {**message, "headers": list(message.get("headers", []))
+                               + [(b"server-timing", header.encode("latin-1"))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_stages.reset(token)
+            REQUEST_SECONDS.labels(scope["method"], self._route(scope), str(status)).observe(
+                time.perf_counter() - start
+            )
@@ -1,33 +1,68 @@
-import joblib
 import os
-import pandas as pd
+import warnings
 import numpy as np
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
+from learner_state import LearnerState, DEFAULT_HISTORY_FEATURES
+from forest_predictor import ForestPredictor
+from metrics import stage
 
-# Path to the trained model
+# Path to the trained model (the .npz export is preferred: it needs NumPy only)
+FOREST_PATH = os.path.join(os.path.dirname(__file__), "mastery_model.npz")
 MODEL_PATH = os.path.join(os.path.dirname(__file__), "mastery_model.pkl")
 FEATURES_PATH = os.path.join(os.path.dirname(__file__), "model_features.pkl")
 
+# Feature order produced by compute_features (used when no feature list is loaded)
+DEFAULT_FEATURES = [
+    'timeTaken', 'correct', 'attemptCount', 'hintCount', 'bottomHint', 'scaffold',
+    'frPast5HelpRequest', 'frPast8WrongCount', 'totalFrPercentPastWrong', 'AveCorrect', 'AveKnow',
+    'frTimeTakenOnScaffolding', 'efficiency', 'struggle_score', 'time_per_attempt'
+]
+
 class MLEngine:
-    def __init__(self):
+    def __init__(self, state_store=None):
+        """
+        Args:
+            state_store: Optional LearnerStore that persists learner histories across
+                restarts and workers; without it histories live in this process only
+        """
         self.model = None
         self.feature_names = None
-        self.user_histories = {}  # Store per-user interaction history
+        self.state_store = state_store
+        self.user_states: Dict[str, LearnerState] = {}  # Per-user rolling history features (no store)
         self.load_model()
 
+    @property
+    def user_histories(self) -> Dict[str, LearnerState]:
+        """Former name of ``user_states`` (histories are now LearnerStates rather than lists)."""
+        return self.user_states
+
     def load_model(self):
-        """Loads the trained model and feature list."""
-        if os.path.exists(MODEL_PATH):
+        """
+        Loads the trained model and feature list.
+        The compiled forest (mastery_model.npz) is used when present; the pickled
+        sklearn model (and with it joblib/sklearn) is only loaded as a fallback.
+        """
+        if os.path.exists(FOREST_PATH):
+            try:
+                self.model = ForestPredictor(FOREST_PATH)
+                self.feature_names = self.model.feature_names
+                print(f"ML Model loaded successfully from {FOREST_PATH} ({self.model.n_trees} trees)")
+            except Exception as e:
+                print(f"Error loading compiled model: {e}")
+                self.model = None
+        if self.model is None and os.path.exists(MODEL_PATH):
             try:
+                import joblib
                 self.model = joblib.load(MODEL_PATH)
                 print(f"ML Model loaded successfully from {MODEL_PATH}")
             except Exception as e:
                 print(f"Error loading ML model: {e}")
-        else:
+        elif self.model is None:
             print(f"Warning: ML model not found at {MODEL_PATH}")
         
-        if os.path.exists(FEATURES_PATH):
+        if not self.feature_names and os.path.exists(FEATURES_PATH):
             try:
+                import joblib
                 self.feature_names = joblib.load(FEATURES_PATH)
                 print(f"Feature list loaded: {len(self.feature_names)} features")
             except Exception as e:
@@ -37,33 +72,37 @@ class MLEngine:
     def update_user_history(self, user_id: str, interaction: Dict):
         """
         Store user interaction for computing historical features.
+        Only the last 20 interactions are kept, as running counts over fixed-size buffers.
         
         Args:
             user_id: Unique user identifier
-            interaction: Dict with keys: timeTaken, correct, attemptCount, hintCount, bottomHint, scaffold
+            interaction: Dict with keys: time_taken, correct, attempt_count, hint_count, bottom_hint, scaffold
         """
-        if user_id not in self.user_histories:
-            self.user_histories[user_id] = []
-        
-        self.user_histories[user_id].append(interaction)
-        
-        # Keep only last 20 interactions to save memory
-        if len(self.user_histories[user_id]) > 20:
-            self.user_histories[user_id] = self.user_histories[user_id][-20:]
+        self._record(user_id, [interaction])
 
-    def compute_features(self, user_id: str, current_interaction: Dict) -> Dict:
+    def _get_state(self, user_id: str) -> Tuple[Optional[LearnerState], int]:
+        if self.state_store is not None:
+            return self.state_store.get(user_id)
+        return self.user_states.get(user_id), 0
+
+    def _record(self, user_id: str, interactions: List[Dict],
+                current: Optional[Tuple[Optional[LearnerState], int]] = None):
         """
-        Compute all required features from user history + current interaction.
-        
-        Args:
-            user_id: User identifier
-            current_interaction: Current problem attempt data
-            
-        Returns:
-            Dict with all features needed by the model
+        Appends interactions to a user's history and hands the new state to the store.
+        ``current`` is the (state, version) the caller already fetched, saving a store lookup.
         """
-        history = self.user_histories.get(user_id, [])
-        
+        state, version = current if current is not None else self._get_state(user_id)
+        if state is None:
+            state = LearnerState()
+            if self.state_store is None:
+                self.user_states[user_id] = state
+        for interaction in interactions:
+            state.push(interaction)
+        if self.state_store is not None:
+            self.state_store.put(user_id, state, version + len(interactions))
+
+    @staticmethod
+    def _features(state: Optional[LearnerState], current_interaction: Dict) -> Dict:
         # Base features (from current interaction)
         features = {
             'timeTaken': current_interaction.get('time_taken', 0),
@@ -74,38 +113,8 @@ class MLEngine:
             'scaffold': current_interaction.get('scaffold', 0)
         }
         
-        # Compute historical features from past interactions
-        if len(history) > 0:
-            recent_5 = history[-5:]
-            recent_8 = history[-8:]
-            
-            # Help requests in past 5
-            features['frPast5HelpRequest'] = sum(1 for h in recent_5 if h.get('hint_count', 0) > 0) / max(len(recent_5), 1)
-            
-            # Wrong count in past 8
-            features['frPast8WrongCount'] = sum(1 for h in recent_8 if h.get('correct', 0) == 0)
-            
-            # Overall error rate
-            total_wrong = sum(1 for h in history if h.get('correct', 0) == 0)
-            features['totalFrPercentPastWrong'] = total_wrong / len(history)
-            
-            # Average correctness
-            features['AveCorrect'] = sum(h.get('correct', 0) for h in history) / len(history)
-            
-            # Average knowledge (proxy: recent correctness)
-            features['AveKnow'] = sum(h.get('correct', 0) for h in recent_5) / max(len(recent_5), 1)
-            
-            # Scaffolding time (if available)
-            scaffold_times = [h.get('time_taken', 0) for h in history if h.get('scaffold', 0) == 1]
-            features['frTimeTakenOnScaffolding'] = np.mean(scaffold_times) if scaffold_times else 0
-        else:
-            # Default values for new users (neutral/average)
-            features['frPast5HelpRequest'] = 0.3
-            features['frPast8WrongCount'] = 2
-            features['totalFrPercentPastWrong'] = 0.3
-            features['AveCorrect'] = 0.5
-            features['AveKnow'] = 0.5
-            features['frTimeTakenOnScaffolding'] = 0
+        # Historical features (defaults for new users)
+        features.update(state.features() if state is not None else DEFAULT_HISTORY_FEATURES)
         
         # Engineered features
         features['efficiency'] = features['correct'] / (features['attemptCount'] + 1)
@@ -114,6 +123,19 @@ class MLEngine:
         
         return features
 
+    def compute_features(self, user_id: str, current_interaction: Dict) -> Dict:
+        """
+        Compute all required features from user history + current interaction.
+        
+        Args:
+            user_id: User identifier
+            current_interaction: Current problem attempt data
+            
+        Returns:
+            Dict with all features needed by the model
+        """
+        return self._features(self._get_state(user_id)[0], current_interaction)
+
     def predict_mastery(self, user_id: str, time_taken: float, correct: int, 
                        attempt_count: int, hint_count: int, 
                        bottom_hint: int = 0, scaffold: int = 0) -> float:
@@ -133,13 +155,7 @@ class MLEngine:
             float: Predicted mastery score (0.0 to 1.0)
         """
         if not self.model:
-            # Fallback heuristic
-            score = 0.5
-            if correct == 1:
-                score += 0.3
-            score -= (attempt_count - 1) * 0.1
-            score -= hint_count * 0.1
-            return max(0.0, min(1.0, score))
+            return self._fallback_score(correct, attempt_count, hint_count)
 
         # Current interaction data
         current_interaction = {
@@ -151,22 +167,104 @@ class MLEngine:
             'scaffold': scaffold
         }
         
-        # Compute all features
-        feature_dict = self.compute_features(user_id, current_interaction)
-        
-        # Update history AFTER prediction (so next prediction uses this)
-        self.update_user_history(user_id, current_interaction)
+        with stage("mastery_features"):
+            # One store lookup: features come from the state before this interaction
+            current = self._get_state(user_id)
+            feature_dict = self._features(current[0], current_interaction)
+
+            # Update history AFTER prediction (so next prediction uses this)
+            self._record(user_id, [current_interaction], current)
         
-        # Create DataFrame with features in correct order
-        if self.feature_names:
-            feature_values = [feature_dict.get(fname, 0) for fname in self.feature_names]
-            features_df = pd.DataFrame([feature_values], columns=self.feature_names)
-        else:
-            features_df = pd.DataFrame([feature_dict])
+        # Features in the order the model was trained with
+        names = self.feature_names or DEFAULT_FEATURES
+        X = np.array([[feature_dict.get(fname, 0) for fname in names]], dtype=np.float64)
         
         try:
-            prediction = self.model.predict(features_df)[0]
-            return float(np.clip(prediction, 0.0, 1.0))
+            return float(np.clip(self._predict(X)[0], 0.0, 1.0))
         except Exception as e:
             print(f"Prediction error: {e}")
             return 0.5
+
+    def _predict(self, X: np.ndarray) -> np.ndarray:
+        """Runs the model on an (n, n_features) array."""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        with stage("mastery_model"):
+            if isinstance(self.model, ForestPredictor):
+                return self.model.predict(X)
+            with warnings.catch_warnings():
+                # The model was fitted on a DataFrame; a plain array in the same column order is equivalent
+                warnings.filterwarnings("ignore", message="X does not have valid feature names")
+                return self.model.predict(X)
+
+    @staticmethod
+    def _fallback_score(correct: int, attempt_count: int, hint_count: int) -> float:
+        """Heuristic used when no trained model is available."""
+        score = 0.5
+        if correct == 1:
+            score += 0.3
+        score -= (attempt_count - 1) * 0.1
+        score -= hint_count * 0.1
+        return max(0.0, min(1.0, score))
+
+    def compute_features_batch(self, user_id: str, interactions: List[Dict]) -> np.ndarray:
+        """
+        Features for a sequence of interactions, as if compute_features and
+        update_user_history were called for each one in order (the stored history is not changed).
+
+        Args:
+            user_id: User identifier
+            interactions: Problem attempts in order (same keys as compute_features)
+
+        Returns:
+            (n, n_features) float64 array in feature_names order
+        """
+        return self._features_batch(self._get_state(user_id)[0], interactions)
+
+    def _features_batch(self, state: Optional[LearnerState], interactions: List[Dict]) -> np.ndarray:
+        names = self.feature_names or DEFAULT_FEATURES
+        state = state.copy() if state is not None else LearnerState()
+        rows = np.zeros((len(interactions), len(names)))
+        for i, interaction in enumerate(interactions):
+            feature_dict = self._features(state, interaction)
+            rows[i] = [feature_dict.get(fname, 0) for fname in names]
+            state.push(interaction)
+        return rows
+
+    def predict_mastery_batch(self, user_id: str, interactions: List[Dict]) -> List[float]:
+        """
+        Predicts mastery for a whole submission with one model call.
+        Results (and the stored history) match calling predict_mastery once per interaction in order.
+
+        Args:
+            user_id: User identifier for history tracking
+            interactions: Dicts with time_taken, correct, attempt_count, hint_count,
+                and optionally bottom_hint, scaffold
+
+        Returns:
+            List of mastery scores (0.0 to 1.0), one per interaction
+        """
+        interactions = [{
+            'time_taken': i.get('time_taken', 0),
+            'correct': i.get('correct', 0),
+            'attempt_count': i.get('attempt_count', 1),
+            'hint_count': i.get('hint_count', 0),
+            'bottom_hint': i.get('bottom_hint', 0),
+            'scaffold': i.get('scaffold', 0)
+        } for i in interactions]
+        if not interactions:
+            return []
+
+        if not self.model:
+            return [self._fallback_score(i['correct'], i['attempt_count'], i['hint_count']) for i in interactions]
+
+        with stage("mastery_features"):
+            current = self._get_state(user_id)
+            X = self._features_batch(current[0], interactions)
+            self._record(user_id, interactions, current)
+
+        try:
+            predictions = self._predict(X)
+            return [float(v) for v in np.clip(predictions, 0.0, 1.0)]
+        except Exception as e:
+            print(f"Prediction error: {e}")
+            return [0.5] * len(interactions)
@@ -0,0 +1,205 @@
+"""
+Stand-in Ollama server for load tests and offline development.
+
+Implements the parts of the Ollama API the backend uses: ``/api/generate``
+and ``/api/chat``, each streaming (NDJSON) or not, plus ``/api/tags`` and
+``/api/version``. Timing follows a simple model of a CPU-hosted LLM:
+
+    prompt evaluation   prompt tokens / --prompt-rate
+    first token         + --latency
+    generation          response tokens / --token-rate
+
+At most ``--num-parallel`` requests are processed at once and the rest queue,
+like ``OLLAMA_NUM_PARALLEL``. Quiz prompts get a valid JSON quiz with the
+requested number of questions. Everything else gets Markdown filler of about
+--response-tokens tokens. ``--error-rate`` fails a fraction of requests with a
+500 to exercise the client's retries.
+
+Usage:
+    python mock_ollama.py --port 11434 --token-rate 20 --latency 0.3
+    OLLAMA_URL=http://localhost:11434 python server.py
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Overridden from the command line (see main)
+SETTINGS = {
+    "latency": 0.2,          # seconds before the first token
+    "token_rate": 25.0,      # generated tokens per second
+    "prompt_rate": 400.0,    # prompt tokens evaluated per second
+    "response_tokens": 200,  # length of non-quiz answers
+    "num_parallel": 4,       # requests processed concurrently
+    "error_rate": 0.0,       # fraction of requests failing with a 500
+}
+
+_WORDS = ("the derivative limit function integral rate change slope tangent area curve value "
+          "continuous example step rule apply result therefore consider notice").split()
+_QUIZ_COUNT = re.compile(r"(\d+)[- ]question|Quiz: (\d+) questions")
+
+app = FastAPI(title="Mock Ollama")
+_slots: Optional[asyncio.Semaphore] = None
+stats = {"requests": 0, "errors": 0, "in_flight": 0}
+
+
+def _tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _quiz(count: int, diagnostic: bool) -> str:
+    questions = []
+    for i in range(1, count + 1):
+        options = [f"Option {c}{i}" for c in "ABCD"]
+        question = {"id": i, "question": f"Mock question {i}?", "options": options}
+        if diagnostic:
+            question.update({"correct": options[1], "topic": random.choice(["Limits", "Derivatives", "Integration"])})
+        else:
+            question.update({"correctAnswer": options[1], "explanation": f"Explanation {i}."})
+        questions.append(question)
+    return json.dumps(questions)
+
+
+def _answer(prompt: str) -> List[str]:
+    """Response chunks (roughly one token each) for a prompt."""
+    if "quiz" in prompt.lower() and "JSON" in prompt:
+        match = _QUIZ_COUNT.search(prompt)
+        count = int(next(g for g in match.groups() if g)) if match else 5
+        text = _quiz(count, diagnostic="diagnostic" in prompt.lower())
+        return [text[i:i + 4] for i in range(0, len(text), 4)]
+    words = ["## Mock answer\n\n"] + [random.choice(_WORDS) + " " for _ in range(SETTINGS["response_tokens"])]
+    return words
+
+
+def _stats(prompt_tokens: int, eval_tokens: int, started: float, prompt_seconds: float, eval_seconds: float) -> Dict[str, Any]:
+    return {
+        "done": True,
+        "total_duration": int((time.monotonic() - started) * 1e9),
+        "load_duration": 0,
+        "prompt_eval_count": prompt_tokens,
+        "prompt_eval_duration": int(prompt_seconds * 1e9),
+        "eval_count": eval_tokens,
+        "eval_duration": int(eval_seconds * 1e9),
+    }
+
+
+async def _respond(body: Dict[str, Any], prompt: str, chat: bool):
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(SETTINGS["num_parallel"])
+    stats["requests"] += 1
+    if random.random() < SETTINGS["error_rate"]:
+        stats["errors"] += 1
+        return JSONResponse({"error": "mock failure"}, status_code=500)
+
+    model = body.get("model", "mock")
+    chunks = _answer(prompt)
+    prompt_tokens = _tokens(prompt)
+    prompt_seconds = prompt_tokens / SETTINGS["prompt_rate"]
+    token_delay = 1.0 / SETTINGS["token_rate"]
+
+    def piece(text: str) -> Dict[str, Any]:
+        if chat:
+            return {"model": model, "message": {"role": "assistant", "content": text}, "done": False}
+        return {"model": model, "response": text, "done": False}
+
+    def final(started: float, text: str = "") -> Dict[str, Any]:
+        result = {**piece(text), **_stats(prompt_tokens, len(chunks), started, prompt_seconds,
+                                          len(chunks) * token_delay)}
+        if not chat:
+            result["context"] = list(range(min(prompt_tokens + len(chunks), 64)))
+        return result
+
+    if body.get("stream", True):
+        async def events():
+            async with _slots:
+                stats["in_flight"] += 1
+                started = time.monotonic()
+                try:
+                    await asyncio.sleep(prompt_seconds + SETTINGS["latency"])
+                    for chunk in chunks:
+                        yield json.dumps(piece(chunk)) + "\n"
+                        await asyncio.sleep(token_delay)
+                    yield json.dumps(final(started)) + "\n"
+                finally:
+                    stats["in_flight"] -= 1
+        return StreamingResponse(events(), media_type="application/x-ndjson")
+
+    async with _slots:
+        stats["in_flight"] += 1
+        started = time.monotonic()
+        try:
+            await asyncio.sleep(prompt_seconds + SETTINGS["latency"] + len(chunks) * token_delay)
+        finally:
+            stats["in_flight"] -= 1
+    return final(started, "".join(chunks))
+
+
+@app.post("/api/generate")
+async def generate(request: Request):
+    body = await request.json()
+    return await _respond(body, body.get("prompt", ""), chat=False)
+
+
+@app.post("/api/chat")
+async def chat(request: Request):
+    body = await request.json()
+    prompt = "\n".join(m.get("content", "") for m in body.get("messages", []))
+    return await _respond(body, prompt, chat=True)
+
+
+@app.get("/api/tags")
+async def tags():
+    return {"models": [{"name": "llama3.1:8b", "model": "llama3.1:8b"}]}
+
+
+@app.get("/api/version")
+async def version():
+    return {"version": "mock"}
+
+
+@app.get("/mock/stats")
+async def mock_stats():
+    return {**stats, "settings": SETTINGS}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Ollama server for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", type=float, default=SETTINGS["latency"],
+                        help="Seconds before the first token (default: 0.2)")
+    parser.add_argument("--token-rate", type=float, default=SETTINGS["token_rate"],
+                        help="Generated tokens per second (default: 25)")
+    parser.add_argument("--prompt-rate", type=float, default=SETTINGS["prompt_rate"],
+                        help="Prompt tokens evaluated per second (default: 400)")
+    parser.add_argument("--response-tokens", type=int, default=SETTINGS["response_tokens"],
+                        help="Length of non-quiz answers in tokens (default: 200)")
+    parser.add_argument("--num-parallel", type=int, default=SETTINGS["num_parallel"],
+                        help="Requests processed at once, the rest queue (default: 4)")
+    parser.add_argument("--error-rate", type=float, default=SETTINGS["error_rate"],
+                        help="Fraction of requests failing with a 500 (default: 0)")
+    args = parser.parse_args()
+
+    SETTINGS.update({
+        "latency": max(0.0, args.latency),
+        "token_rate": max(0.1, args.token_rate),
+        "prompt_rate": max(1.0, args.prompt_rate),
+        "response_tokens": max(1, args.response_tokens),
+        "num_parallel": max(1, args.num_parallel),
+        "error_rate": min(1.0, max(0.0, args.error_rate)),
+    })
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
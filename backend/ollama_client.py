@@ -0,0 +1,228 @@
+"""
+Shared, connection-pooled client for the local Ollama server.
+
+One long-lived ``httpx.AsyncClient`` keeps connections alive between
+generations instead of opening a fresh TCP connection per call. A semaphore
+caps in-flight requests at Ollama's ``OLLAMA_NUM_PARALLEL`` so excess callers
+queue here rather than piling onto Ollama, and failed attempts are retried
+with exponential backoff plus full jitter.
+
+Queue wait and generation time are recorded as request stages (see
+metrics.py), together with retries, token counts and the generation speed
+Ollama reports (``eval_count`` / ``eval_duration``).
+"""
+
+import asyncio
+import json
+import logging
+import random
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+
+from metrics import REGISTRY, observe_stage, stage
+
+logger = logging.getLogger(__name__)
+
+OLLAMA_REQUESTS = REGISTRY.counter(
+    "classmate_ollama_requests_total", "Ollama calls by endpoint and outcome", ("endpoint", "outcome")
+)
+OLLAMA_RETRIES = REGISTRY.counter(
+    "classmate_ollama_retries_total", "Ollama attempts retried after a transient failure", ("endpoint",)
+)
+OLLAMA_TOKENS = REGISTRY.counter(
+    "classmate_ollama_tokens_total", "Tokens Ollama evaluated (prompt) or generated (eval)", ("endpoint", "kind")
+)
+OLLAMA_TOKENS_PER_SECOND = REGISTRY.histogram(
+    "classmate_ollama_tokens_per_second", "Generation speed reported by Ollama (eval_count / eval_duration)",
+    ("endpoint",), buckets=(1, 2, 5, 10, 15, 20, 30, 40, 60, 80, 120, 200)
+)
+OLLAMA_PHASE_SECONDS = REGISTRY.histogram(
+    "classmate_ollama_phase_seconds", "Time Ollama reports for model load, prompt evaluation and generation",
+    ("endpoint", "phase")
+)
+
+
+def _endpoint(path: str) -> str:
+    return path.rsplit("/", 1)[-1]
+
+
+def record_generation(path: str, result: Dict[str, Any]):
+    """Records the timing stats of Ollama's final (``done``) response or chunk."""
+    if not REGISTRY.enabled or not result.get("done"):
+        return
+    endpoint = _endpoint(path)
+    for phase, key in (("load", "load_duration"), ("prompt_eval", "prompt_eval_duration"), ("eval", "eval_duration")):
+        if result.get(key):
+            OLLAMA_PHASE_SECONDS.labels(endpoint, phase).observe(result[key] / 1e9)
+    OLLAMA_TOKENS.labels(endpoint, "prompt").inc(result.get("prompt_eval_count") or 0)
+    OLLAMA_TOKENS.labels(endpoint, "eval").inc(result.get("eval_count") or 0)
+    if result.get("eval_count") and result.get("eval_duration"):
+        OLLAMA_TOKENS_PER_SECOND.labels(endpoint).observe(result["eval_count"] / (result["eval_duration"] / 1e9))
+
+
+class OllamaClient:
+    def __init__(self, base_url: str = "http://localhost:11434", max_connections: int = 32,
+                 max_keepalive: int = 16, keepalive_expiry: float = 60.0,
+                 connect_timeout: float = 5.0, read_timeout: float = 120.0,
+                 num_parallel: int = 4, retries: int = 3,
+                 backoff_base: float = 0.5, backoff_max: float = 8.0, num_ctx: int = 0):
+        """
+        Args:
+            base_url: Ollama server URL
+            max_connections: Connection pool size
+            max_keepalive: Idle connections kept open
+            keepalive_expiry: Seconds an idle connection is kept
+            connect_timeout: Seconds to establish a connection
+            read_timeout: Seconds to wait for response data (generation time)
+            num_parallel: Concurrent requests allowed (match OLLAMA_NUM_PARALLEL)
+            retries: Default number of attempts per call
+            backoff_base: First retry delay ceiling in seconds (doubles per attempt)
+            backoff_max: Upper bound for the retry delay ceiling
+            num_ctx: Context window (tokens) requested on every call; 0 keeps the model's
+                default. One value for all calls, since Ollama reloads the model when it changes
+        """
+        self.base_url = base_url.rstrip("/")
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.num_parallel = max(1, num_parallel)
+        self.retries = max(1, retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.num_ctx = max(0, int(num_ctx))
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(base_url=self.base_url, limits=self.limits, timeout=self.timeout)
+            self._semaphore = asyncio.Semaphore(self.num_parallel)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._semaphore = None
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _with_options(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        if not self.num_ctx:
+            return payload
+        return {**payload, "options": {**payload.get("options", {}), "num_ctx": self.num_ctx}}
+
+    @staticmethod
+    def _retryable(error: Exception) -> bool:
+        if isinstance(error, httpx.HTTPStatusError):
+            status = error.response.status_code
+            return status >= 500 or status == 429
+        return isinstance(error, (httpx.TransportError, ValueError))
+
+    async def post(self, path: str, payload: Dict[str, Any], retries: Optional[int] = None) -> Dict[str, Any]:
+        """POSTs a JSON payload and returns the decoded JSON body, retrying transient failures."""
+        await self.start()
+        retries = retries or self.retries
+        payload = self._with_options(payload)
+        endpoint = _endpoint(path)
+
+        for attempt in range(retries):
+            try:
+                queued = time.perf_counter()
+                async with self._semaphore:
+                    observe_stage("ollama_queue", time.perf_counter() - queued)
+                    with stage("ollama_generate"):
+                        response = await self._client.post(path, json=payload)
+                        response.raise_for_status()
+                        result = response.json()
+                OLLAMA_REQUESTS.labels(endpoint, "ok").inc()
+                record_generation(path, result)
+                return result
+            except Exception as e:
+                logger.warning(f"Ollama API error (Attempt {attempt+1}/{retries}): {e}")
+                if attempt == retries - 1 or not self._retryable(e):
+                    OLLAMA_REQUESTS.labels(endpoint, "error").inc()
+                    raise
+                OLLAMA_RETRIES.labels(endpoint).inc()
+                await asyncio.sleep(self._backoff(attempt))
+
+    async def generate(self, prompt: str, model: str, retries: Optional[int] = None) -> str:
+        """Non-streaming /api/generate; returns the completion text."""
+        result = await self.post(
+            "/api/generate",
+            {"model": model, "prompt": prompt, "stream": False},
+            retries=retries
+        )
+        return result.get("response", "")
+
+    async def chat(self, messages: List[Dict[str, str]], model: str, keep_alive: Optional[str] = None,
+                   retries: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Non-streaming /api/chat; returns Ollama's response (``message.content`` is the
+        reply, ``prompt_eval_count`` the prompt tokens that had to be evaluated).
+        """
+        payload = {"model": model, "messages": messages, "stream": False}
+        if keep_alive:
+            payload["keep_alive"] = keep_alive
+        return await self.post("/api/chat", payload, retries=retries)
+
+    async def stream(self, path: str, payload: Dict[str, Any], retries: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        POSTs with ``"stream": true`` and yields each NDJSON chunk as it arrives.
+        Connection failures are retried only until the first chunk has been yielded.
+        Closing the generator (e.g. the client disconnected) closes the upstream
+        connection, which makes Ollama abort the generation.
+        """
+        await self.start()
+        retries = retries or self.retries
+        payload = self._with_options({**payload, "stream": True})
+        endpoint = _endpoint(path)
+
+        for attempt in range(retries):
+            started = False
+            try:
+                queued = time.perf_counter()
+                async with self._semaphore:
+                    sent = time.perf_counter()
+                    observe_stage("ollama_queue", sent - queued)
+                    async with self._client.stream("POST", path, json=payload) as response:
+                        response.raise_for_status()
+                        async for line in response.aiter_lines():
+                            if not line.strip():
+                                continue
+                            chunk = json.loads(line)
+                            if chunk.get("error"):
+                                raise RuntimeError(chunk["error"])
+                            if not started:
+                                observe_stage("ollama_first_token", time.perf_counter() - sent)
+                                started = True
+                            if chunk.get("done"):
+                                observe_stage("ollama_generate", time.perf_counter() - sent)
+                                record_generation(path, chunk)
+                            yield chunk
+                OLLAMA_REQUESTS.labels(endpoint, "ok").inc()
+                return
+            except Exception as e:
+                logger.warning(f"Ollama stream error (Attempt {attempt+1}/{retries}): {e}")
+                if started or attempt == retries - 1 or not self._retryable(e):
+                    OLLAMA_REQUESTS.labels(endpoint, "error").inc()
+                    raise
+                OLLAMA_RETRIES.labels(endpoint).inc()
+                await asyncio.sleep(self._backoff(attempt))
+
+    def generate_stream(self, prompt: str, model: str, retries: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Streaming /api/generate; yields Ollama's chunks (``response`` text, final ``done`` stats)."""
+        return self.stream("/api/generate", {"model": model, "prompt": prompt}, retries=retries)
+
+    def chat_stream(self, messages: List[Dict[str, str]], model: str, keep_alive: Optional[str] = None,
+                    retries: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Streaming /api/chat; yields Ollama's chunks (``message.content`` text, final ``done`` stats)."""
+        payload = {"model": model, "messages": messages}
+        if keep_alive:
+            payload["keep_alive"] = keep_alive
+        return self.stream("/api/chat", payload, retries=retries)
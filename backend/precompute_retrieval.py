@@ -0,0 +1,168 @@
+"""
+Precompute RAG retrieval results for the fixed template queries.
+
+The chapter and quiz generators only ever search for
+``topics.QUERY_TEMPLATES`` filled in with a known (topic, subtopic) pair, so
+their top-k FAISS hits can be computed once at index build time and written
+next to ``faiss_index.bin``. The server reads them at startup and answers
+those queries with no encode and no index scan.
+
+The file records the size and modification time of the index and metadata
+files, plus the embedding model name and the index's nprobe/efSearch (hits
+are computed with the server's FAISS_* settings); if any of them changes the
+precomputed results are ignored until this script is run again. Checking them is two
+``stat`` calls, so startup cost does not grow with the index; hashing a
+million-vector index would take seconds on every start.
+
+Usage:
+    python precompute_retrieval.py [--k 10]
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from query_cache import normalize_query
+from topics import template_queries
+
+logger = logging.getLogger(__name__)
+
+PRECOMPUTED_FILENAME = "faiss_precomputed.json"
+
+
+def precomputed_path(index_path: str) -> str:
+    """Location of the precomputed results for a given index file."""
+    return os.path.join(os.path.dirname(index_path), PRECOMPUTED_FILENAME)
+
+
+def file_fingerprint(path: str) -> str:
+    """``size:mtime_ns`` of a file; changes whenever the file is rewritten (or replaced)."""
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def search_knobs(index_type: str, nprobe: int, ef_search: int) -> Dict[str, int]:
+    """The search settings that affect an index type's hits (none for flat)."""
+    if index_type.startswith("ivf"):
+        return {"nprobe": nprobe}
+    if index_type == "hnsw":
+        return {"ef_search": ef_search}
+    return {}
+
+
+def _fingerprints(index_path: str, meta_path: str, model_name: str,
+                  search: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    return {
+        "index": file_fingerprint(index_path),
+        "metadata": file_fingerprint(meta_path),
+        "model": model_name,
+        "search": search or {},
+    }
+
+
+def build_precomputed(index, encode_fn, index_path: str, meta_path: str, model_name: str,
+                      k: int = 10, out_path: Optional[str] = None,
+                      search: Optional[Dict[str, int]] = None) -> str:
+    """
+    Embeds every template query in one batch, searches them in one call and writes the hits.
+
+    Args:
+        index: Loaded FAISS index, configured like the server's (``configure_search``)
+        encode_fn: Callable embedding a list of texts into a 2-D array
+        index_path: Path of the index file (for the fingerprint and default output location)
+        meta_path: Path of the metadata file (for the fingerprint)
+        model_name: Embedding model used for queries
+        k: Number of hits stored per query
+        out_path: Output path (defaults to ``precomputed_path(index_path)``)
+        search: ``search_knobs`` the index was configured with (for the fingerprint)
+
+    Returns:
+        The path written
+    """
+    out_path = out_path or precomputed_path(index_path)
+    queries = sorted({normalize_query(q) for q in template_queries()})
+
+    vectors = np.asarray(encode_fn(queries), dtype=np.float32)
+    D, I = index.search(vectors, k)
+
+    results = {}
+    for q, ids, scores in zip(queries, I, D):
+        valid = ids >= 0
+        results[q] = {"ids": ids[valid].tolist(), "scores": scores[valid].tolist()}
+
+    payload = {
+        "fingerprint": _fingerprints(index_path, meta_path, model_name, search),
+        "k": k,
+        "results": results,
+    }
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f)
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+def load_precomputed(index_path: str, meta_path: str, model_name: str,
+                     path: Optional[str] = None,
+                     search: Optional[Dict[str, int]] = None) -> Optional[Dict[str, Tuple[np.ndarray, np.ndarray]]]:
+    """
+    Loads precomputed hits keyed by normalized query text. Returns None when the file is
+    missing or was built for a different index/metadata/model or search settings.
+    """
+    path = path or precomputed_path(index_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+    except Exception as e:
+        logger.warning(f"Could not read precomputed retrieval results {path}: {e}")
+        return None
+
+    if payload.get("fingerprint") != _fingerprints(index_path, meta_path, model_name, search):
+        logger.warning(f"Precomputed retrieval results {path} are stale; "
+                       f"re-run precompute_retrieval.py to rebuild them")
+        return None
+
+    return {
+        query: (np.asarray(hit["ids"], dtype=np.int64), np.asarray(hit["scores"], dtype=np.float32))
+        for query, hit in payload["results"].items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute top-k hits for the template RAG queries")
+    parser.add_argument("--k", type=int, default=10, help="Hits stored per query (default: 10)")
+    parser.add_argument("--out", default=None, help=f"Output path (default: {PRECOMPUTED_FILENAME} next to the index)")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from sentence_transformers import SentenceTransformer
+    from build_index import EMBEDDING_MODEL, METADATA_PATH, configure_search, index_path_for, load_index, search_settings
+
+    # Same index, file and search settings as the server
+    load_dotenv()
+    index_type, nprobe, ef_search = search_settings()
+    index_path = index_path_for(index_type)
+
+    start = time.time()
+    index = load_index(index_path)
+    configure_search(index, nprobe=nprobe, ef_search=ef_search)
+    model = SentenceTransformer(EMBEDDING_MODEL, device="cpu")
+    out_path = build_precomputed(
+        index,
+        lambda texts: model.encode(texts, show_progress_bar=False),
+        index_path, METADATA_PATH, EMBEDDING_MODEL,
+        k=args.k, out_path=args.out, search=search_knobs(index_type, nprobe, ef_search)
+    )
+    print(f"Wrote precomputed hits for {len(set(map(normalize_query, template_queries())))} template queries "
+          f"to {out_path} in {time.time() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Pre-render learning chapters into the shared cache store.
+
+Renders the chapter for every topic × subtopic × difficulty through the same
+retrieval and prompt as /generate_learning_chapter and stores it in cache.db,
+so opening a study chapter is a cache read. Chapters that are already cached
+and fresh (same prompt template and retrieved context, younger than
+CHAPTER_CACHE_TTL) are skipped, so the script is resumable and can be re-run
+after corpus or prompt changes to re-render only what is out of date.
+
+Usage:
+    python prerender_chapters.py --topics curriculum --difficulties Easy Medium Hard --concurrency 4
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Dict, List
+
+import server
+from server import (
+    ChapterRequest, chapter_context, chapter_fingerprint, chapter_is_fresh, load_components,
+    render_chapter, store_chapter, CACHE_DB_PATH, OLLAMA_NUM_PARALLEL
+)
+from topics import CALCULUS_TOPICS, CURRICULUM_TOPICS
+from cache_store import CHAPTER_NAMESPACE, chapter_cache_key
+
+TOPIC_SETS = {"calculus": CALCULUS_TOPICS, "curriculum": CURRICULUM_TOPICS}
+DIFFICULTIES = ["Easy", "Medium", "Hard"]
+
+
+async def prerender_all(topics: Dict[str, List[str]], difficulties: List[str],
+                        concurrency: int = OLLAMA_NUM_PARALLEL, force: bool = False):
+    """Renders every missing or stale chapter and saves it to the cache store."""
+    load_components("index", "metadata", "embedder", "precomputed")
+    store = server._cache_store()
+    print(f"Loaded existing cache with {store.count(CHAPTER_NAMESPACE)} chapters.")
+
+    requests = [
+        ChapterRequest(topic=topic, subtopic=subtopic, difficulty=difficulty)
+        for topic, subtopics in topics.items()
+        for subtopic in subtopics
+        for difficulty in difficulties
+    ]
+    semaphore = asyncio.Semaphore(concurrency)
+    rendered, skipped = 0, 0
+    failed = []
+    start = time.time()
+
+    async def run(req: ChapterRequest):
+        nonlocal rendered, skipped
+        label = f"{req.topic} - {req.subtopic} ({req.difficulty})"
+        search_query, context_docs = await chapter_context(req)
+        fingerprint = chapter_fingerprint(context_docs)
+        entry = store.get(CHAPTER_NAMESPACE, chapter_cache_key(req.topic, req.subtopic, req.difficulty))
+        if entry is not None and not force and chapter_is_fresh(entry, fingerprint):
+            skipped += 1
+            return
+
+        async with semaphore:
+            try:
+                chapter = await render_chapter(req, search_query, context_docs)
+            except Exception as e:
+                failed.append(label)
+                print(f"  ❌ Failed: {label}: {e}")
+                return
+        if not chapter["content"].strip():
+            failed.append(label)
+            print(f"  ❌ Empty chapter: {label}")
+            return
+        # Each chapter is committed on its own, so an interrupted run resumes where it stopped
+        await asyncio.to_thread(store_chapter, req, fingerprint, chapter)
+        rendered += 1
+        rate = rendered / max(time.time() - start, 1e-6) * 60
+        print(f"  [{rendered + len(failed)}] ✅ {label}  ({rate:.1f} chapters/min)")
+
+    await asyncio.gather(*(run(req) for req in requests))
+
+    elapsed = time.time() - start
+    print(f"\n✅ Pre-rendering complete! {len(requests)} chapters requested, {skipped} already fresh, "
+          f"{rendered} rendered in {elapsed:.1f}s; {store.count(CHAPTER_NAMESPACE)} chapters in {CACHE_DB_PATH}")
+    if failed:
+        print(f"❌ {len(failed)} failed (re-run to retry):")
+        for label in failed:
+            print(f"   - {label}")
+    store.close()
+
+
+async def _run(**kwargs):
+    try:
+        await prerender_all(**kwargs)
+    finally:
+        await server.close_clients()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-render learning chapters into the shared cache store")
+    parser.add_argument("--topics", choices=sorted(TOPIC_SETS), default="curriculum",
+                        help="Topic list to cover (default: curriculum, the frontend chapters)")
+    parser.add_argument("--difficulties", nargs="+", choices=DIFFICULTIES, default=["Medium"],
+                        help="Difficulties to render (default: Medium)")
+    parser.add_argument("--concurrency", type=int, default=OLLAMA_NUM_PARALLEL,
+                        help=f"Generations in flight (default: OLLAMA_NUM_PARALLEL={OLLAMA_NUM_PARALLEL})")
+    parser.add_argument("--force", action="store_true", help="Re-render chapters that are still fresh")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("Chapter Pre-renderer")
+    print("=" * 60)
+    asyncio.run(_run(
+        topics=TOPIC_SETS[args.topics], difficulties=args.difficulties,
+        concurrency=max(1, args.concurrency), force=args.force
+    ))
+
+
+if __name__ == "__main__":
+    main()
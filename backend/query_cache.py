@@ -0,0 +1,187 @@
+"""
+Query-embedding cache for the RAG retrieval path.
+
+Maps normalized query text to its embedding vector and to the top-k FAISS
+hits, so repeated retrievals skip the transformer (and, when the hits are
+cached, the index scan too). Bounded by entry count with LRU eviction and an
+optional TTL. Vectors can be persisted, together with their keys, to a single
+file (``.npz`` format) so the cache survives restarts; hits are not persisted
+because they depend on the index they were computed against.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(text: str) -> str:
+    """Lowercases and collapses whitespace so trivially different queries share a key."""
+    return " ".join(text.lower().split())
+
+
+class _Entry:
+    __slots__ = ("vector", "ids", "scores", "expires_at")
+
+    def __init__(self, vector: Optional[np.ndarray], expires_at: Optional[float]):
+        self.vector = vector
+        self.ids: Optional[np.ndarray] = None
+        self.scores: Optional[np.ndarray] = None
+        self.expires_at = expires_at
+
+
+class QueryCache:
+    def __init__(self, max_entries: int = 4096, ttl_seconds: float = 0, path: Optional[str] = None):
+        """
+        Args:
+            max_entries: Maximum number of cached queries (LRU eviction beyond it)
+            ttl_seconds: Entry lifetime in seconds; 0 disables expiry
+            path: Optional ``.npy`` path used by ``load()``/``save()``
+        """
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl_seconds)
+        self.path = path
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.vector_hits = 0
+        self.vector_misses = 0
+        self.result_hits = 0
+        self.result_misses = 0
+        self.evictions = 0
+
+    def _get(self, key: str) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at is not None and entry.expires_at < time.monotonic():
+            del self._entries[key]
+            self.evictions += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _get_or_create(self, key: str) -> _Entry:
+        entry = self._get(key)
+        if entry is None:
+            expires_at = time.monotonic() + self.ttl if self.ttl > 0 else None
+            entry = _Entry(None, expires_at)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def get_vector(self, query: str) -> Optional[np.ndarray]:
+        key = normalize_query(query)
+        with self._lock:
+            entry = self._get(key)
+            if entry is None or entry.vector is None:
+                self.vector_misses += 1
+                return None
+            self.vector_hits += 1
+            return entry.vector
+
+    def put_vector(self, query: str, vector: np.ndarray):
+        key = normalize_query(query)
+        with self._lock:
+            self._get_or_create(key).vector = np.asarray(vector, dtype=np.float32)
+
+    @staticmethod
+    def _hits_key(query: str, scope: str) -> str:
+        key = normalize_query(query)
+        return f"{key}\x00{scope}" if scope else key
+
+    def get_hits(self, query: str, limit: int, scope: str = "") -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Returns cached (ids, scores) for the top ``limit`` hits.
+        A cached top-k also answers any smaller limit, since exact top-k lists are prefixes.
+        ``scope`` separates result lists for the same query (e.g. different search filters).
+        """
+        key = self._hits_key(query, scope)
+        with self._lock:
+            entry = self._get(key)
+            if entry is None or entry.ids is None or len(entry.ids) < limit:
+                self.result_misses += 1
+                return None
+            self.result_hits += 1
+            return entry.ids[:limit], entry.scores[:limit]
+
+    def put_hits(self, query: str, ids: np.ndarray, scores: np.ndarray, scope: str = ""):
+        key = self._hits_key(query, scope)
+        with self._lock:
+            entry = self._get_or_create(key)
+            # Keep the deepest result list seen so far
+            if entry.ids is None or len(ids) >= len(entry.ids):
+                entry.ids = np.asarray(ids, dtype=np.int64)
+                entry.scores = np.asarray(scores, dtype=np.float32)
+
+    def clear_hits(self):
+        """Drops cached hits (e.g. after the index is swapped), keeping vectors."""
+        with self._lock:
+            for entry in self._entries.values():
+                entry.ids = None
+                entry.scores = None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            vector_total = self.vector_hits + self.vector_misses
+            result_total = self.result_hits + self.result_misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "vector_hits": self.vector_hits,
+                "vector_misses": self.vector_misses,
+                "vector_hit_ratio": self.vector_hits / vector_total if vector_total else 0.0,
+                "result_hits": self.result_hits,
+                "result_misses": self.result_misses,
+                "result_hit_ratio": self.result_hits / result_total if result_total else 0.0,
+                "evictions": self.evictions,
+            }
+
+    def save(self, path: Optional[str] = None) -> int:
+        """Writes the cached vectors and their keys to ``path`` (one .npz file). Returns the count."""
+        path = path or self.path
+        if not path:
+            return 0
+        with self._lock:
+            items = [(k, e.vector) for k, e in self._entries.items() if e.vector is not None]
+        if not items:
+            return 0
+
+        keys = [k for k, _ in items]
+        vectors = np.stack([v for _, v in items]).astype(np.float32)
+        # Keys and vectors go into one file, replaced atomically, so they can never be paired
+        # from different saves. Keys are stored as UTF-8 JSON bytes (no pickling on load).
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, vectors=vectors, keys=np.frombuffer(json.dumps(keys).encode("utf-8"), dtype=np.uint8))
+        os.replace(tmp_path, path)
+        return len(keys)
+
+    def load(self, path: Optional[str] = None) -> int:
+        """Loads vectors saved by ``save()``. Returns the number of entries loaded."""
+        path = path or self.path
+        if not path or not os.path.exists(path):
+            return 0
+        try:
+            with np.load(path) as data:
+                vectors = data["vectors"]
+                keys = json.loads(data["keys"].tobytes().decode("utf-8"))
+        except Exception as e:
+            logger.warning(f"Could not load query cache from {path}: {e}")
+            return 0
+        if len(keys) != len(vectors):
+            logger.warning(f"Query cache at {path} is inconsistent, ignoring it")
+            return 0
+
+        # Oldest first, so the most recently used keys end up at the LRU tail
+        for key, vector in list(zip(keys, vectors))[-self.max_entries:]:
+            self.put_vector(key, vector)
+        return min(len(keys), self.max_entries)
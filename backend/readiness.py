@@ -0,0 +1,76 @@
+"""
+Per-component readiness registry for staged startup.
+
+The server loads its components (ML engine, FAISS index, corpus metadata,
+embedding model, ...) concurrently in background threads. Each loader runs
+through ``Readiness.run``, which records its state (pending, loading, ready
+or failed), load time and error. Endpoints check only the components they
+need, and ``/readyz`` reports the whole table.
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+
+class Readiness:
+    def __init__(self, components: Iterable[str] = ()):
+        self._lock = threading.Lock()
+        self._components: Dict[str, Dict[str, Any]] = {}
+        self.started_at = time.monotonic()
+        self.register(*components)
+
+    def register(self, *names: str):
+        with self._lock:
+            for name in names:
+                self._components.setdefault(name, {"status": PENDING})
+
+    def _set(self, name: str, **fields):
+        with self._lock:
+            self._components.setdefault(name, {}).update(fields)
+
+    def run(self, name: str, loader: Callable[[], Any]) -> Any:
+        """Runs a component loader, recording its status and timing. Re-raises loader errors."""
+        self._set(name, status=LOADING, error=None)
+        start = time.monotonic()
+        try:
+            result = loader()
+        except Exception as e:
+            self._set(name, status=FAILED, error=str(e), seconds=round(time.monotonic() - start, 3))
+            logger.error(f"Component '{name}' failed to load: {e}")
+            raise
+        seconds = round(time.monotonic() - start, 3)
+        self._set(name, status=READY, seconds=seconds)
+        logger.info(f"Component '{name}' ready in {seconds:.2f}s")
+        return result
+
+    def start(self, name: str, loader: Callable[[], Any]) -> threading.Thread:
+        """Runs ``run(name, loader)`` on a background thread."""
+        def target():
+            try:
+                self.run(name, loader)
+            except Exception:
+                pass  # recorded as failed
+        thread = threading.Thread(target=target, name=f"load-{name}", daemon=True)
+        thread.start()
+        return thread
+
+    def missing(self, *names: str) -> List[str]:
+        """Components among ``names`` that are not ready."""
+        with self._lock:
+            return [n for n in names if self._components.get(n, {}).get("status") != READY]
+
+    def is_ready(self, *names: str) -> bool:
+        return not self.missing(*(names or tuple(self._components)))
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {name: dict(state) for name, state in self._components.items()}
@@ -0,0 +1,148 @@
+"""
+Metadata filters for vector search.
+
+``FilterIndex`` keeps, for each filterable metadata field, a sorted array of
+FAISS row ids per value. A filter (values OR-ed within a field, fields AND-ed)
+resolves to the allowed ids, which are handed to FAISS as an ``IDSelector`` so
+the restriction is applied inside the search: vectors outside the filter are
+skipped rather than scored, and the top-k is taken over matching chunks only,
+with no over-fetching and post-filtering.
+"""
+
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+FILTER_FIELDS = ("topic", "chapter", "difficulty", "content_type", "source")
+
+
+def _normalize_value(field: str, value: Any):
+    if field == "chapter":
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+    return str(value).strip().lower() if value is not None else None
+
+
+def normalize_filters(filters: Optional[Dict[str, Any]]) -> Dict[str, Tuple]:
+    """Drops empty fields and turns every value into a sorted tuple of normalized values."""
+    normalized = {}
+    for field in FILTER_FIELDS:
+        value = (filters or {}).get(field)
+        if value is None or value == [] or value == "":
+            continue
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        normalized[field] = tuple(sorted({_normalize_value(field, v) for v in values}, key=str))
+    return normalized
+
+
+def filters_key(filters: Dict[str, Tuple]) -> str:
+    """Stable string for a normalized filter, used as a cache scope."""
+    return ";".join(f"{field}={','.join(map(str, values))}" for field, values in sorted(filters.items()))
+
+
+def search_params(index: faiss.Index, selector: faiss.IDSelector) -> faiss.SearchParameters:
+    """SearchParameters carrying the selector plus the index's own nprobe/efSearch."""
+    if hasattr(index, "nprobe"):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+    if hasattr(index, "hnsw"):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+class FilterBuilder:
+    """Collects the row ids per field value, record by record in FAISS row order."""
+
+    def __init__(self):
+        self.rows = 0
+        self.postings = {field: defaultdict(list) for field in FILTER_FIELDS}
+
+    def add(self, item: Dict):
+        for field in FILTER_FIELDS:
+            value = _normalize_value(field, item.get(field))
+            if value is not None:
+                self.postings[field][value].append(self.rows)
+        self.rows += 1
+
+    def build(self, max_cached_selectors: int = 256) -> "FilterIndex":
+        postings = {
+            field: {value: np.asarray(rows, dtype=np.int64) for value, rows in values.items()}
+            for field, values in self.postings.items()
+        }
+        return FilterIndex(postings, max_cached_selectors)
+
+
+class FilterIndex:
+    def __init__(self, postings: Dict[str, Dict[Any, np.ndarray]], max_cached_selectors: int = 256):
+        """
+        Args:
+            postings: Field -> normalized value -> sorted row ids
+            max_cached_selectors: Number of resolved filters kept (LRU)
+        """
+        self._postings = postings
+        self._cache: "OrderedDict[str, Tuple[np.ndarray, faiss.IDSelector]]" = OrderedDict()
+        self._max_cached = max_cached_selectors
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict], max_cached_selectors: int = 256) -> "FilterIndex":
+        """Builds the index from metadata records in FAISS row order."""
+        builder = FilterBuilder()
+        for item in records:
+            builder.add(item)
+        return builder.build(max_cached_selectors)
+
+    def state(self) -> Tuple[Dict[str, np.ndarray], Dict]:
+        """Arrays (per field, CSR over its values) and the value lists, for ``from_state``."""
+        arrays: Dict[str, np.ndarray] = {}
+        fields: Dict[str, List] = {}
+        for field, values in self._postings.items():
+            fields[field] = list(values)
+            lengths = [len(rows) for rows in values.values()]
+            indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=indptr[1:])
+            arrays[f"{field}.indptr"] = indptr
+            arrays[f"{field}.rows"] = (np.concatenate(list(values.values())) if values
+                                       else np.empty(0, dtype=np.int64))
+        return arrays, fields
+
+    @classmethod
+    def from_state(cls, arrays: Dict[str, np.ndarray], fields: Dict,
+                   max_cached_selectors: int = 256) -> "FilterIndex":
+        postings = {}
+        for field, values in fields.items():
+            indptr, rows = arrays[f"{field}.indptr"], arrays[f"{field}.rows"]
+            postings[field] = {value: rows[indptr[i]:indptr[i + 1]] for i, value in enumerate(values)}
+        return cls(postings, max_cached_selectors)
+
+    def allowed_ids(self, filters: Dict[str, Tuple]) -> np.ndarray:
+        """Sorted row ids matching a normalized filter."""
+        allowed = None
+        for field, values in filters.items():
+            field_rows = [self._postings[field][v] for v in values if v in self._postings[field]]
+            rows = np.unique(np.concatenate(field_rows)) if field_rows else np.empty(0, dtype=np.int64)
+            allowed = rows if allowed is None else np.intersect1d(allowed, rows, assume_unique=True)
+            if len(allowed) == 0:
+                break
+        return allowed if allowed is not None else np.empty(0, dtype=np.int64)
+
+    def selector(self, filters: Dict[str, Tuple]) -> Tuple[np.ndarray, faiss.IDSelector]:
+        """Allowed ids and a FAISS selector over them, cached per filter."""
+        key = filters_key(filters)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached
+
+        ids = self.allowed_ids(filters)
+        entry = (ids, faiss.IDSelectorBatch(ids))
+        with self._lock:
+            self._cache[key] = entry
+            while len(self._cache) > self._max_cached:
+                self._cache.popitem(last=False)
+        return entry
@@ -0,0 +1,167 @@
+"""
+Semantic response cache for LLM answers.
+
+Students ask the same question in different words ("what's the chain rule",
+"explain chain rule pls"). Each cached answer is stored with the embedding of
+the question that produced it; a new question is answered from the cache when
+its embedding is within a cosine threshold of a cached one.
+
+Entries are partitioned into buckets (e.g. chat answers per grade/subject/difficulty,
+hints per topic/subtopic) so an answer is only reused for the audience it was
+written for. Each bucket has its own small ``IndexFlatIP`` behind an
+``IndexIDMap2`` (vectors are normalized, so inner product is cosine
+similarity); entries are evicted LRU across all buckets, with an optional TTL.
+
+An entry may also carry an exact ``key``: a lookup that passes a key only
+matches the entry stored with the same key in that bucket, found by a dict
+lookup rather than among the nearest neighbours (in a dense bucket the exact
+match need not be among them). Hints use it because two questions that
+differ in one expression ("x^2" vs "x^3") embed almost identically but need
+different answers.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import faiss
+import numpy as np
+
+
+class _Entry:
+    __slots__ = ("bucket", "payload", "expires_at", "key")
+
+    def __init__(self, bucket: str, payload: Any, expires_at: Optional[float], key: Optional[str] = None):
+        self.bucket = bucket
+        self.payload = payload
+        self.expires_at = expires_at
+        self.key = key
+
+
+class SemanticCache:
+    def __init__(self, dim: int, threshold: float = 0.92, max_entries: int = 2048,
+                 ttl_seconds: float = 0, candidates: int = 4):
+        """
+        Args:
+            dim: Embedding dimension
+            threshold: Minimum cosine similarity for a hit
+            max_entries: Maximum cached answers across all buckets (LRU eviction beyond it)
+            ttl_seconds: Entry lifetime in seconds; 0 disables expiry
+            candidates: Nearest entries checked per lookup (skips expired ones)
+        """
+        self.dim = dim
+        self.threshold = threshold
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl_seconds)
+        self.candidates = max(1, candidates)
+        self._indexes: Dict[str, faiss.IndexIDMap2] = {}
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._keys: Dict[Tuple[str, str], int] = {}  # (bucket, key) -> entry id
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _as_row(vector: np.ndarray) -> np.ndarray:
+        return np.ascontiguousarray(np.asarray(vector, dtype=np.float32).reshape(1, -1))
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        if entry.key is not None and self._keys.get((entry.bucket, entry.key)) == entry_id:
+            del self._keys[(entry.bucket, entry.key)]
+        index = self._indexes[entry.bucket]
+        index.remove_ids(np.asarray([entry_id], dtype=np.int64))
+        if index.ntotal == 0:
+            del self._indexes[entry.bucket]
+
+    def _lookup_key(self, bucket: str, vector: np.ndarray, key: str) -> Optional[Tuple[Any, float]]:
+        entry_id = self._keys.get((bucket, key))
+        if entry_id is None:
+            return None
+        entry = self._entries[entry_id]
+        if entry.expires_at is not None and entry.expires_at < time.monotonic():
+            self._remove(entry_id)
+            self.evictions += 1
+            return None
+        score = float(self._indexes[bucket].reconstruct(entry_id) @ self._as_row(vector)[0])
+        if score < self.threshold:
+            return None
+        self._entries.move_to_end(entry_id)
+        return entry.payload, score
+
+    def lookup(self, bucket: str, vector: np.ndarray, key: Optional[str] = None) -> Optional[Tuple[Any, float]]:
+        """
+        Returns (payload, similarity) of the closest live entry in the bucket within
+        the threshold, or None. With a key, only the entry stored under that key is
+        considered. Payloads are shared; do not mutate them.
+        """
+        with self._lock:
+            if key is not None:
+                hit = self._lookup_key(bucket, vector, key)
+                if hit is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                return hit
+            index = self._indexes.get(bucket)
+            if index is None:
+                self.misses += 1
+                return None
+            scores, ids = index.search(self._as_row(vector), min(self.candidates, index.ntotal))
+            now = time.monotonic()
+            for score, entry_id in zip(scores[0], ids[0]):
+                if entry_id < 0 or score < self.threshold:
+                    break
+                entry = self._entries[int(entry_id)]
+                if entry.expires_at is not None and entry.expires_at < now:
+                    self._remove(int(entry_id))
+                    self.evictions += 1
+                    continue
+                self._entries.move_to_end(int(entry_id))
+                self.hits += 1
+                return entry.payload, float(score)
+            self.misses += 1
+            return None
+
+    def put(self, bucket: str, vector: np.ndarray, payload: Any, key: Optional[str] = None):
+        """Stores an answer; one stored under the same bucket and key replaces the previous one."""
+        with self._lock:
+            if key is not None and (bucket, key) in self._keys:
+                self._remove(self._keys[(bucket, key)])
+            index = self._indexes.get(bucket)
+            if index is None:
+                index = faiss.IndexIDMap2(faiss.IndexFlatIP(self.dim))
+                self._indexes[bucket] = index
+            entry_id = self._next_id
+            self._next_id += 1
+            index.add_with_ids(self._as_row(vector), np.asarray([entry_id], dtype=np.int64))
+            expires_at = time.monotonic() + self.ttl if self.ttl > 0 else None
+            self._entries[entry_id] = _Entry(bucket, payload, expires_at, key)
+            if key is not None:
+                self._keys[(bucket, key)] = entry_id
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+            self._entries.clear()
+            self._keys.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "buckets": len(self._indexes),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+            }
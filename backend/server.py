@@ -5,8 +5,10 @@ import json
 import logging
 import numpy as np
 import faiss
-import torch
 import asyncio
+import random
+import time
+import threading
 
 
 # Fix for potential tokenizers deadlock/crash
@@ -15,14 +17,39 @@ os.environ["TOKENIZERS_PARALLELISM"] = "false"
 os.environ["OMP_NUM_THREADS"] = "1"
 os.environ["MKL_NUM_THREADS"] = "1"
 
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Query, Request
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
-from sentence_transformers import SentenceTransformer
+from typing import Callable, List, Optional, Dict, Any, Union, Literal
 from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
 from ml_engine import MLEngine
-import httpx
+from learner_store import LearnerStore
+from embedding_service import EmbeddingBatcher
+from embedding_pool import EmbeddingPool
+from query_cache import QueryCache, normalize_query
+from precompute_retrieval import load_precomputed, search_knobs
+from topics import CHAPTER_QUERY_TEMPLATE, QUIZ_QUERY_TEMPLATE
+from build_index import (
+    EMBEDDINGS_PATH, EMBEDDING_MODEL, METADATA_PATH,
+    index_path_for, configure_search, load_index, search_settings
+)
+from metadata_store import MetadataStore
+from corpus_indexes import CorpusIndexes
+from search_filters import normalize_filters, filters_key, search_params
+from bm25_index import rrf_fuse
+from ollama_client import OllamaClient
+from singleflight import SingleFlight, flight_key
+from semantic_cache import SemanticCache
+from cache_store import (
+    CacheStore, CHAPTER_NAMESPACE, QUIZ_NAMESPACE, chapter_cache_key, content_fingerprint, open_store,
+    quiz_cache_key
+)
+from readiness import Readiness
+from context_builder import ContextBuilder
+from chat_sessions import ChatSession, ChatSessionStore
+from metrics import REGISTRY, MetricsMiddleware, stage
 
 # Load environment variables
 load_dotenv()
@@ -45,19 +72,134 @@ app.add_middleware(
 # Global variables
 index = None
 metadata = []
+topic_index = None
+filter_index = None
+bm25_index = None
+ollama_client = None
+cache_store = None
 model = None
+embedder = None
+query_cache = None
+precomputed = None
+semantic_cache = None
+doc_rows: Dict[str, int] = {}  # corpus id -> index row, for the context builder's dedupe
+doc_embeddings = None  # embeddings.npy, memory-mapped; row i is index row i
 ml_engine = None
+# Coalesces identical concurrent generations (quiz/chapter/hint)
+generation_flights = SingleFlight()
+
+# Components loaded in the background at startup, and their readiness
+COMPONENTS = ("ml_engine", "cache_store", "index", "metadata", "embedder", "precomputed")
+# Components /readyz waits for (precomputed hits are optional)
+REQUIRED_COMPONENTS = ("ml_engine", "cache_store", "index", "metadata", "embedder")
+readiness = Readiness(COMPONENTS)
 
 # Paths
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-INDEX_PATH = os.path.join(BASE_DIR, "faiss_index.bin")
-META_PATH = os.path.join(BASE_DIR, "faiss_metadata.json")
-MODEL_NAME = "sentence-transformers/all-mpnet-base-v2"
+# Index type built by build_index.py: flat (faiss_index.bin), hnsw, ivf_flat or ivf_pq,
+# and its FAISS_NPROBE / FAISS_EF_SEARCH (shared with precompute_retrieval.py)
+FAISS_INDEX_TYPE, FAISS_NPROBE, FAISS_EF_SEARCH = search_settings()
+INDEX_PATH = index_path_for(FAISS_INDEX_TYPE, BASE_DIR)
+# Memory-map the index and metadata so uvicorn workers share pages via the OS cache
+FAISS_MMAP = os.environ.get("FAISS_MMAP", "1") == "1"
+META_PATH = METADATA_PATH
+MODEL_NAME = EMBEDDING_MODEL
+
+# Embedding micro-batcher settings
+EMBED_MAX_BATCH_SIZE = int(os.environ.get("EMBED_MAX_BATCH_SIZE", "32"))
+EMBED_MAX_WAIT_MS = float(os.environ.get("EMBED_MAX_WAIT_MS", "5"))
+# EMBED_WORKERS > 0 encodes in that many worker processes (own model copy, EMBED_WORKER_THREADS
+# threads each, default cores / workers) instead of in this single-threaded process
+EMBED_WORKERS = int(os.environ.get("EMBED_WORKERS", "0"))
+EMBED_WORKER_THREADS = int(os.environ.get("EMBED_WORKER_THREADS", "0"))
+
+# Query cache settings (QUERY_CACHE_PATH is the file vectors persist to; empty disables persistence)
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", "4096"))
+QUERY_CACHE_TTL = float(os.environ.get("QUERY_CACHE_TTL", "0"))
+QUERY_CACHE_PATH = os.environ.get("QUERY_CACHE_PATH", "")
+
+# Retrieval mode used by /chat and /generate_hint: dense, sparse (BM25) or hybrid (RRF of both)
+RAG_SEARCH_MODE = os.environ.get("RAG_SEARCH_MODE", "hybrid")
+# Candidates taken from each list before reciprocal rank fusion, and the RRF constant
+RRF_DEPTH = int(os.environ.get("RRF_DEPTH", "30"))
+RRF_K = int(os.environ.get("RRF_K", "60"))
+
+# Learner histories for the mastery model (SQLite, sharded); LEARNER_DB_PATH="" keeps them in memory only
+LEARNER_DB_PATH = os.environ.get("LEARNER_DB_PATH", os.path.join(BASE_DIR, "learner_state.db"))
+LEARNER_DB_SHARDS = int(os.environ.get("LEARNER_DB_SHARDS", "4"))
+LEARNER_HOT_USERS = int(os.environ.get("LEARNER_HOT_USERS", "100000"))
+LEARNER_FLUSH_INTERVAL = float(os.environ.get("LEARNER_FLUSH_INTERVAL", "0.5"))
+
+# Semantic answer cache for /chat (first turn) and /generate_hint; SEMANTIC_CACHE_SIZE=0 disables it
+SEMANTIC_CACHE_SIZE = int(os.environ.get("SEMANTIC_CACHE_SIZE", "2048"))
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_TTL = float(os.environ.get("SEMANTIC_CACHE_TTL", "0"))
+
+# Ollama connection pool; keep OLLAMA_NUM_PARALLEL equal to the Ollama server's setting
+OLLAMA_MAX_CONNECTIONS = int(os.environ.get("OLLAMA_MAX_CONNECTIONS", "32"))
+OLLAMA_MAX_KEEPALIVE = int(os.environ.get("OLLAMA_MAX_KEEPALIVE", "16"))
+OLLAMA_KEEPALIVE_EXPIRY = float(os.environ.get("OLLAMA_KEEPALIVE_EXPIRY", "60"))
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_READ_TIMEOUT = float(os.environ.get("OLLAMA_READ_TIMEOUT", "120"))
+OLLAMA_NUM_PARALLEL = int(os.environ.get("OLLAMA_NUM_PARALLEL", "4"))
+OLLAMA_MODEL = os.environ.get("OLLAMA_MODEL", "llama3.1:8b")
+# How long Ollama keeps the chat model (and its KV cache) loaded between turns
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+# Context window requested on every Ollama call (0 = the model's default, which may be
+# too small for a chat session and silently truncates it from the front)
+OLLAMA_NUM_CTX = int(os.environ.get("OLLAMA_NUM_CTX", "8192"))
+
+# Server-side chat sessions: count, idle lifetime (seconds) and messages kept per session
+CHAT_SESSIONS_MAX = int(os.environ.get("CHAT_SESSIONS_MAX", "10000"))
+CHAT_SESSION_TTL = float(os.environ.get("CHAT_SESSION_TTL", "1800"))
+CHAT_SESSION_MAX_MESSAGES = int(os.environ.get("CHAT_SESSION_MAX_MESSAGES", "40"))
+
+# Generated-content cache (SQLite, WAL); CACHE_HOT_ENTRIES decoded values stay in memory
+CACHE_DB_PATH = os.environ.get("CACHE_DB_PATH", os.path.join(BASE_DIR, "cache.db"))
+CACHE_HOT_ENTRIES = int(os.environ.get("CACHE_HOT_ENTRIES", "512"))
+# Pre-generated quiz variants per topic/subtopic/difficulty served at random (see generate_quiz_cache.py --variants)
+QUIZ_CACHE_VARIANTS = int(os.environ.get("QUIZ_CACHE_VARIANTS", "1"))
+# Rendered chapters older than this (seconds; 0 = never) are served once more and re-rendered
+# in the background; so are chapters whose prompt template or retrieved context changed
+CHAPTER_CACHE_TTL = float(os.environ.get("CHAPTER_CACHE_TTL", str(7 * 24 * 3600)))
+# Seconds one worker holds the claim on re-rendering a stale chapter (covers a slow render)
+CHAPTER_REFRESH_LEASE = float(os.environ.get("CHAPTER_REFRESH_LEASE", "600"))
+
+# RAG prompt context: estimated token budget (0 = unlimited) and the cosine similarity
+# above which a retrieved chunk is dropped as a near-duplicate of a more relevant one
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "1200"))
+CONTEXT_DEDUPE_THRESHOLD = float(os.environ.get("CONTEXT_DEDUPE_THRESHOLD", "0.95"))
+# Estimated tokens of earlier turns a chat session keeps: what OLLAMA_NUM_CTX leaves after
+# the new turn's context and ~2k tokens for the system message, question and reply (0 = no cap)
+CHAT_SESSION_MAX_TOKENS = int(os.environ.get(
+    "CHAT_SESSION_MAX_TOKENS",
+    str(max(1024, OLLAMA_NUM_CTX - CONTEXT_TOKEN_BUDGET - 2048) if OLLAMA_NUM_CTX else 0)
+))
+
+# Prometheus metrics on /metrics (METRICS_ENABLED=0 turns all instrumentation into no-ops);
+# METRICS_TIMING_HEADERS=1 also returns each request's stage timings in a Server-Timing header
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+METRICS_TIMING_HEADERS = os.environ.get("METRICS_TIMING_HEADERS", "0") == "1"
+REGISTRY.enabled = METRICS_ENABLED
+REGISTRY.timing_headers = METRICS_TIMING_HEADERS
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
 
 # Data Models
+class SearchFilters(BaseModel):
+    """Metadata constraints; a list matches any of its values, fields are combined with AND."""
+    topic: Optional[Union[str, List[str]]] = None
+    chapter: Optional[Union[int, List[int]]] = None
+    difficulty: Optional[Union[str, List[str]]] = None
+    content_type: Optional[Union[str, List[str]]] = None
+    source: Optional[Union[str, List[str]]] = None
+
 class SearchRequest(BaseModel):
     query: str
     limit: int = 5
+    filters: Optional[SearchFilters] = None
+    # dense (FAISS), sparse (BM25) or hybrid (reciprocal rank fusion of both)
+    mode: Literal["dense", "sparse", "hybrid"] = "dense"
 
 class ChatMsg(BaseModel):
     role: str
@@ -67,6 +209,9 @@ class ChatRequest(BaseModel):
     message: str
     history: List[ChatMsg] = []
     user_profile: Optional[Dict[str, Any]] = None
+    # Keeps the conversation server-side (see chat_sessions.py); session_id takes precedence
+    user_id: Optional[str] = None
+    session_id: Optional[str] = None
 
 class PredictionRequest(BaseModel):
     user_id: str
@@ -108,159 +253,675 @@ class UserAssessmentRequest(BaseModel):
     quiz_history: List[Dict[str, Any]]
     topic_mastery: Dict[str, float]
 
-async def call_ollama(prompt: str, model: str = "llama3.1:8b", retries: int = 3) -> str:
+def _new_ollama_client() -> OllamaClient:
+    return OllamaClient(
+        base_url=os.environ.get("OLLAMA_URL", "http://localhost:11434"),
+        max_connections=OLLAMA_MAX_CONNECTIONS,
+        max_keepalive=OLLAMA_MAX_KEEPALIVE,
+        keepalive_expiry=OLLAMA_KEEPALIVE_EXPIRY,
+        connect_timeout=OLLAMA_CONNECT_TIMEOUT,
+        read_timeout=OLLAMA_READ_TIMEOUT,
+        num_parallel=OLLAMA_NUM_PARALLEL,
+        num_ctx=OLLAMA_NUM_CTX
+    )
+
+def _ollama() -> OllamaClient:
+    """The shared pooled client (created lazily for scripts that skip startup)."""
+    global ollama_client
+    if ollama_client is None:
+        ollama_client = _new_ollama_client()
+    return ollama_client
+
+_cache_store_lock = threading.Lock()
+
+def _cache_store() -> CacheStore:
+    """The shared quiz/content cache (opened lazily for scripts that skip startup)."""
+    global cache_store
+    with _cache_store_lock:  # the startup loader and an early request may race here
+        if cache_store is None:
+            cache_store = open_store(CACHE_DB_PATH, hot_entries=CACHE_HOT_ENTRIES)
+    return cache_store
+
+async def call_ollama(prompt: str, model: str = OLLAMA_MODEL, retries: int = 3) -> str:
     """
     Calls Ollama API with retry logic.
     """
-    ollama_url = os.environ.get("OLLAMA_URL", "http://localhost:11434")
-    
-    for attempt in range(retries):
+    try:
+        return await _ollama().generate(prompt, model, retries=retries)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Ollama API error: {str(e)}"
+        )
+
+async def call_ollama_chat(messages: List[Dict[str, str]], model: str = OLLAMA_MODEL, retries: int = 3) -> Dict[str, Any]:
+    """Multi-turn /api/chat with keep_alive; returns Ollama's response."""
+    try:
+        return await _ollama().chat(messages, model, keep_alive=OLLAMA_KEEP_ALIVE, retries=retries)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Ollama API error: {str(e)}"
+        )
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _stream_generation(request: Request, first_event: Dict[str, Any], prompt: Optional[str] = None,
+                       on_complete: Optional[Callable[[str], None]] = None,
+                       messages: Optional[List[Dict[str, str]]] = None) -> StreamingResponse:
+    """
+    Streams an Ollama generation as Server-Sent Events:
+    a `context` event (RAG sources etc.), one `token` event per chunk, then `done` with
+    Ollama's timing stats, or `error`. When the client disconnects the upstream request is
+    closed, which aborts the generation in Ollama. Generates from prompt, or with /api/chat
+    from messages. on_complete, if given, receives the full text of a generation that
+    finished (run in the threadpool).
+    """
+    async def events():
+        yield _sse("context", first_event)
+        if messages is not None:
+            upstream = _ollama().chat_stream(messages, OLLAMA_MODEL, keep_alive=OLLAMA_KEEP_ALIVE)
+        else:
+            upstream = _ollama().generate_stream(prompt, OLLAMA_MODEL)
+        parts = []
         try:
-            async with httpx.AsyncClient(timeout=120.0) as client:
-                response = await client.post(
-                    f"{ollama_url}/api/generate",
-                    json={
-                        "model": model,
-                        "prompt": prompt,
-                        "stream": False
-                    }
-                )
-                response.raise_for_status()
-                result = response.json()
-                return result.get("response", "")
+            async for chunk in upstream:
+                if await request.is_disconnected():
+                    logger.info("Client disconnected, aborting generation")
+                    return
+                text = chunk.get("response") or (chunk.get("message") or {}).get("content")
+                if text:
+                    parts.append(text)
+                    yield _sse("token", {"text": text})
+                if chunk.get("done"):
+                    if on_complete:
+                        try:
+                            await run_in_threadpool(on_complete, "".join(parts))
+                        except Exception as e:
+                            logger.warning(f"Failed to keep streamed generation: {e}")
+                    yield _sse("done", {k: chunk.get(k) for k in
+                                        ("total_duration", "prompt_eval_count", "eval_count", "eval_duration")})
         except Exception as e:
-            logger.warning(f"Ollama API error (Attempt {attempt+1}/{retries}): {e}")
-            if attempt == retries - 1:
-                raise HTTPException(
-                    status_code=500,
-                    detail=f"Ollama API error: {str(e)}"
-                )
-            await asyncio.sleep(1)
+            logger.error(f"Streaming generation error: {e}")
+            yield _sse("error", {"detail": str(e)})
+        finally:
+            await upstream.aclose()
 
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
+def _rag_sources(docs: List[Dict[str, Any]], default_type: str = 'explanation') -> List[Dict[str, Any]]:
+    """Formats RAG sources for transparency."""
+    return [{
+        'id': d.get('id', str(i)),
+        'topic': d.get('topic', ''),
+        'subtopic': d.get('subtopic', ''),
+        'content': d.get('content', ''),
+        'content_type': d.get('content_type', default_type),
+        'score': d.get('score', 0),
+        'source': d.get('source', 'Unknown')
+    } for i, d in enumerate(docs)]
+
+def _doc_vectors(docs: List[Dict[str, Any]]) -> Optional[np.ndarray]:
+    """
+    Stored embeddings of retrieved docs (None if unavailable). Read from embeddings.npy,
+    else from flat/HNSW indexes, which keep the full vectors; IVF indexes have no direct
+    map, and IVF-PQ could only return lossy reconstructions.
+    """
+    rows = [doc_rows.get(d.get('id')) for d in docs]
+    if index is None or any(row is None for row in rows):
+        return None
+    if doc_embeddings is not None:
+        return np.asarray(doc_embeddings[rows], dtype=np.float32)
+    if FAISS_INDEX_TYPE in ("flat", "hnsw"):
+        return np.vstack([index.reconstruct(int(row)) for row in rows])
+    return None
+
+context_builder = ContextBuilder(CONTEXT_TOKEN_BUDGET, CONTEXT_DEDUPE_THRESHOLD, vector_fn=_doc_vectors)
+
+def _pack_context(docs: List[Dict[str, Any]], label: str, fixed_tokens: int = 0) -> List[Dict[str, Any]]:
+    """Cleans, dedupes and budgets retrieved docs before they go into a prompt (see context_builder.py)."""
+    if not docs:
+        return []
+    with stage("context_pack"):
+        packed = context_builder.build(docs, fixed_tokens=fixed_tokens)
+    logger.info(f"📦 {label} context: {len(packed['docs'])}/{len(docs)} chunks, "
+                f"~{packed['context_tokens']} tokens (~{packed['tokens_saved']} saved)")
+    return packed["docs"]
+
+
+
+def _load_ml_engine():
+    """ML engine (learner histories persist across restarts and workers)."""
+    global ml_engine
+    learner_store = None
+    if LEARNER_DB_PATH:
+        learner_store = LearnerStore(
+            LEARNER_DB_PATH,
+            shards=LEARNER_DB_SHARDS,
+            hot_users=LEARNER_HOT_USERS,
+            flush_interval=LEARNER_FLUSH_INTERVAL
+        )
+        learner_store.start()
+    ml_engine = MLEngine(state_store=learner_store)
+
+def _load_cache_store():
+    """Generated-content cache (imports quiz_cache.json on first run)."""
+    _cache_store()
+    logger.info(f"Cache store ready at {CACHE_DB_PATH} ({cache_store.count(QUIZ_NAMESPACE)} quizzes)")
+
+def _load_index():
+    global index
+    if not os.path.exists(INDEX_PATH):
+        raise FileNotFoundError(f"FAISS index not found at {INDEX_PATH}")
+    logger.info(f"Loading FAISS index ({FAISS_INDEX_TYPE}) from {INDEX_PATH}...")
+    loaded = load_index(INDEX_PATH, mmap=FAISS_MMAP)
+    configure_search(loaded, nprobe=FAISS_NPROBE, ef_search=FAISS_EF_SEARCH)
+    _load_doc_embeddings(loaded)
+    index = loaded
+
+def _load_doc_embeddings(loaded):
+    """Maps embeddings.npy for the context builder's near-duplicate check, if it matches the index."""
+    global doc_embeddings
+    doc_embeddings = None
+    if os.path.exists(EMBEDDINGS_PATH):
+        vectors = np.load(EMBEDDINGS_PATH, mmap_mode="r")
+        if vectors.ndim == 2 and vectors.shape == (loaded.ntotal, loaded.d):
+            doc_embeddings = vectors
+            return
+        logger.warning(f"{EMBEDDINGS_PATH} has shape {vectors.shape}, the index "
+                       f"{(loaded.ntotal, loaded.d)}; not using it for context dedupe")
+    if FAISS_INDEX_TYPE not in ("flat", "hnsw"):
+        logger.warning(f"No stored embeddings for the {FAISS_INDEX_TYPE} index; context dedupe "
+                       f"drops exact duplicates only")
+
+def _load_metadata():
+    """Corpus metadata plus the topic, filter and BM25 indexes built from it."""
+    global metadata, topic_index, filter_index, bm25_index, doc_rows
+    if not os.path.exists(META_PATH):
+        raise FileNotFoundError(f"Metadata not found at {META_PATH}")
+    logger.info(f"Loading metadata from {META_PATH}...")
+    # Compact mmapped copy of the JSON (rebuilt when the JSON changes); records decode per hit
+    store = MetadataStore.open_for(META_PATH)
+    # Topic, filter and BM25 postings, built in one pass when the store changes and mmapped
+    indexes, rebuilt = CorpusIndexes.open_for(store)
+    if rebuilt:
+        logger.info(f"Built the topic, filter and BM25 indexes for {len(store)} records")
+    topic_index, filter_index, bm25_index = indexes.topics, indexes.filters, indexes.bm25
+    doc_rows = indexes.doc_rows
+    metadata = store
+
+def _load_embedder():
+    """Embedding model, micro-batcher, warm-up encode and the semantic answer cache."""
+    global model, embedder, semantic_cache
+    max_in_flight = 1
+    if EMBED_WORKERS > 0:
+        logger.info(f"Starting {EMBED_WORKERS} embedding workers for {MODEL_NAME}...")
+        loaded = EmbeddingPool(
+            MODEL_NAME,
+            workers=EMBED_WORKERS,
+            threads=EMBED_WORKER_THREADS or None,
+            max_batch_size=EMBED_MAX_BATCH_SIZE
+        )
+        loaded.start()
+        max_in_flight = loaded.max_in_flight
+    else:
+        # Deferred: importing sentence_transformers pulls in torch/transformers (seconds)
+        from sentence_transformers import SentenceTransformer
+
+        logger.info(f"Loading embedding model {MODEL_NAME}...")
+        loaded = SentenceTransformer(MODEL_NAME, device="cpu")
+
+    # All encodes go through the batcher (one batch at a time in-process, one per pool slot otherwise)
+    batcher = EmbeddingBatcher(
+        lambda texts: loaded.encode(texts, batch_size=len(texts), show_progress_bar=False),
+        max_batch_size=EMBED_MAX_BATCH_SIZE,
+        max_wait_ms=EMBED_MAX_WAIT_MS,
+        max_in_flight=max_in_flight
+    )
+    batcher.start()
+    # Warm-up so the first real query doesn't pay for lazy initialization
+    batcher.encode("derivative of a function")
+
+    model = loaded
+    embedder = batcher
+    # Semantic answer cache (similar questions reuse a generated answer); set last,
+    # since the endpoints only consult it once they can encode
+    if SEMANTIC_CACHE_SIZE > 0:
+        semantic_cache = SemanticCache(
+            loaded.get_sentence_embedding_dimension(),
+            threshold=SEMANTIC_CACHE_THRESHOLD,
+            max_entries=SEMANTIC_CACHE_SIZE,
+            ttl_seconds=SEMANTIC_CACHE_TTL
+        )
+
+def _load_precomputed():
+    """Precomputed hits for the template queries (ignored if index/metadata changed)."""
+    global precomputed
+    precomputed = load_precomputed(INDEX_PATH, META_PATH, MODEL_NAME,
+                                   search=search_knobs(FAISS_INDEX_TYPE, FAISS_NPROBE, FAISS_EF_SEARCH))
+    if precomputed:
+        logger.info(f"Loaded precomputed retrieval results for {len(precomputed)} template queries")
+
+_LOADERS = {
+    "ml_engine": _load_ml_engine,
+    "cache_store": _load_cache_store,
+    "index": _load_index,
+    "metadata": _load_metadata,
+    "embedder": _load_embedder,
+    "precomputed": _load_precomputed,
+}
+
+def _init_query_cache():
+    """Query cache (vectors survive restarts when QUERY_CACHE_PATH is set)."""
+    global query_cache
+    if query_cache is not None:
+        return
+    query_cache = QueryCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL, QUERY_CACHE_PATH or None)
+    loaded = query_cache.load()
+    if loaded:
+        logger.info(f"Loaded {loaded} cached query embeddings from {QUERY_CACHE_PATH}")
+
+def load_components(*names: str):
+    """
+    Loads components synchronously (concurrently, waiting for all) for scripts
+    that import this module without running the server. Raises if any fails.
+    """
+    names = names or COMPONENTS
+    _init_query_cache()
+    threads = [readiness.start(name, _LOADERS[name]) for name in names if readiness.missing(name)]
+    for thread in threads:
+        thread.join()
+    failed = readiness.missing(*names)
+    if failed:
+        raise RuntimeError(f"Failed to load: {', '.join(failed)}")
+
+def _require(*names: str):
+    """503 until the components an endpoint depends on are loaded."""
+    missing = readiness.missing(*names)
+    if missing:
+        raise HTTPException(status_code=503, detail=f"Still loading: {', '.join(missing)}")
 
 @app.on_event("startup")
 async def startup_event():
-    global index, metadata, model, ml_engine
-    
-    # 0. Load ML Engine
-    ml_engine = MLEngine()
-    
-    # 1. Load FAISS Index
-    if os.path.exists(INDEX_PATH):
-        logger.info(f"Loading FAISS index from {INDEX_PATH}...")
-        index = faiss.read_index(INDEX_PATH)
-    else:
-        logger.error(f"FAISS index not found at {INDEX_PATH}")
-        raise FileNotFoundError("FAISS index missing")
-
-    # 2. Load Metadata
-    if os.path.exists(META_PATH):
-        logger.info(f"Loading metadata from {META_PATH}...")
-        with open(META_PATH, "r", encoding="utf-8") as f:
-            metadata = json.load(f)
-    else:
-        logger.error(f"Metadata not found at {META_PATH}")
-        raise FileNotFoundError("Metadata missing")
+    global ollama_client
+
+    # Shared Ollama connection pool (closed on shutdown)
+    ollama_client = _new_ollama_client()
+    await ollama_client.start()
 
-    # 3. Load Embedding Model
-    logger.info(f"Loading embedding model {MODEL_NAME}...")
-    model = SentenceTransformer(MODEL_NAME, device="cpu")
-    logger.info("Server startup complete.")
+    _init_query_cache()
+
+    # Everything else loads concurrently in the background; endpoints serve as soon
+    # as the components they need are ready (see /readyz)
+    for name in COMPONENTS:
+        readiness.start(name, _LOADERS[name])
+    logger.info("Server accepting requests; components loading in the background.")
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving."""
+    return {"status": "ok", "uptime_seconds": round(time.monotonic() - readiness.started_at, 3)}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: 200 once every required component is loaded, else 503. Lists per-component status."""
+    ready = readiness.is_ready(*REQUIRED_COMPONENTS)
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"ready": ready, "components": readiness.snapshot()}
+    )
+
+async def close_clients():
+    """
+    Closes the pooled Ollama client (its connections belong to the running event loop),
+    then stops the embedding batcher thread and the worker processes. Used at shutdown
+    and by the scripts that load the server's components.
+    """
+    global ollama_client, embedder
+    if ollama_client:
+        await ollama_client.close()
+        ollama_client = None
+    if embedder:
+        embedder.stop()
+        embedder = None
+    if isinstance(model, EmbeddingPool):
+        model.stop()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await close_clients()
+    if cache_store:
+        cache_store.close()
+    if ml_engine and ml_engine.state_store:
+        ml_engine.state_store.stop()
+    if query_cache and QUERY_CACHE_PATH:
+        try:
+            saved = query_cache.save()
+            logger.info(f"Saved {saved} cached query embeddings to {QUERY_CACHE_PATH}")
+        except Exception as e:
+            logger.warning(f"Failed to persist query cache: {e}")
+
+def _search_index(query_vector: np.ndarray, limit: int, filters: Optional[Dict] = None):
+    """
+    Runs the FAISS search for one query vector. Returns (ids, scores) of valid hits.
+    Metadata filters are applied inside FAISS through an ID selector over the matching rows.
+    """
+    params = None
+    if filters:
+        allowed, selector = filter_index.selector(filters)
+        if len(allowed) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        params = search_params(index, selector)
+        limit = min(limit, len(allowed))
+
+    with stage("index_search"):
+        D, I = index.search(query_vector.reshape(1, -1), limit, params=params)
+    valid = (I[0] >= 0) & (I[0] < len(metadata))
+    return I[0][valid], D[0][valid]
+
+def _hits_to_docs(ids, scores) -> List[Dict[str, Any]]:
+    """Attaches metadata to each hit."""
+    results = []
+    with stage("metadata"):
+        for idx, score in zip(ids, scores):
+            item = metadata[int(idx)]
+            item['score'] = float(score)
+            results.append(item)
+    return results
+
+def _search_scope(filters: Optional[Dict], mode: str) -> str:
+    """Query-cache scope: dense unfiltered results use the plain key."""
+    scope = filters_key(filters or {})
+    return scope if mode == "dense" else f"{mode}|{scope}"
+
+def _lookup_hits(query: str, limit: int, filters: Optional[Dict] = None, mode: str = "dense"):
+    """Returns (ids, scores) from the precomputed results or the query cache, or None."""
+    with stage("retrieval_cache"):
+        if precomputed and not filters and mode == "dense":
+            hit = precomputed.get(normalize_query(query))
+            if hit is not None and len(hit[0]) >= limit:
+                return hit[0][:limit], hit[1][:limit]
+        return query_cache.get_hits(query, limit, scope=_search_scope(filters, mode))
+
+def _sparse_search(query: str, limit: int, filters: Optional[Dict] = None):
+    allowed = filter_index.selector(filters)[0] if filters else None
+    with stage("bm25_search"):
+        return bm25_index.search(query, limit, allowed)
+
+def _cached_search(query: str, limit: int, query_vector: Optional[np.ndarray],
+                   filters: Optional[Dict] = None, mode: str = "dense") -> List[Dict[str, Any]]:
+    if mode == "sparse":
+        ids, scores = _sparse_search(query, limit, filters)
+    elif mode == "hybrid":
+        # Scores become fused RRF scores rather than cosine similarities
+        depth = max(limit, RRF_DEPTH)
+        dense_ids, _ = _search_index(query_vector, depth, filters)
+        sparse_ids, _ = _sparse_search(query, depth, filters)
+        ids, scores = rrf_fuse([dense_ids, sparse_ids], limit, RRF_K)
+    else:
+        ids, scores = _search_index(query_vector, limit, filters)
+    query_cache.put_hits(query, ids, scores, scope=_search_scope(filters, mode))
+    return _hits_to_docs(ids, scores)
 
 @app.post("/search")
-def search(req: SearchRequest):  # Made synchronous to avoid segfault
-    if not index or not model:
-        raise HTTPException(status_code=503, detail="Server not initializing")
+def search(req: SearchRequest):  # Sync: runs in the threadpool, encodes via the batcher thread
+    _require("index", "metadata", "embedder")
     
     try:
-        # Embed query
-        query_vector = model.encode([req.query], show_progress_bar=False)
-        
-        # Search FAISS
-        D, I = index.search(query_vector, req.limit)
-        
-        results = []
-        for i, idx in enumerate(I[0]):
-            idx = int(idx)
-            if idx < 0 or idx >= len(metadata):
-                continue
-            
-            item = metadata[idx].copy()
-            item['score'] = float(D[0][i])
-            results.append(item)
-            
-        return {"results": results}
+        filters = normalize_filters(req.filters.dict(exclude_none=True) if req.filters else None)
+        hits = _lookup_hits(req.query, req.limit, filters, req.mode)
+        if hits is not None:
+            return {"results": _hits_to_docs(*hits)}
+
+        query_vector = None
+        if req.mode != "sparse":
+            query_vector = query_cache.get_vector(req.query)
+            if query_vector is None:
+                with stage("embed"):
+                    query_vector = embedder.encode(req.query)
+                query_cache.put_vector(req.query, query_vector)
+        return {"results": _cached_search(req.query, req.limit, query_vector, filters, req.mode)}
         
     except Exception as e:
         logger.error(f"Search error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def retrieve(query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None,
+                   mode: str = "dense") -> List[Dict[str, Any]]:
+    """
+    Async RAG retrieval for the generation endpoints.
+    The encode is awaited on the batcher and the index scan runs in the threadpool,
+    so the event loop stays free while concurrent requests share encode batches.
+    filters restricts hits by metadata field, e.g. {"content_type": "video"};
+    mode is dense, sparse or hybrid as in SearchRequest.
+    """
+    _require("index", "metadata", "embedder")
+    
+    filters = normalize_filters(filters)
+    hits = _lookup_hits(query, limit, filters, mode)
+    if hits is not None:
+        return _hits_to_docs(*hits)
+
+    query_vector = await _query_vector(query) if mode != "sparse" else None
+    return await run_in_threadpool(_cached_search, query, limit, query_vector, filters, mode)
+
+async def _query_vector(query: str) -> np.ndarray:
+    """Query embedding from the query cache, or encoded on the batcher."""
+    query_vector = query_cache.get_vector(query)
+    if query_vector is None:
+        with stage("embed"):
+            query_vector = await embedder.encode_async(query)
+        query_cache.put_vector(query, query_vector)
+    return query_vector
+
+@app.get("/stats")
+async def get_stats():
+    """Retrieval, answer cache, embedding batcher and single-flight counters."""
+    return {
+        "query_cache": query_cache.stats() if query_cache else None,
+        "precomputed_queries": len(precomputed) if precomputed else 0,
+        "embedder": embedder.stats() if embedder else None,
+        "single_flight": generation_flights.stats(),
+        "cache_store": cache_store.stats() if cache_store else None,
+        "embedding_pool": model.stats() if isinstance(model, EmbeddingPool) else None,
+        "semantic_cache": semantic_cache.stats() if semantic_cache else None,
+        "context": context_builder.stats(),
+        "chat_sessions": chat_sessions.stats(),
+        "learner_store": ml_engine.state_store.stats() if ml_engine and ml_engine.state_store else None
+    }
+
+@REGISTRY.collector
+def _cache_metrics():
+    """Cache hit/miss counters, read from the caches' own stats at scrape time."""
+    counts = {}
+    if query_cache:
+        s = query_cache.stats()
+        counts["query_vector"] = (s["vector_hits"], s["vector_misses"])
+        counts["query_result"] = (s["result_hits"], s["result_misses"])
+    if semantic_cache:
+        s = semantic_cache.stats()
+        counts["semantic"] = (s["hits"], s["misses"])
+    if cache_store:
+        s = cache_store.stats()
+        counts["content_store"] = (s["hot_hits"] + s["disk_hits"], s["misses"])
+    s = generation_flights.stats()
+    counts["single_flight"] = (s["coalesced"], s["executions"])
+
+    yield ("classmate_cache_hits_total", "counter", "Lookups answered from the cache",
+           [({"cache": name}, hits) for name, (hits, _) in counts.items()])
+    yield ("classmate_cache_misses_total", "counter", "Lookups the cache could not answer",
+           [({"cache": name}, misses) for name, (_, misses) in counts.items()])
+    yield ("classmate_cache_hit_ratio", "gauge", "Hits / lookups since startup",
+           [({"cache": name}, hits / (hits + misses) if hits + misses else 0.0)
+            for name, (hits, misses) in counts.items()])
+    yield ("classmate_component_ready", "gauge", "1 once a startup component has loaded",
+           [({"component": name}, 1 if info["status"] == "ready" else 0)
+            for name, info in readiness.snapshot().items()])
+    if embedder:
+        s = embedder.stats()
+        yield ("classmate_embed_queue_depth", "gauge", "Queries waiting for the embedding batcher",
+               [({}, s["queued"])])
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition of the stage, Ollama, model and cache metrics."""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled (METRICS_ENABLED=0)")
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Static instructions come first in every prompt so consecutive requests share a
+# cacheable prefix in Ollama; request-specific text follows
+CHAT_SYSTEM_PROMPT = """You are an expert calculus tutor named ClassMate.
+The student's latest message starts with the CONTEXT retrieved for it; use it to answer the question.
+If the context has video links, recommend them.
+If the answer is not in the context, use your general knowledge but mention that it's outside the provided materials."""
+
+# Frontend roles -> Ollama chat roles
+_CHAT_ROLES = {"user": "user", "model": "assistant", "assistant": "assistant"}
+
+chat_sessions = ChatSessionStore(CHAT_SESSIONS_MAX, CHAT_SESSION_TTL, CHAT_SESSION_MAX_MESSAGES,
+                                 max_tokens=CHAT_SESSION_MAX_TOKENS)
+
+def _chat_system(req: ChatRequest) -> str:
+    """System message: the tutor instructions and the student's profile (stable across turns)."""
+    if not req.user_profile:
+        return CHAT_SYSTEM_PROMPT
+    return (f"{CHAT_SYSTEM_PROMPT}\n\n"
+            f"Student Profile:\n"
+            f"Grade: {req.user_profile.get('grade', 'Unknown')}\n"
+            f"Subject: {req.user_profile.get('subject', 'Calculus')}\n"
+            f"Level: {req.user_profile.get('difficultyLevel', 'Medium')}")
+
+def _chat_turn(req: ChatRequest, docs: List[Dict[str, Any]]) -> str:
+    """
+    The new user message: this turn's retrieved context, then the question. Sessions
+    record only the question (req.message), so earlier turns don't carry old context.
+    """
+    context_str = "\n\n".join([
+        f"Source: {d.get('source', 'Unknown')} ({d.get('topic', 'General')})\nContent: {d['content']}"
+        for d in _pack_context(docs, "chat", fixed_tokens=12)
+    ])
+    return f"CONTEXT:\n{context_str}\n\nQuestion: {req.message}"
+
+def _chat_session(req: ChatRequest) -> Optional[ChatSession]:
+    """
+    Server-side session for requests carrying a session_id or user_id, else None.
+    A session_id always continues its conversation. A user_id only continues one while the
+    client sends its history; a request with empty history starts a new conversation.
+    A history that disagrees with the session's replaces it, so both sides stay in step.
+    """
+    key = req.session_id or (f"user:{req.user_id}" if req.user_id else None)
+    if key is None:
+        return None
+    session = chat_sessions.get(key, _chat_system(req), fresh=not req.session_id and not req.history)
+    if req.history:
+        # Picks up a conversation the server no longer has (restart, eviction, another worker)
+        # or one the client changed (edited or deleted messages)
+        chat_sessions.sync(session, [{"role": _CHAT_ROLES.get(m.role, "user"), "content": m.text}
+                                     for m in req.history])
+    return session
+
+def _chat_messages(req: ChatRequest, session: Optional[ChatSession], turn: str) -> List[Dict[str, str]]:
+    """
+    /api/chat messages for a turn. Earlier messages are identical from turn to turn, so
+    Ollama only evaluates the new one. Without a session the client's history is used.
+    """
+    if session is not None:
+        return chat_sessions.messages(session, turn)
+    history = [{"role": _CHAT_ROLES.get(m.role, "user"), "content": m.text} for m in req.history]
+    return [{"role": "system", "content": _chat_system(req)}] + history + [{"role": "user", "content": turn}]
+
+def _chat_bucket(req: ChatRequest) -> str:
+    """Semantic cache partition: answers are only shared within the same grade, subject and level."""
+    profile = req.user_profile or {}
+    return (f"chat|{profile.get('grade', '')}|{profile.get('subject', '')}|"
+            f"{profile.get('difficultyLevel', '')}").lower()
+
 @app.post("/chat")
 async def chat(req: ChatRequest):
     try:
-        # 1. Retrieve Context (call synchronous search)
-        search_res = search(SearchRequest(query=req.message, limit=3))
-        docs = search_res['results']
-        
-        context_str = "\n\n".join([
-            f"Source: {d.get('source', 'Unknown')} ({d.get('topic', 'General')})\nContent: {d.get('content', '')}"
-            for d in docs
-        ])
-        
-        # 2. Call Ollama
-        # System instruction with Profile
-        profile_txt = ""
-        if req.user_profile:
-            profile_txt = f"""
-            Student Profile:
-            Grade: {req.user_profile.get('grade', 'Unknown')}
-            Subject: {req.user_profile.get('subject', 'Calculus')}
-            Level: {req.user_profile.get('difficultyLevel', 'Medium')}
-            """
-            
-        system_prompt = f"""
-        You are an expert calculus tutor named ClassMate.
-        {profile_txt}
-        
-        Use the following CONTEXT to answer the user's question.
-        If the context has video links, recommend them.
-        If the answer is not in the context, use your general knowledge but mention that it's outside the provided materials.
-        
-        CONTEXT:
-        {context_str}
-        """
+        session = _chat_session(req)
+
+        # 0. Semantic cache (first turn only; later turns depend on the conversation)
+        query_vector = None
+        if semantic_cache and not req.history and (session is None or not session.messages):
+            query_vector = await _query_vector(req.message)
+            with stage("semantic_cache"):
+                hit = semantic_cache.lookup(_chat_bucket(req), query_vector)
+            if hit is not None:
+                logger.info(f"⚡ Semantic cache hit for chat (similarity {hit[1]:.3f})")
+                if session is not None:
+                    chat_sessions.append(session, req.message, hit[0]["response"])
+                return hit[0]
+
+        # 1. Retrieve Context
+        docs = await retrieve(req.message, limit=3, mode=RAG_SEARCH_MODE)
         
-        # Send to Ollama
-        full_prompt = f"{system_prompt}\n\nUser: {req.message}\n\nAssistant:"
-        response_text = await call_ollama(full_prompt)
+        # 2. Call Ollama with the conversation so far plus the new turn
+        turn = _chat_turn(req, docs)
+        messages = _chat_messages(req, session, turn)
+        reply = await call_ollama_chat(messages)
+        response_text = (reply.get("message") or {}).get("content", "")
+        logger.info(f"💬 Chat turn {len(messages) // 2}: {reply.get('prompt_eval_count')} prompt tokens evaluated")
+        if session is not None:
+            chat_sessions.append(session, req.message, response_text)
         
-        return {"response": response_text, "context": docs}
+        result = {"response": response_text, "context": docs}
+        if query_vector is not None:
+            semantic_cache.put(_chat_bucket(req), query_vector, result)
+        return result
 
     except Exception as e:
         logger.error(f"Chat error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest, request: Request):
+    """SSE variant of /chat: a `context` event with the retrieved docs, then tokens."""
+    try:
+        session = _chat_session(req)
+        docs = await retrieve(req.message, limit=3, mode=RAG_SEARCH_MODE)
+        turn = _chat_turn(req, docs)
+        messages = _chat_messages(req, session, turn)
+    except Exception as e:
+        logger.error(f"Chat error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    on_complete = (lambda reply: chat_sessions.append(session, req.message, reply)) if session is not None else None
+    return _stream_generation(request, {"context": docs}, messages=messages, on_complete=on_complete)
+
 @app.get("/topic/{topic_name}")
-async def get_topic_resources(topic_name: str):
-    if not metadata:
-        raise HTTPException(status_code=503, detail="Corpus not loaded")
-    
-    results = []
-    topic_lower = topic_name.lower()
+async def get_topic_resources(
+    topic_name: str,
+    content_type: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1),
+    stream: bool = False
+):
+    """
+    Corpus items whose topic/subtopic matches topic_name, in chapter order.
+    Served from the prebuilt topic index; supports a content_type filter,
+    offset/limit pagination and streaming the JSON as records are decoded.
+    """
+    _require("metadata")
     
-    for item in metadata:
-        # Check topic or subtopic matches
-        if (item.get('topic', '').lower() in topic_lower or 
-            topic_lower in item.get('topic', '').lower() or
-            topic_lower in item.get('subtopic', '').lower()):
-            results.append(item)
-            
-    # Sort by chapter if possible
-    results.sort(key=lambda x: x.get('chapter', 100))
-    return {"results": results}
+    rows = topic_index.lookup(topic_name, content_type)
+    total = len(rows)
+    page = rows[offset:offset + limit] if limit else rows[offset:]
+
+    if stream:
+        def generate():
+            yield '{"total": %d, "results": [' % total
+            for i, row in enumerate(page):
+                yield ("," if i else "") + json.dumps(metadata[int(row)], ensure_ascii=False)
+            yield "]}"
+        return StreamingResponse(generate(), media_type="application/json")
 
-    return {"results": results}
+    return {"total": total, "results": [metadata[int(row)] for row in page]}
 
 class GenerateRequest(BaseModel):
     prompt: str
@@ -276,8 +937,7 @@ async def generate_content(req: GenerateRequest):
 
 @app.post("/predict-mastery")
 async def predict_mastery(req: PredictionRequest):
-    if not ml_engine:
-        raise HTTPException(status_code=503, detail="ML Engine not loaded")
+    _require("ml_engine")
     
     score = ml_engine.predict_mastery(
         user_id=req.user_id,
@@ -290,151 +950,280 @@ async def predict_mastery(req: PredictionRequest):
     )
     return {"mastery_score": score}
 
+def _video_url(doc: Dict[str, Any]) -> Optional[str]:
+    """Embeddable URL of a video chunk (corpus videos keep their link in metadata.url)."""
+    url = doc.get('content') or (doc.get('metadata') or {}).get('url')
+    if url and "youtube.com/watch?v=" in url:
+        url = "https://www.youtube.com/embed/" + url.split("watch?v=", 1)[1].split("&", 1)[0]
+    return url
+
+CHAPTER_INSTRUCTIONS = """You are an expert Calculus tutor. Write a comprehensive study chapter for the topic given below.
+
+Format behavior:
+- Use clear headings (##)
+- Write 4-6 detailed paragraphs explaining the concept.
+- Include 2-3 practical solved examples with step-by-step explanations.
+- End with a brief summary.
+- Output strictly in Markdown format.
+
+Use the context below if relevant, but ensure the explanation is complete and structured."""
+
+def _chapter_prompt(req: ChapterRequest, context_docs: List[Dict[str, Any]]) -> str:
+    context_str = "\n".join([f"- {d['content']}" for d in _pack_context(context_docs, "chapter")])
+    return (f"{CHAPTER_INSTRUCTIONS}\n\n"
+            f"Topic: '{req.topic} - {req.subtopic}'\n"
+            f"Target Audience: {req.difficulty} level student.\n\n"
+            f"Context:\n{context_str}\n")
+
+async def _chapter_video_url(search_query: str, context_docs: List[Dict[str, Any]]) -> str:
+    # Try to find video from RAG sources first, then the best-matching video in the corpus
+    for doc in context_docs:
+        if doc.get('content_type') == 'video' and _video_url(doc):
+            return _video_url(doc)
+    videos = await retrieve(search_query, limit=1, filters={"content_type": "video"})
+    if videos and _video_url(videos[0]):
+        return _video_url(videos[0])
+    
+    # If no video found in RAG, use default fallback video
+    return "https://www.youtube.com/embed/HfACrKJ_Y2w"  # Default calculus playlist
+
+def chapter_fingerprint(context_docs: List[Dict[str, Any]]) -> str:
+    """Version of a chapter: prompt template plus the ids of the context it was written from."""
+    template = _chapter_prompt(ChapterRequest(topic="{topic}", subtopic="{subtopic}", difficulty="{difficulty}"), [])
+    return content_fingerprint(template, [d.get('id') for d in context_docs])
+
+def chapter_is_fresh(entry: Dict[str, Any], fingerprint: str) -> bool:
+    """Whether a cached chapter entry can be served without re-rendering it."""
+    if entry.get("fingerprint") != fingerprint:
+        return False
+    return not CHAPTER_CACHE_TTL or time.time() - entry.get("generated_at", 0) < CHAPTER_CACHE_TTL
+
+async def chapter_context(req: ChapterRequest):
+    """Returns (search_query, context_docs) for a chapter (shared with prerender_chapters.py)."""
+    search_query = CHAPTER_QUERY_TEMPLATE.format(topic=req.topic, subtopic=req.subtopic)
+    return search_query, await retrieve(search_query, limit=10)
+
+async def render_chapter(req: ChapterRequest, search_query: str, context_docs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Generates a chapter with Ollama (shared with prerender_chapters.py)."""
+    # 1. Generate Content
+    content = await call_ollama(_chapter_prompt(req, context_docs))
+
+    # 2. Video Recommendations
+    video_url = await _chapter_video_url(search_query, context_docs)
+
+    # 3. Format RAG sources for transparency
+    return {
+        "title": f"{req.topic}: {req.subtopic}",
+        "content": content,
+        "video_url": video_url,
+        "references": context_docs,
+        "rag_sources": _rag_sources(context_docs[:10])
+    }
+
+def store_chapter(req: ChapterRequest, fingerprint: str, chapter: Dict[str, Any]):
+    _cache_store().put(CHAPTER_NAMESPACE, chapter_cache_key(req.topic, req.subtopic, req.difficulty), {
+        "fingerprint": fingerprint,
+        "generated_at": time.time(),
+        "chapter": chapter
+    })
+
+# Background re-renders in flight (referenced so they are not garbage collected)
+_chapter_refreshes = set()
+
+async def _refresh_chapter(req: ChapterRequest):
+    # Single-flight covers this process; the lease in cache.db keeps the other workers
+    # from re-rendering the same chapter at the same time
+    store = _cache_store()
+    key = chapter_cache_key(req.topic, req.subtopic, req.difficulty)
+    if not await run_in_threadpool(store.claim, CHAPTER_NAMESPACE, key, CHAPTER_REFRESH_LEASE):
+        return
+    try:
+        search_query, context_docs = await chapter_context(req)
+        chapter = await render_chapter(req, search_query, context_docs)
+        await run_in_threadpool(store_chapter, req, chapter_fingerprint(context_docs), chapter)
+        logger.info(f"🔄 Re-rendered cached chapter {req.topic} - {req.subtopic} ({req.difficulty})")
+    except Exception as e:
+        logger.warning(f"Background chapter refresh failed for {req.topic} - {req.subtopic}: {e}")
+    finally:
+        try:
+            await run_in_threadpool(store.release, CHAPTER_NAMESPACE, key)
+        except Exception as e:
+            logger.warning(f"Could not release chapter refresh lease: {e}")
+
+def _schedule_chapter_refresh(req: ChapterRequest):
+    key = flight_key("chapter-refresh", topic=req.topic, subtopic=req.subtopic, difficulty=req.difficulty)
+    task = asyncio.ensure_future(generation_flights.do(key, lambda: _refresh_chapter(req)))
+    _chapter_refreshes.add(task)
+    task.add_done_callback(_chapter_refreshes.discard)
+
+def _cached_chapter(req: ChapterRequest, context_docs: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Cached chapter for the request, or None. Stale chapters (expired, or rendered from
+    another prompt/context) are still returned, and a re-render starts in the background.
+    """
+    try:
+        with stage("chapter_cache"):
+            entry = _cache_store().get(CHAPTER_NAMESPACE, chapter_cache_key(req.topic, req.subtopic, req.difficulty))
+    except Exception as e:
+        logger.warning(f"Chapter cache read error: {e}, falling back to generation")
+        return None
+    if entry is None:
+        return None
+    if not chapter_is_fresh(entry, chapter_fingerprint(context_docs)):
+        _schedule_chapter_refresh(req)
+    return entry["chapter"]
+
 @app.post("/generate_learning_chapter")
 async def generate_learning_chapter(req: ChapterRequest):
+    key = flight_key("chapter", topic=req.topic, subtopic=req.subtopic, difficulty=req.difficulty)
+    return await generation_flights.do(key, lambda: _generate_learning_chapter(req))
+
+async def _generate_learning_chapter(req: ChapterRequest):
     try:
         # 1. RAG Search
-        search_query = f"{req.topic} {req.subtopic} concepts explanation example"
-        search_res = search(SearchRequest(query=search_query, limit=10))
-        context_docs = search_res['results']
-        context_str = "\n".join([f"- {d.get('content', '')}" for d in context_docs])
+        search_query, context_docs = await chapter_context(req)
 
-        # 2. Generate Content
-        prompt = f"""
-        You are an expert Calculus tutor. Write a comprehensive study chapter for the topic: '{req.topic} - {req.subtopic}'.
-        Target Audience: {req.difficulty} level student.
-        
-        Use the following context if relevant, but ensure the explanation is complete and structured:
-        {context_str}
-
-        Format behavior:
-        - Use clear headings (##)
-        - Write 4-6 detailed paragraphs explaining the concept.
-        - Include 2-3 practical solved examples with step-by-step explanations.
-        - End with a brief summary.
-        - Output strictly in Markdown format.
-        """
-        
-        content = await call_ollama(prompt)
-        
-        # 3. Video Recommendations
-        # Try to find video from RAG sources first
-        video_url = None
-        for doc in context_docs:
-            if doc.get('content_type') == 'video' and doc.get('content'):
-                video_url = doc.get('content')
-                break
-        
-        # If no video found in RAG, use default fallback video
-        if not video_url:
-            video_url = "https://www.youtube.com/embed/HfACrKJ_Y2w"  # Default calculus playlist
-        
-        # 4. Format RAG sources for transparency
-        rag_sources = [{
-            'id': d.get('id', str(i)),
-            'topic': d.get('topic', ''),
-            'subtopic': d.get('subtopic', ''),
-            'content': d.get('content', ''),
-            'content_type': d.get('content_type', 'explanation'),
-            'score': d.get('score', 0),
-            'source': d.get('source', 'Unknown')
-        } for i, d in enumerate(context_docs[:10])]
-        
-        return {
+        # 2. Pre-rendered chapter (see prerender_chapters.py)
+        cached = _cached_chapter(req, context_docs)
+        if cached is not None:
+            logger.info(f"✅ Serving cached chapter for {req.topic} - {req.subtopic}")
+            return cached
+
+        # 3. Cache miss - generate and keep it for the next visit
+        chapter = await render_chapter(req, search_query, context_docs)
+        try:
+            await run_in_threadpool(store_chapter, req, chapter_fingerprint(context_docs), chapter)
+        except Exception as e:
+            logger.warning(f"Failed to save chapter to cache: {e}")
+        return chapter
+    except Exception as e:
+        logger.error(f"Chapter generation error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/generate_learning_chapter/stream")
+async def generate_learning_chapter_stream(req: ChapterRequest, request: Request):
+    """
+    SSE variant of /generate_learning_chapter: the first `context` event carries
+    title, video_url, references and rag_sources; the chapter Markdown follows as tokens.
+    A cached chapter arrives as a single `token` event, followed by `done` with cached=true.
+    """
+    try:
+        search_query, context_docs = await chapter_context(req)
+        cached = _cached_chapter(req, context_docs)
+        if cached is not None:
+            first_event = {k: v for k, v in cached.items() if k != "content"}
+
+            async def cached_events():
+                yield _sse("context", first_event)
+                yield _sse("token", {"text": cached["content"]})
+                yield _sse("done", {"cached": True})
+
+            return StreamingResponse(
+                cached_events(),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+
+        first_event = {
             "title": f"{req.topic}: {req.subtopic}",
-            "content": content,
-            "video_url": video_url,
+            "video_url": await _chapter_video_url(search_query, context_docs),
             "references": context_docs,
-            "rag_sources": rag_sources
+            "rag_sources": _rag_sources(context_docs[:10])
         }
     except Exception as e:
         logger.error(f"Chapter generation error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+    fingerprint = chapter_fingerprint(context_docs)
+    return _stream_generation(
+        request, first_event, _chapter_prompt(req, context_docs),
+        on_complete=lambda content: store_chapter(req, fingerprint, {**first_event, "content": content})
+    )
+
 @app.post("/generate_quiz")
 async def generate_quiz(req: QuizRequest):
     """
     Generate or retrieve a cached quiz for the given topic/subtopic.
     Checks cache first for instant loading, falls back to generation if not found.
+    Concurrent identical requests share one generation.
     """
+    key = flight_key("quiz", topic=req.topic, subtopic=req.subtopic,
+                     difficulty=req.difficulty, num_questions=req.num_questions)
+    return await generation_flights.do(key, lambda: _generate_quiz(req))
+
+QUIZ_INSTRUCTIONS = """Create multiple choice quizzes from the context material given below.
+
+Output STRICTLY valid JSON in this format:
+[
+    {
+        "id": 1,
+        "question": "Question text here?",
+        "options": ["A) Option 1", "B) Option 2", "C) Option 3", "D) Option 4"],
+        "correctAnswer": "Option text matching one of the options",
+        "explanation": "Brief explanation of why"
+    }
+]
+Do not include markdown formatting (like ```json), just the raw JSON string."""
+
+def build_quiz_prompt(topic: str, subtopic: str, num_questions: int, difficulty: str,
+                      context_docs: List[Dict[str, Any]], variant: int = 0) -> str:
+    """Quiz generation prompt (shared with generate_quiz_cache.py)."""
+    context_str = "\n".join([f"- {d['content']}" for d in _pack_context(context_docs, "quiz")])
+    variant_txt = f"This is version {variant + 1} of this quiz: ask different questions than other versions.\n" if variant else ""
+    return (f"{QUIZ_INSTRUCTIONS}\n\n"
+            f"Quiz: {num_questions} questions on '{topic} - {subtopic}'.\n"
+            f"Difficulty: {difficulty}.\n"
+            f"{variant_txt}\n"
+            f"Context material:\n{context_str}\n\n"
+            f"Respond with the JSON array only.\n")
+
+def parse_quiz(response_text: str) -> List[Dict[str, Any]]:
+    """Parses the LLM's quiz JSON. Raises json.JSONDecodeError on invalid output."""
+    # Clean response if it contains markdown
+    response_text = response_text.replace("```json", "").replace("```", "").strip()
+    return json.loads(response_text)
+
+def _cached_quiz(req: QuizRequest) -> Optional[Dict[str, Any]]:
+    """Looks up a pre-generated quiz, picking one of QUIZ_CACHE_VARIANTS variants at random."""
+    store = _cache_store()
+    variant = random.randrange(QUIZ_CACHE_VARIANTS) if QUIZ_CACHE_VARIANTS > 1 else 0
+    with stage("quiz_cache"):
+        cached = store.get(QUIZ_NAMESPACE, quiz_cache_key(req.topic, req.subtopic, req.difficulty, variant))
+        if cached is None and variant:
+            cached = store.get(QUIZ_NAMESPACE, quiz_cache_key(req.topic, req.subtopic, req.difficulty))
+    return cached
+
+async def _generate_quiz(req: QuizRequest):
     try:
         # Check cache first
-        cache_key = f"{req.topic}|{req.subtopic}|{req.difficulty}"
-        cache_file = os.path.join(os.path.dirname(__file__), "quiz_cache.json")
-        
-        if os.path.exists(cache_file):
-            try:
-                with open(cache_file, 'r') as f:
-                    cache = json.load(f)
-                
-                if cache_key in cache:
-                    logger.info(f"✅ Serving cached quiz for {req.topic} - {req.subtopic}")
-                    return cache[cache_key]
-            except Exception as e:
-                logger.warning(f"Cache read error: {e}, falling back to generation")
+        cache_key = quiz_cache_key(req.topic, req.subtopic, req.difficulty)
+        try:
+            cached = _cached_quiz(req)
+            if cached is not None:
+                logger.info(f"✅ Serving cached quiz for {req.topic} - {req.subtopic}")
+                return cached
+        except Exception as e:
+            logger.warning(f"Cache read error: {e}, falling back to generation")
         
         # Cache miss - generate on demand
         logger.info(f"⏳ Cache miss, generating quiz for {req.topic} - {req.subtopic}")
         
         # 1. RAG Search
-        search_query = f"{req.topic} {req.subtopic} practice problems quiz"
-        search_res = search(SearchRequest(query=search_query, limit=10))
-        context_docs = search_res['results']
-        context_str = "\n".join([f"- {d.get('content', '')}" for d in context_docs])
+        search_query = QUIZ_QUERY_TEMPLATE.format(topic=req.topic, subtopic=req.subtopic)
+        context_docs = await retrieve(search_query, limit=10)
 
         # 2. Generate Quiz JSON
-        prompt = f"""
-        Create a {req.num_questions}-question multiple choice quiz on '{req.topic} - {req.subtopic}'.
-        Difficulty: {req.difficulty}.
-        
-        Context material:
-        {context_str}
-
-        Output STRICTLY valid JSON in this format:
-        [
-            {{
-                "id": 1,
-                "question": "Question text here?",
-                "options": ["A) Option 1", "B) Option 2", "C) Option 3", "D) Option 4"],
-                "correctAnswer": "Option text matching one of the options",
-                "explanation": "Brief explanation of why"
-            }}
-        ]
-        Do not include markdown formatting (like ```json), just the raw JSON string.
-        """
-        
+        prompt = build_quiz_prompt(req.topic, req.subtopic, req.num_questions, req.difficulty, context_docs)
         response_text = await call_ollama(prompt)
-        # Clean response if it contains markdown
-        response_text = response_text.replace("```json", "").replace("```", "").strip()
-        
-        # Format RAG sources
-        rag_sources = [{
-            'id': d.get('id', str(i)),
-            'topic': d.get('topic', ''),
-            'subtopic': d.get('subtopic', ''),
-            'content': d.get('content', ''),
-            'content_type': d.get('content_type', 'explanation'),
-            'score': d.get('score', 0),
-            'source': d.get('source', 'Unknown')
-        } for i, d in enumerate(context_docs[:10])]
         
         quiz_data = {
-            "quiz": json.loads(response_text),
-            "rag_sources": rag_sources
+            "quiz": parse_quiz(response_text),
+            "rag_sources": _rag_sources(context_docs[:10])
         }
         
         # Save to cache for future use
         try:
-            cache = {}
-            if os.path.exists(cache_file):
-                with open(cache_file, 'r') as f:
-                    cache = json.load(f)
-            
-            cache[cache_key] = quiz_data
-            
-            with open(cache_file, 'w') as f:
-                json.dump(cache, f, indent=2)
-            
+            await run_in_threadpool(_cache_store().put, QUIZ_NAMESPACE, cache_key, quiz_data)
             logger.info(f"💾 Cached quiz for future use: {cache_key}")
         except Exception as e:
             logger.warning(f"Failed to save to cache: {e}")
@@ -520,53 +1309,84 @@ async def generate_diagnostic_quiz(req: DiagnosticRequest):
         ]}
 
 
+def _hint_search_query(req: HintRequest) -> str:
+    return f"{req.topic} {req.subtopic} {req.question_text} hint explanation"
+
+HINT_INSTRUCTIONS = """You are a helpful tutor. A student is stuck on the question below.
+Use the context to provide a helpful hint (NOT the full answer).
+Provide a gentle hint that guides them toward the solution without giving it away completely.
+Keep it concise (2-3 sentences)."""
+
+def _hint_prompt(req: HintRequest, context_docs: List[Dict[str, Any]]) -> str:
+    context_str = "\n".join([f"- {d['content']}" for d in _pack_context(context_docs, "hint")])
+    answer_txt = f"Their answer: {req.user_answer}\n" if req.user_answer else ""
+    return (f"{HINT_INSTRUCTIONS}\n\n"
+            f"Context:\n{context_str}\n\n"
+            f"Question: {req.question_text}\n"
+            f"{answer_txt}")
+
 @app.post("/generate_hint")
 async def generate_hint(req: HintRequest):
     """
     Generates a hint for a quiz question using RAG context.
     Returns the hint text and the RAG sources used for transparency.
+    Concurrent identical requests share one generation.
     """
+    key = flight_key("hint", topic=req.topic, subtopic=req.subtopic,
+                     question_text=req.question_text, user_answer=req.user_answer)
+    return await generation_flights.do(key, lambda: _generate_hint(req))
+
+def _hint_bucket(req: HintRequest) -> str:
+    """Semantic cache partition: hints are only shared within a subtopic and for the same answer."""
+    return f"hint|{req.topic}|{req.subtopic}|{normalize_query(req.user_answer)}".lower()
+
+async def _generate_hint(req: HintRequest):
     try:
+        search_query = _hint_search_query(req)
+
+        # 0. Semantic cache: the same question (up to case and spacing). Matched on the question
+        # alone and only exactly, since questions differing in one expression embed almost identically
+        query_vector = None
+        question_key = normalize_query(req.question_text)
+        if semantic_cache:
+            query_vector = await _query_vector(req.question_text)
+            with stage("semantic_cache"):
+                hit = semantic_cache.lookup(_hint_bucket(req), query_vector, key=question_key)
+            if hit is not None:
+                logger.info(f"⚡ Semantic cache hit for hint (similarity {hit[1]:.3f})")
+                return hit[0]
+
         # 1. RAG Search for relevant context
-        search_query = f"{req.topic} {req.subtopic} {req.question_text} hint explanation"
-        search_res = search(SearchRequest(query=search_query, limit=3))
-        context_docs = search_res['results']
-        context_str = "\n".join([f"- {d.get('content', '')}" for d in context_docs])
+        context_docs = await retrieve(search_query, limit=3, mode=RAG_SEARCH_MODE)
         
         # 2. Generate hint using Ollama
-        prompt = f"""
-        You are a helpful tutor. A student is stuck on this question:
-        
-        Question: {req.question_text}
-        {f"Their answer: {req.user_answer}" if req.user_answer else ""}
-        
-        Use the following context to provide a helpful hint (NOT the full answer):
-        {context_str}
-        
-        Provide a gentle hint that guides them toward the solution without giving it away completely.
-        Keep it concise (2-3 sentences).
-        """
-        
-        hint_text = await call_ollama(prompt)
+        hint_text = await call_ollama(_hint_prompt(req, context_docs))
         
         # 3. Format RAG sources for transparency
-        rag_sources = [{
-            'id': d.get('id', str(i)),
-            'topic': d.get('topic', ''),
-            'subtopic': d.get('subtopic', ''),
-            'content': d.get('content', ''),
-            'content_type': d.get('content_type', 'hint'),
-            'score': d.get('score', 0),
-            'source': d.get('source', 'Unknown')
-        } for i, d in enumerate(context_docs)]
-        
-        return {
+        result = {
             "hint": hint_text,
-            "sources": rag_sources
+            "sources": _rag_sources(context_docs, default_type='hint')
         }
+        if query_vector is not None:
+            semantic_cache.put(_hint_bucket(req), query_vector, result, key=question_key)
+        return result
+    except Exception as e:
+        logger.error(f"Hint generation error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/generate_hint/stream")
+async def generate_hint_stream(req: HintRequest, request: Request):
+    """SSE variant of /generate_hint: a `context` event with the sources, then tokens."""
+    try:
+        context_docs = await retrieve(_hint_search_query(req), limit=3, mode=RAG_SEARCH_MODE)
     except Exception as e:
         logger.error(f"Hint generation error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    return _stream_generation(
+        request,
+        {"sources": _rag_sources(context_docs, default_type='hint')},
+        _hint_prompt(req, context_docs)
+    )
 
 @app.post("/submit_quiz_ml")
 async def submit_quiz_ml(req: QuizSubmissionRequest):
@@ -574,28 +1394,23 @@ async def submit_quiz_ml(req: QuizSubmissionRequest):
     Submits quiz results and uses ML model to predict mastery for each question.
     Returns updated mastery scores.
     """
-    if not ml_engine:
-        raise HTTPException(status_code=503, detail="ML Engine not loaded")
+    _require("ml_engine")
     
     try:
-        mastery_predictions = []
+        # One batched model call for the whole submission (same results as per-question calls)
+        scores = ml_engine.predict_mastery_batch(req.user_id, [{
+            'time_taken': q_data.get('timeTaken', 30),
+            'correct': 1 if q_data.get('correct', False) else 0,
+            'attempt_count': q_data.get('attemptCount', 1),
+            'hint_count': q_data.get('hintCount', 0),
+            'bottom_hint': 0,
+            'scaffold': 0
+        } for q_data in req.questions])
         
-        for q_data in req.questions:
-            # Call ML model for each question
-            mastery_score = ml_engine.predict_mastery(
-                user_id=req.user_id,
-                time_taken=q_data.get('timeTaken', 30),
-                correct=1 if q_data.get('correct', False) else 0,
-                attempt_count=q_data.get('attemptCount', 1),
-                hint_count=q_data.get('hintCount', 0),
-                bottom_hint=0,
-                scaffold=0
-            )
-            
-            mastery_predictions.append({
-                'questionId': q_data.get('questionId'),
-                'masteryScore': mastery_score
-            })
+        mastery_predictions = [{
+            'questionId': q_data.get('questionId'),
+            'masteryScore': mastery_score
+        } for q_data, mastery_score in zip(req.questions, scores)]
         
         # Calculate overall topic mastery (average of all questions)
         avg_mastery = sum(p['masteryScore'] for p in mastery_predictions) / len(mastery_predictions) if mastery_predictions else 0.5
@@ -636,23 +1451,22 @@ async def assess_user_level(req: UserAssessmentRequest):
     
     try:
         # Use ML model to assess based on quiz history
-        mastery_scores = []
-        
+        interactions = []
         for quiz in req.quiz_history[-10:]:  # Last 10 quizzes
             # Simulate quiz interaction for ML model
             score = quiz.get('score', 50) / 100  # Normalize to 0-1
             time_taken = quiz.get('time_taken', 300)  # Default 5 min
             questions = quiz.get('totalQuestions', 5)
             
-            # Predict mastery for this quiz
-            mastery = ml_engine.predict_mastery(
-                user_id=req.user_id,
-                time_taken=time_taken / questions,  # Per question
-                correct=1 if score > 0.7 else 0,
-                attempt_count=1,
-                hint_count=0
-            )
-            mastery_scores.append(mastery)
+            interactions.append({
+                'time_taken': time_taken / questions,  # Per question
+                'correct': 1 if score > 0.7 else 0,
+                'attempt_count': 1,
+                'hint_count': 0
+            })
+        
+        # Predict mastery for all quizzes in one batched model call
+        mastery_scores = ml_engine.predict_mastery_batch(req.user_id, interactions)
         
         # Calculate overall level
         if mastery_scores:
@@ -0,0 +1,70 @@
+"""
+Single-flight coalescing for expensive async work (RAG search + LLM generation).
+
+When a class opens the same chapter or quiz at once, every request would run
+its own retrieval and its own multi-second Ollama call. ``SingleFlight.do``
+runs the work once per key: the first caller starts it as a task and every
+concurrent caller with the same key awaits that task and receives the same
+result (or the same exception). The key is dropped as soon as the task
+finishes, so this never caches completed results.
+
+The shared task is shielded, so a caller that is cancelled (client went away)
+does not cancel the generation the others are waiting on.
+"""
+
+import asyncio
+import json
+from typing import Any, Awaitable, Callable, Dict
+
+from query_cache import normalize_query
+
+
+def flight_key(endpoint: str, **inputs: Any) -> str:
+    """Stable key for an endpoint and its prompt inputs (strings are normalized)."""
+    normalized = {
+        name: normalize_query(value) if isinstance(value, str) else value
+        for name, value in inputs.items()
+    }
+    return f"{endpoint}:{json.dumps(normalized, sort_keys=True, default=str)}"
+
+
+class SingleFlight:
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Awaits ``fn()`` once per key across concurrent callers.
+
+        Args:
+            key: Coalescing key (see ``flight_key``)
+            fn: Zero-argument coroutine factory doing the work
+
+        Returns:
+            The shared result. Callers receive the same object and must not mutate it.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            self.executions += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._done(k, t))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception retrieved even if every waiter was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict:
+        return {
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+        }
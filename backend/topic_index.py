@@ -0,0 +1,171 @@
+"""
+Inverted topic/subtopic index for ``/topic/{topic_name}``.
+
+Built once per metadata file (see corpus_indexes.py). Every distinct normalized topic and subtopic
+value gets a posting list of chunk positions, pre-sorted in chapter order, and
+the values themselves are indexed by character trigrams so substring queries
+only look at values that can match. A lookup therefore touches the matching
+values and their postings instead of scanning every chunk. The postings are
+stored with the other corpus indexes and mmapped; only the trigram index over
+the (few) distinct values is rebuilt on load.
+
+Matching is the same as the original scan: a chunk matches when its topic is
+contained in the query, or the query is contained in its topic or subtopic.
+"""
+
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+GRAM = 3
+
+
+def _grams(text: str) -> Set[str]:
+    return {text[i:i + GRAM] for i in range(len(text) - GRAM + 1)}
+
+
+class _ValueIndex:
+    """Distinct field values -> chapter-ordered postings, with a trigram index over the values."""
+
+    def __init__(self, postings: Dict[str, np.ndarray]):
+        self.postings = postings
+        self.grams: Dict[str, Set[str]] = defaultdict(set)
+        for value in postings:
+            for gram in _grams(value):
+                self.grams[gram].add(value)
+
+    def containing(self, query: str) -> List[str]:
+        """Values that contain ``query`` as a substring."""
+        if len(query) < GRAM:
+            return [v for v in self.postings if query in v]
+        candidates = None
+        # Intersect the rarest gram sets first
+        for gram in sorted(_grams(query), key=lambda g: len(self.grams.get(g, ()))):
+            values = self.grams.get(gram)
+            if not values:
+                return []
+            candidates = set(values) if candidates is None else candidates & values
+            if not candidates:
+                return []
+        return [v for v in candidates if query in v]
+
+
+class TopicBuilder:
+    """Collects the fields the topic index needs, record by record in FAISS row order."""
+
+    def __init__(self):
+        self.chapters = []
+        self.topics = []
+        self.subtopics = []
+        self.content_types = []
+
+    def add(self, item: Dict):
+        self.chapters.append(item.get('chapter', 100))
+        self.topics.append((item.get('topic') or '').lower())
+        self.subtopics.append((item.get('subtopic') or '').lower())
+        self.content_types.append(item.get('content_type') or '')
+
+    def build(self) -> "TopicIndex":
+        chapters = self.chapters
+        # Stable chapter sort, same order as the original results.sort(key=chapter)
+        order = np.array(
+            sorted(range(len(chapters)), key=lambda i: chapters[i] if chapters[i] is not None else 100),
+            dtype=np.int64
+        )
+        type_values = sorted(set(self.content_types))
+        type_codes = {value: code for code, value in enumerate(type_values)}
+        codes = np.array([type_codes[t] for t in self.content_types], dtype=np.int32)[order]
+
+        postings = ({}, {})
+        for rank, row in enumerate(order):
+            postings[0].setdefault(self.topics[row], []).append(rank)
+            postings[1].setdefault(self.subtopics[row], []).append(rank)
+        topics, subtopics = ({value: np.asarray(ranks, dtype=np.int64) for value, ranks in field.items()}
+                             for field in postings)
+        return TopicIndex(order, codes, type_values, topics, subtopics)
+
+
+def _csr(postings: Dict[str, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    lengths = [len(ranks) for ranks in postings.values()]
+    indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    ranks = np.concatenate(list(postings.values())) if postings else np.empty(0, dtype=np.int64)
+    return indptr, ranks
+
+
+class TopicIndex:
+    def __init__(self, order: np.ndarray, content_type_codes: np.ndarray, content_types: List[str],
+                 topics: Dict[str, np.ndarray], subtopics: Dict[str, np.ndarray]):
+        """
+        Args:
+            order: FAISS row ids in chapter order (a chunk's position here is its rank)
+            content_type_codes: Index into ``content_types`` for every rank
+            content_types: Distinct content types
+            topics: Normalized topic -> sorted ranks
+            subtopics: Normalized subtopic -> sorted ranks
+        """
+        self.order = order
+        self._content_type_codes = content_type_codes
+        self._content_types = {value: code for code, value in enumerate(content_types)}
+        self._topics = _ValueIndex(topics)
+        self._subtopics = _ValueIndex(subtopics)
+        self._topic_lengths = sorted({len(v) for v in self._topics.postings})
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict]) -> "TopicIndex":
+        """Builds the index from metadata records in FAISS row order."""
+        builder = TopicBuilder()
+        for item in records:
+            builder.add(item)
+        return builder.build()
+
+    def state(self) -> Tuple[Dict[str, np.ndarray], Dict]:
+        """Arrays (postings in CSR form) and the value lists, for ``from_state``."""
+        arrays = {"order": self.order, "content_type_codes": self._content_type_codes}
+        fields = {"content_types": sorted(self._content_types, key=self._content_types.get)}
+        for name, field in (("topics", self._topics), ("subtopics", self._subtopics)):
+            arrays[f"{name}.indptr"], arrays[f"{name}.ranks"] = _csr(field.postings)
+            fields[name] = list(field.postings)
+        return arrays, fields
+
+    @classmethod
+    def from_state(cls, arrays: Dict[str, np.ndarray], fields: Dict) -> "TopicIndex":
+        postings = []
+        for name in ("topics", "subtopics"):
+            indptr, ranks = arrays[f"{name}.indptr"], arrays[f"{name}.ranks"]
+            postings.append({value: ranks[indptr[i]:indptr[i + 1]] for i, value in enumerate(fields[name])})
+        return cls(arrays["order"], arrays["content_type_codes"], fields["content_types"], *postings)
+
+    def _topics_within(self, query: str) -> List[str]:
+        """Topic values that occur inside the query (checked by sliding each distinct value length)."""
+        found = []
+        for length in self._topic_lengths:
+            if length > len(query):
+                break
+            seen = {query[i:i + length] for i in range(len(query) - length + 1)}
+            found.extend(v for v in seen if v in self._topics.postings)
+        return found
+
+    def lookup(self, topic_name: str, content_type: Optional[str] = None) -> np.ndarray:
+        """
+        Returns the matching FAISS row ids in chapter order.
+
+        Args:
+            topic_name: Topic or subtopic text from the request
+            content_type: Optional filter (video, explanation, problem, ...)
+        """
+        query = topic_name.lower()
+        postings = [self._topics.postings[v] for v in set(self._topics_within(query))]
+        postings += [self._topics.postings[v] for v in self._topics.containing(query)]
+        postings += [self._subtopics.postings[v] for v in self._subtopics.containing(query)]
+        if not postings:
+            return np.empty(0, dtype=np.int64)
+
+        ranks = np.unique(np.concatenate(postings))
+        if content_type:
+            code = self._content_types.get(content_type)
+            if code is None:
+                return np.empty(0, dtype=np.int64)
+            ranks = ranks[self._content_type_codes[ranks] == code]
+        return self.order[ranks]
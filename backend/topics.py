@@ -0,0 +1,99 @@
+"""
+Topic lists and the RAG query templates built from them.
+
+The generation endpoints and the offline scripts (quiz pre-generation,
+precomputed retrieval) share these so their search queries are identical.
+"""
+
+# Topics to generate quizzes for
+CALCULUS_TOPICS = {
+    "Limits": ["Basic Limit Concept", "Limit Laws", "Continuity", "Infinite Limits"],
+    "Derivatives": ["Definition of Derivative", "Derivative Rules", "Chain Rule", "Implicit Differentiation"],
+    "Integration": ["Antiderivatives", "Definite Integrals", "Substitution", "Integration by Parts"],
+    "Applications": ["Optimization", "Related Rates", "Area Between Curves", "Volume of Revolution"],
+    "Series": ["Sequences", "Geometric Series", "Convergence Tests", "Power Series"]
+}
+
+# Chapter/section structure used by the frontend (keep in sync with src/constants/topics.ts)
+CURRICULUM_TOPICS = {
+    "Chapter 1: Functions and Graphs": [
+        "Review of Functions",
+        "Basic Classes of Functions",
+        "Trigonometric Functions",
+        "Inverse Functions",
+        "Exponential and Logarithmic Functions"
+    ],
+    "Chapter 2: Limits": [
+        "A Preview of Calculus",
+        "The Limit of a Function",
+        "The Limit Laws",
+        "Continuity",
+        "The Precise Definition of a Limit"
+    ],
+    "Chapter 3: Derivatives": [
+        "Defining the Derivative",
+        "The Derivative as a Function",
+        "Differentiation Rules",
+        "Derivatives as Rates of Change",
+        "Derivatives of Trigonometric Functions",
+        "The Chain Rule",
+        "Derivatives of Inverse Functions",
+        "Implicit Differentiation",
+        "Derivatives of Exponential and Logarithmic Functions"
+    ],
+    "Chapter 4: Applications of Derivatives": [
+        "Related Rates",
+        "Linear Approximations and Differentials",
+        "Maxima and Minima",
+        "The Mean Value Theorem",
+        "Derivatives and the Shape of a Graph",
+        "Limits at Infinity and Asymptotes",
+        "Applied Optimization Problems",
+        "L’Hôpital’s Rule",
+        "Newton’s Method",
+        "Antiderivatives"
+    ],
+    "Chapter 5: Integration": [
+        "Approximating Areas",
+        "The Definite Integral",
+        "The Fundamental Theorem of Calculus",
+        "Integration Formulas and the Net Change Theorem",
+        "Substitution",
+        "Integrals Involving Exponential and Logarithmic Functions",
+        "Integrals Resulting in Inverse Trigonometric Functions"
+    ],
+    "Chapter 6: Applications of Integration": [
+        "Areas between Curves",
+        "Determining Volumes by Slicing",
+        "Volumes of Revolution: Cylindrical Shells",
+        "Arc Length of a Curve and Surface Area",
+        "Physical Applications",
+        "Moments and Centers of Mass",
+        "Integrals, Exponential Functions, and Logarithms",
+        "Exponential Growth and Decay",
+        "Calculus of the Hyperbolic Functions"
+    ]
+}
+
+# RAG search queries used by /generate_learning_chapter and /generate_quiz
+CHAPTER_QUERY_TEMPLATE = "{topic} {subtopic} concepts explanation example"
+QUIZ_QUERY_TEMPLATE = "{topic} {subtopic} practice problems quiz"
+QUERY_TEMPLATES = [CHAPTER_QUERY_TEMPLATE, QUIZ_QUERY_TEMPLATE]
+
+
+def topic_pairs():
+    """Yields every (topic, subtopic) pair from both topic lists, without duplicates."""
+    seen = set()
+    for topics in (CALCULUS_TOPICS, CURRICULUM_TOPICS):
+        for topic, subtopics in topics.items():
+            for subtopic in subtopics:
+                if (topic, subtopic) not in seen:
+                    seen.add((topic, subtopic))
+                    yield topic, subtopic
+
+
+def template_queries():
+    """All template queries the generators can issue."""
+    return [template.format(topic=topic, subtopic=subtopic)
+            for topic, subtopic in topic_pairs()
+            for template in QUERY_TEMPLATES]
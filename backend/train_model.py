@@ -5,11 +5,13 @@ from sklearn.ensemble import RandomForestRegressor
 from sklearn.metrics import mean_squared_error, r2_score
 import joblib
 import os
+from forest_predictor import export_forest
 
 # Define paths
 BASE_DIR = os.path.dirname(__file__)
 MODEL_PATH = os.path.join(BASE_DIR, "mastery_model.pkl")
 FEATURES_PATH = os.path.join(BASE_DIR, "model_features.pkl")
+FOREST_PATH = os.path.join(BASE_DIR, "mastery_model.npz")
 
 def generate_synthetic_data(n_samples=5000):
     """
@@ -99,8 +101,12 @@ def train_model():
     joblib.dump(model, MODEL_PATH)
     joblib.dump(features, FEATURES_PATH)
     
+    # 7. Export flattened trees for the NumPy-only predictor used by the server
+    export_forest(model, FOREST_PATH, feature_names=features)
+    
     print(f"Model saved to: {MODEL_PATH}")
     print(f"Features saved to: {FEATURES_PATH}")
+    print(f"Compiled forest saved to: {FOREST_PATH}")
 
 if __name__ == "__main__":
     train_model()